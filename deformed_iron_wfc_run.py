@@ -20,13 +20,13 @@ img = Image.open("images/samples/IPF-X.png")
 dir(img)
 
 resized = img.resize((32, 32))
-reduced = resized.convert('P', palette=Image.ADAPTIVE, colors=6)
-image = reduced.convert("RGB")
+image = resized.convert("RGB")
 
 import wfc.wfc_control as wfc_control
 
 result = wfc_control.execute_wfc(
                             image = np.array(image),
+                            colors=6,  # or pattern_budget=... for the most colors that stay within it
                             # filename="IPF-X",
                             tile_size=2,
                             pattern_width=1,
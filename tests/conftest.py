@@ -1,7 +1,12 @@
 from __future__ import annotations
 
 import os.path
+import imageio  # type: ignore
+import numpy as np
 import pytest
+from numpy.typing import NDArray
+from wfc import wfc_solver
+from wfc.wfc_model import WFCModel, compile_model
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 
@@ -12,4 +17,26 @@ class Resources:
 
 @pytest.fixture(scope="session")
 def resources() -> Resources:
-    return Resources()
\ No newline at end of file
+    return Resources()
+
+
+@pytest.fixture(scope="session")
+def knot_model(resources: Resources) -> WFCModel:
+    """Knot with 3x3 patterns in every rotation, big enough for the solver to backtrack and contradict."""
+    image = imageio.imread(resources.get_image("samples/Knot.png"))[:, :, :3]
+    return compile_model(image, pattern_width=3, rotations=7)
+
+
+def solution_wave(model: WFCModel, solution: NDArray[np.integer]) -> NDArray[np.bool_]:
+    """The wave with only the solution's pattern left in each cell."""
+    wave = np.zeros((model.number_of_patterns,) + solution.shape, dtype=np.bool_)
+    np.put_along_axis(wave, solution[None], True, axis=0)
+    return wave
+
+
+def is_consistent(model: WFCModel, solution: NDArray[np.integer], periodic: bool = True) -> bool:
+    """Whether every pattern of the solution may be next to its neighbours."""
+    try:
+        return wfc_solver.propagate(solution_wave(model, solution), model.adjacency_matrices(), periodic=periodic) == 0
+    except wfc_solver.Contradiction:
+        return False
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import imageio  # type: ignore
+import numpy as np
+import pytest
+from tests.conftest import Resources
+from wfc import wfc_async
+from wfc.wfc_model import compile_model
+
+
+def test_generate_many(resources: Resources) -> None:
+    image = imageio.imread(resources.get_image("samples/Red Maze.png"))[:, :, :3]
+    model = compile_model(image, pattern_width=2, rotations=7)
+    jobs = [{"model": model, "output_size": (8, 8)} for _ in range(3)] + [{"model": model, "image": image}]
+
+    results = asyncio.run(wfc_async.generate_many(jobs, concurrency=2))
+    for result in results[:3]:
+        assert isinstance(result, np.ndarray)
+        assert result.shape == (8, 8, 3)
+    #a model and an image together is refused, without failing the other jobs
+    assert isinstance(results[3], TypeError)
+
+
+def test_cancel(resources: Resources) -> None:
+    image = imageio.imread(resources.get_image("samples/Flowers.png"))[:, :, :3]
+    model = compile_model(image, pattern_width=3, rotations=1, ground=-4)
+
+    async def cancelled_solve() -> float:
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(wfc_async.execute_wfc_async(model=model, output_size=(200, 200)), 0.5)
+        return time.perf_counter()
+
+    time_begin = time.perf_counter()
+    time_cancelled = asyncio.run(cancelled_solve())
+    #the solve takes far longer than this, so it must have been stopped
+    assert time_cancelled - time_begin < 10
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import imageio  # type: ignore
+import numpy as np
+import pytest
+from tests.conftest import Resources
+from wfc import wfc_constraints
+from wfc import wfc_control
+from wfc import wfc_solver
+from wfc.wfc_model import compile_model
+
+
+def test_ground_constraints(resources: Resources) -> None:
+    image = imageio.imread(resources.get_image("samples/Flowers.png"))[:, :, :3]
+    model = compile_model(image, pattern_width=3, rotations=1, ground=-4)
+    wave = np.ones((model.number_of_patterns, 10, 12), dtype=np.bool_)
+    wfc_constraints.apply_constraints(wave, wfc_constraints.ground_constraints(model, (10, 12)))
+    assert (wave == wfc_solver.makeWave(model.number_of_patterns, 10, 12, ground=model.ground)).all()
+
+
+def test_constrained_run(resources: Resources) -> None:
+    image = imageio.imread(resources.get_image("samples/Red Maze.png"))[:, :, :3]
+    model = compile_model(image, pattern_width=2, rotations=7)
+    size = (16, 16)
+    red = wfc_constraints.patterns_showing(model, [255, 0, 0])
+    white = wfc_constraints.patterns_showing(model, [255, 255, 255])
+    constraints = [
+        wfc_constraints.allow(wfc_constraints.region_cells(size, [(10, 5)]), red),
+        wfc_constraints.forbid(wfc_constraints.region_columns(size, 4, 8), white),
+    ]
+    np.random.seed(0)
+    result = wfc_control.execute_wfc(model=model, output_size=size, constraints=constraints, output_periodic=False)
+    assert not isinstance(result, tuple)
+    assert (result[10, 5] == [255, 0, 0]).all()
+    assert not (result[4:8] == 255).all(axis=2).any()
+
+    #compiled once, then served from the model's cache
+    domain = wfc_constraints.compile_domain(model, size, constraints, periodic=False)
+    assert wfc_constraints.compile_domain(model, size, constraints, periodic=False) is domain
+    wave = wfc_constraints.unpack_domain(domain, model.number_of_patterns)
+    assert not wave[white][:, 4:8].any()
+
+    nothing = np.zeros(model.number_of_patterns, dtype=np.bool_)
+    with pytest.raises(wfc_solver.Contradiction):
+        wfc_control.execute_wfc(
+            model=model, output_size=size, constraints=[wfc_constraints.allow(wfc_constraints.region_cells(size, [(3, 3)]), nothing)]
+        )
+
+
+def test_region_border() -> None:
+    border = wfc_constraints.region_border((5, 4))
+    assert border.shape == (5, 4)
+    assert border.sum() == 5 * 4 - 3 * 2 and not border[1:-1, 1:-1].any()
+    assert wfc_constraints.region_border((5, 4), 2).all()  # Every column is within 2 of an edge
+    assert not wfc_constraints.region_border((5, 4), 0).any()
+    assert wfc_constraints.region_border((5, 4), 10).all()
+    assert wfc_constraints.region_border((6, 6), 2).sum() == 6 * 6 - 2 * 2
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import imageio  # type: ignore
+import pytest
+from tests.conftest import Resources
+from wfc import wfc_control, wfc_visualize
+from wfc.wfc_model import compile_model
+from wfc.wfc_solver import StopEarly
+
+
+def test_import_is_lightweight() -> None:
+    """Headless runs and pool workers should not pay for plotting, image I/O or scipy at import."""
+    heavy = ["matplotlib", "scipy", "imageio", "hilbertcurve", "PIL"]
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, wfc.wfc_control, wfc.wfc_model, wfc.wfc_visualize; print([m for m in {heavy!r} if m in sys.modules])",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    assert loaded == "[]"
+
+
+def test_stopped_solve_shuts_down_render_pool(resources: Resources, tmp_path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("visualization")
+    # Only the solver frames are of interest here, not the figures of the model
+    monkeypatch.setattr(wfc_control, "figure_pattern_catalog", lambda *args, **kwargs: None)
+    monkeypatch.setattr(wfc_control, "figure_adjacencies", lambda *args, **kwargs: None)
+    renderers = []
+    drain = wfc_visualize.AsyncFrameRenderer.drain
+
+    def recorded_drain(self):
+        renderers.append((self, self.executor is not None))
+        return drain(self)
+
+    monkeypatch.setattr(wfc_visualize.AsyncFrameRenderer, "drain", recorded_drain)
+    image = imageio.imread(resources.get_image("samples/Red Maze.png"))[:, :, :3]
+    steps = iter(range(2))
+    with pytest.raises(StopEarly):
+        wfc_control.execute_wfc(
+            "Red Maze",
+            model=compile_model(image),
+            output_size=(8, 8),
+            visualize=True,
+            visualize_workers=1,
+            should_stop=lambda: next(steps, None) is None,
+        )
+    [(renderer, was_running)] = renderers
+    assert was_running and renderer.executor is None
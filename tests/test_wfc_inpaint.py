@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import imageio  # type: ignore
+import numpy as np
+from tests.conftest import Resources, is_consistent
+from wfc import wfc_control
+from wfc import wfc_inpaint
+from wfc.wfc_model import compile_model
+
+
+def test_region_window() -> None:
+    mask = np.zeros((10, 8), dtype=np.bool_)
+    mask[0:2, 3:5] = True
+    window, wraps = wfc_inpaint.region_window(mask, 1, periodic=False)
+    assert window is not None
+    xs, ys = window
+    assert list(xs) == [0, 1, 2] and list(ys) == [2, 3, 4, 5] and not wraps
+    window, wraps = wfc_inpaint.region_window(mask, 1, periodic=True)
+    assert window is not None
+    xs, ys = window
+    assert list(xs) == [9, 0, 1, 2] and not wraps
+    window, wraps = wfc_inpaint.region_window(mask, 4, periodic=True)
+    assert window is not None
+    xs, ys = window
+    assert len(xs) == 10 and len(ys) == 8 and wraps
+    assert wfc_inpaint.region_window(np.zeros((10, 8), dtype=np.bool_), 1, periodic=True) == (None, False)
+
+
+def test_resolve_region(resources: Resources) -> None:
+    image = imageio.imread(resources.get_image("samples/Flowers.png"))[:, :, :3]
+    model = compile_model(image, pattern_width=3, rotations=1, ground=-4)
+    np.random.seed(1)
+    _, solution = wfc_control.execute_wfc(model=model, output_size=(24, 24), return_solution=True)
+    assert is_consistent(model, solution, periodic=True)
+
+    mask = np.zeros(solution.shape, dtype=np.bool_)
+    mask[5:12, 18:24] = True  # Includes the ground row
+    repainted = wfc_inpaint.resolve_region(model, solution, mask, attempt_limit=20)
+    assert (repainted[~mask] == solution[~mask]).all()
+    assert is_consistent(model, repainted, periodic=True)
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from wfc import wfc_memory
+from wfc import wfc_solver
+
+
+def test_estimate_covers_propagate() -> None:
+    #every pattern fits next to itself and to a third of the others
+    compatible = (np.add.outer(np.arange(30), np.arange(30)) % 3) == 0
+    adjLists = {d: [np.nonzero(row)[0] for row in compatible] for d in [(1, 0), (-1, 0), (0, 1), (0, -1)]}
+    adj = wfc_solver.makeAdj(adjLists)
+    wave = wfc_solver.makeWave(30, 40, 40)
+    wave[1:, 0, 0] = False
+
+    estimate = wfc_memory.estimate_solver_memory(30, (40, 40))
+    with wfc_memory.PeakMemory() as peak:
+        wfc_solver.propagate(wave, adj, periodic=True)
+    assert 0 < peak.peak <= estimate["propagate"] + estimate["heuristics"]
+
+
+def test_plan_memory() -> None:
+    wave_bytes = 100 * 64 * 64
+    plan = wfc_memory.plan_memory("4G", 100, (64, 64), backtracking=True)
+    assert plan["backtracking"] and plan["history_limit"] is None
+
+    budget = 40 * wave_bytes
+    plan = wfc_memory.plan_memory(budget, 100, (64, 64), backtracking=True, visualize=True)
+    assert plan["backtracking"]
+    assert not plan["visualize"]
+    history_limit = plan["history_limit"]
+    assert history_limit is not None and 1 <= history_limit < 40
+    assert plan["estimate"]["total"] <= budget
+
+    with pytest.raises(wfc_memory.MemoryBudgetExceeded):
+        wfc_memory.plan_memory(budget, 100, (64, 64), backtracking=True, policy="raise")
+    with pytest.raises(wfc_memory.MemoryBudgetExceeded):
+        wfc_memory.plan_memory("1M", 100, (64, 64))
+    assert wfc_memory.parse_size("1.5K") == 1536
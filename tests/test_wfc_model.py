@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import json
+import os
+import imageio  # type: ignore
+import numpy as np
+import pytest
+from tests.conftest import Resources
+from wfc import wfc_constraints
+from wfc import wfc_control
+from wfc import wfc_model
+from wfc import wfc_patterns
+from wfc import wfc_solver
+from wfc import wfc_tiles
+
+
+def test_compile_model(resources: Resources) -> None:
+    filename = resources.get_image("samples/Red Maze.png")
+    img = imageio.imread(filename)
+    model = wfc_model.compile_model(img, tile_size=1, pattern_width=2, rotations=0)
+    assert model.adjacency.shape == (4, model.number_of_patterns, model.number_of_patterns)
+    assert model.tile_atlas.shape == (len(model.tile_ids), 1, 1, img.shape[2])
+    assert (model.weights > 0).all()
+    assert ((1, 0), -3950451988873469076, -3950451988873469076) in model.adjacency_relations()
+    assert not ((0, 1), -3950451988873469076, -3950451988873469076) in model.adjacency_relations()
+
+
+def test_save_and_load_model(resources: Resources, tmp_path) -> None:
+    filename = resources.get_image("samples/Red Maze.png")
+    img = imageio.imread(filename)
+    model = wfc_model.compile_model(img, tile_size=1, pattern_width=2, ground=-1)
+    model_dir = str(tmp_path / "red_maze")
+    model.save(model_dir)
+
+    loaded = wfc_model.WFCModel.load(model_dir)
+    assert isinstance(loaded.pattern_contents, np.memmap)
+    assert np.array_equal(loaded.pattern_ids, model.pattern_ids)
+    assert np.array_equal(loaded.pattern_contents, model.pattern_contents)
+    assert np.array_equal(loaded.weights, model.weights)
+    assert np.array_equal(loaded.adjacency, model.adjacency)
+    assert np.array_equal(loaded.tile_atlas, model.tile_atlas)
+    assert loaded.ground is not None and model.ground is not None
+    assert np.array_equal(loaded.ground, model.ground)
+    assert loaded.metadata["pattern_width"] == 2
+
+    wave = wfc_solver.makeWave(loaded.number_of_patterns, 6, 6)
+    solution = wfc_solver.run(
+        wave,
+        loaded.adjacency_matrices(),
+        locationHeuristic=wfc_solver.lexicalLocationHeuristic,
+        patternHeuristic=wfc_solver.lexicalPatternHeuristic,
+        periodic=True,
+        backtracking=True,
+    )
+    assert solution.shape == (6, 6)
+
+
+def test_load_model_version_mismatch(resources: Resources, tmp_path) -> None:
+    filename = resources.get_image("samples/Red Maze.png")
+    img = imageio.imread(filename)
+    model_dir = str(tmp_path / "red_maze")
+    wfc_model.compile_model(img).save(model_dir)
+
+    header_path = os.path.join(model_dir, wfc_model.MODEL_HEADER)
+    with open(header_path, encoding="utf_8") as headerf:
+        header = json.load(headerf)
+    header["version"] = wfc_model.MODEL_FORMAT_VERSION + 1
+    with open(header_path, "w", encoding="utf_8") as headerf:
+        json.dump(header, headerf)
+
+    with pytest.raises(wfc_model.ModelFormatError):
+        wfc_model.WFCModel.load(model_dir)
+    with pytest.raises(wfc_model.ModelFormatError):
+        wfc_model.WFCModel.load(str(tmp_path / "missing"))
+
+
+def test_solution_to_image(resources: Resources) -> None:
+    filename = resources.get_image("samples/Red Maze.png")
+    img = imageio.imread(filename)
+    model = wfc_model.compile_model(img, tile_size=1, pattern_width=2, rotations=0)
+    _tile_catalog, tile_grid, _code_list, _unique_tiles = wfc_tiles.make_tile_catalog(img, 1)
+    _patterns_in_grid, _pattern_contents_list, patch_codes = wfc_patterns.unique_patterns_2d(
+        tile_grid, 2, True
+    )
+    solution = np.searchsorted(model.pattern_ids, patch_codes)
+    assert np.array_equal(model.solution_to_image(solution), img)
+
+
+def test_supported_patterns() -> None:
+    #0 needs 1 to its right, 1 needs 2 and 2 nothing can follow; 3 can follow itself in every direction
+    adjacency = np.zeros((4, 4, 4), dtype=np.bool_)
+    adjacency[:, 3, 3] = True
+    adjacency[:, [0, 1, 2], [0, 1, 2]] = True
+    right = wfc_model.CARDINAL_DIRECTIONS.index((1, 0))
+    adjacency[right, :3, :3] = False
+    adjacency[right, 0, 1] = adjacency[right, 1, 2] = True
+    assert wfc_model.supported_patterns(adjacency).tolist() == [False, False, False, True]
+    adjacency[right, 2, 0] = True
+    assert wfc_model.supported_patterns(adjacency).all()
+
+
+def test_prune_unsupported_patterns(resources: Resources, monkeypatch: pytest.MonkeyPatch) -> None:
+    img = imageio.imread(resources.get_image("samples/Red Maze.png"))
+    unpruned = wfc_model.compile_model(img, pattern_width=2, rotations=0, ground=-1, prune=False)
+    #the patterns are taken from the wrapped input, so every one of them has its real neighbours
+    model = wfc_model.compile_model(img, pattern_width=2, rotations=0, ground=-1)
+    assert model.metadata["pruned patterns"] == 0
+    assert model.number_of_patterns == unpruned.number_of_patterns
+
+    extract = wfc_model.adjacency_extraction
+    dead = unpruned.pattern_ids[0]
+
+    def without_right_neighbours(*args, **kwargs):
+        return [(d, p1, p2) for d, p1, p2 in extract(*args, **kwargs) if not (d == (1, 0) and p1 == dead)]
+
+    monkeypatch.setattr(wfc_model, "adjacency_extraction", without_right_neighbours)
+    model = wfc_model.compile_model(img, pattern_width=2, rotations=0, ground=-1)
+    pruned = model.metadata["pruned patterns"]
+    assert pruned >= 1 and model.number_of_patterns == unpruned.number_of_patterns - pruned
+    assert dead not in model.pattern_ids.tolist()
+    assert wfc_model.supported_patterns(model.adjacency).all()
+    index = {p: i for i, p in enumerate(unpruned.pattern_ids.tolist())}
+    kept = np.array([index[p] for p in model.pattern_ids.tolist()])
+    assert np.array_equal(model.weights, unpruned.weights[kept])
+    assert np.array_equal(model.pattern_tile_indices, unpruned.pattern_tile_indices[kept])
+    assert model.ground is not None and np.isin(unpruned.pattern_ids[unpruned.ground], model.pattern_ids[model.ground]).any()
+
+    #a non-periodic output may place a pattern whose only right neighbour is dead on its right edge,
+    #so nothing is pruned
+    leaning = next(p1 for d, p1, p2 in unpruned.adjacency_relations() if d == (1, 0) and p2 == dead and p1 != dead)
+
+    def leaning_on_dead(*args, **kwargs):
+        relations = without_right_neighbours(*args, **kwargs)
+        return [(d, p1, p2) for d, p1, p2 in relations if not (d == (1, 0) and p1 == leaning and p2 != dead)]
+
+    monkeypatch.setattr(wfc_model, "adjacency_extraction", leaning_on_dead)
+    assert wfc_model.compile_model(img, pattern_width=2, rotations=0, ground=-1).metadata["pruned patterns"] >= 2
+    model = wfc_model.compile_model(img, pattern_width=2, rotations=0, ground=-1, output_periodic=False)
+    assert model.metadata["pruned patterns"] == 0 and model.number_of_patterns == unpruned.number_of_patterns
+    wave = np.ones((model.number_of_patterns, 6, 6), dtype=np.bool_)
+    wave[:, 5, 2] = model.pattern_ids == leaning
+    assert wfc_solver.propagate(wave.copy(), model.adjacency_matrices(), periodic=False) > 0
+    with pytest.raises(wfc_solver.Contradiction):
+        wfc_solver.propagate(wave.copy(), model.adjacency_matrices(), periodic=True)
+
+    #without any pattern that can be surrounded, there is no need to start an attempt
+    monkeypatch.setattr(wfc_model, "adjacency_extraction", lambda *args, **kwargs: [])
+    with pytest.raises(wfc_solver.Contradiction):
+        wfc_model.compile_model(img, pattern_width=2, rotations=0)
+    assert wfc_model.compile_model(img, pattern_width=2, rotations=0, output_periodic=False).number_of_patterns > 0
+
+
+def test_pattern_classes() -> None:
+    adjacency = np.ones((4, 4, 4), dtype=np.bool_)
+    adjacency[:, 3, 0] = False
+    adjacency[:, 0, 3] = False
+    #3 can not be next to 0, so neither can be merged with 1 and 2; ground splits 1 from 2
+    assert wfc_model.pattern_classes(adjacency).tolist() == [0, 1, 1, 2]
+    assert wfc_model.pattern_classes(adjacency, np.array([1])).tolist() == [0, 1, 2, 3]
+
+    classes = np.array([0, 1, 1, 2])
+    wave = np.zeros((4, 2, 3), dtype=np.bool_)
+    wave[2, 0, 0] = wave[[1, 2], 1, 2] = wave[3, 1, 1] = True
+    class_wave = wfc_model.compress_wave(wave, classes)
+    assert class_wave.shape == (3, 2, 3)
+    assert class_wave[1, 0, 0] and class_wave[1, 1, 2] and class_wave[2, 1, 1] and class_wave.sum() == 3
+
+    np.random.seed(0)
+    solution = np.array([[1, 0, 1], [0, 2, 1]])
+    expanded = wfc_model.expand_solution(solution, classes, np.array([1.0, 1.0, 1.0, 1.0]), wave)
+    assert expanded[0, 0] == 2 and expanded[0, 1] == 0 and expanded[1, 1] == 3
+    assert np.isin(expanded[[0, 1], [2, 2]], [1, 2]).all()
+    assert np.array_equal(classes[expanded], solution)
+
+
+def test_compressed_model(resources: Resources) -> None:
+    img = imageio.imread(resources.get_image("samples/Red Maze.png"))[:, :, :3]
+    #single pixel patterns have no overlap to disagree on, so they are all one class
+    model = wfc_model.compile_model(img, pattern_width=1, rotations=0)
+    class_model, classes = model.compressed()
+    assert model.compressed()[0] is class_model
+    assert model.number_of_patterns == 3 and class_model.number_of_patterns == 1
+    assert classes.tolist() == [0, 0, 0] and class_model.weights.tolist() == [model.weights.sum()]
+
+    size = (12, 10)
+    red = wfc_constraints.patterns_showing(model, [255, 0, 0])
+    constraints = [wfc_constraints.allow(wfc_constraints.region_columns(size, 0, 3), red)]
+    np.random.seed(0)
+    image, solution = wfc_control.execute_wfc(
+        model=model, output_size=size, constraints=constraints, compress_patterns=True, return_solution=True
+    )
+    assert solution.shape == size and (solution < model.number_of_patterns).all()
+    assert (image[:3] == [255, 0, 0]).all() and not (image[3:] == [255, 0, 0]).all(axis=2).all()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import imageio  # type: ignore
+import numpy as np
+import pytest
+from tests.conftest import Resources
+from wfc import wfc_control
+from wfc import wfc_numba
+from wfc import wfc_solver
+from wfc.wfc_model import WFCModel, compile_model
+
+
+@pytest.mark.parametrize("periodic", [True, False])
+def test_propagate_kernel(resources: Resources, periodic: bool) -> None:
+    #the kernels as plain Python, so that they are checked without numba too
+    image = imageio.imread(resources.get_image("samples/Red Maze.png"))[:, :, :3]
+    model = compile_model(image, pattern_width=2, rotations=7)
+    adj = model.adjacency_matrices()
+    propagator = wfc_numba.NumbaPropagator(adj, periodic=periodic, jit=False)
+    np.random.seed(0)
+    wave = np.ones((model.number_of_patterns, 8, 6), dtype=np.bool_)
+    expected = wave.copy()
+    assert propagator(wave) == wfc_solver.propagate(expected, adj, periodic=periodic)
+    for _ in range(4):
+        x, y = np.random.randint(8), np.random.randint(6)
+        pattern = np.random.choice(np.nonzero(wave[:, x, y])[0])
+        for w in (wave, expected):
+            w[:, x, y] = False
+            w[pattern, x, y] = True
+        try:
+            removed = wfc_solver.propagate(expected, adj, periodic=periodic)
+        except wfc_solver.Contradiction:
+            with pytest.raises(wfc_solver.Contradiction) as exc_info:
+                propagator(wave, [(x, y)])
+            assert exc_info.value.cells is not None and exc_info.value.cells.sum() == 1
+            break
+        assert propagator(wave, [(x, y)]) == removed
+        assert (wave == expected).all()
+
+
+def test_entropy_location_kernel() -> None:
+    np.random.seed(0)
+    wave = np.random.random_sample((5, 7, 9)) > 0.4
+    preferences = np.random.random_sample((7, 9)) * 0.1
+    heuristic = wfc_numba.makeEntropyLocationHeuristic(preferences, jit=False)
+    assert heuristic(wave) == wfc_solver.makeEntropyLocationHeuristic(preferences)(wave)
+    wave[:, :, :] = False
+    wave[0] = True
+    assert heuristic(wave) == wfc_solver.makeEntropyLocationHeuristic(preferences)(wave)
+
+
+def test_resolve_backend() -> None:
+    assert wfc_numba.resolve_backend("numpy") == "numpy"
+    assert wfc_numba.resolve_backend("numba") == ("numba" if wfc_numba.HAVE_NUMBA else "numpy")
+    with pytest.raises(ValueError):
+        wfc_numba.resolve_backend("cuda")
+
+
+def test_numba_backend(knot_model: WFCModel) -> None:
+    pytest.importorskip("numba")
+    model = knot_model
+    solutions = []
+    for backend in ("numpy", "numba"):
+        np.random.seed(1)
+        _, solution = wfc_control.execute_wfc(
+            model=model, output_size=(16, 16), backtracking=True, return_solution=True, backend=backend
+        )
+        solutions.append(solution)
+    assert (solutions[0] == solutions[1]).all()
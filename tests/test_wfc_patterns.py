@@ -48,3 +48,13 @@ def test_pattern_to_tile(resources: Resources) -> None:
     )
     new_tile_grid = wfc_patterns.pattern_grid_to_tiles(pattern_grid, pattern_catalog)
     assert np.array_equal(tile_grid, new_tile_grid)
+
+
+def test_count_patterns(resources: Resources) -> None:
+    img = imageio.imread(resources.get_image("samples/Flowers.png"))[:, :, :3]
+    _tile_catalog, tile_grid, _code_list, _unique_tiles = wfc_tiles.make_tile_catalog(img, 1)
+    for rotations, periodic in ((0, True), (7, True), (2, False)):
+        _catalog, _weights, pattern_list, _grid = wfc_patterns.make_pattern_catalog_with_rotations(
+            tile_grid, 3, rotations=rotations, input_is_periodic=periodic
+        )
+        assert wfc_patterns.count_patterns(tile_grid, 3, rotations, periodic) == len(pattern_list)
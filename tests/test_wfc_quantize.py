@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import imageio  # type: ignore
+import numpy as np
+import pytest
+from tests.conftest import Resources
+from wfc import wfc_quantize
+from wfc.wfc_model import compile_model
+
+
+def number_of_colors(image: np.ndarray) -> int:
+    return len(np.unique(image.reshape(-1, image.shape[-1]), axis=0))
+
+
+def test_quantize(resources: Resources) -> None:
+    img = imageio.imread(resources.get_image("Inputs/Deformed Iron EBSD.png"))[:, :, :3]
+    quantized = wfc_quantize.quantize(img, 6)
+    assert quantized.shape == img.shape and quantized.dtype == img.dtype
+    assert number_of_colors(quantized) == 6
+    assert np.array_equal(wfc_quantize.quantize(img, 6), quantized)
+
+    #an image with fewer colors is left as it is
+    maze = imageio.imread(resources.get_image("samples/Red Maze.png"))[:, :, :3]
+    assert np.array_equal(wfc_quantize.quantize(maze, 16), maze)
+    with pytest.raises(ValueError):
+        wfc_quantize.quantize(maze, 0)
+
+
+def test_median_cut_refines() -> None:
+    colors = np.random.RandomState(0).randint(0, 256, size=(200, 3))
+    counts = np.ones(200, dtype=np.int64)
+    boxes, parents = wfc_quantize.median_cut(colors, counts, 32)
+    assert len(parents) == 32 and (parents[1:] < np.arange(1, 32)).all()
+    for number_of_boxes in (1, 5, 12):
+        merged = wfc_quantize.merge_boxes(boxes, parents, number_of_boxes)
+        assert np.array_equal(merged, wfc_quantize.median_cut(colors, counts, number_of_boxes)[0])
+        #every box of the finer cut lies inside one of the coarser
+        finer = wfc_quantize.merge_boxes(boxes, parents, number_of_boxes + 1)
+        assert all(len(np.unique(merged[finer == b])) == 1 for b in range(number_of_boxes + 1))
+
+
+def test_quantize_to_budget(resources: Resources) -> None:
+    img = imageio.imread(resources.get_image("Inputs/Deformed Iron EBSD.png"))[:, :, :3]
+    quantized, colors = wfc_quantize.quantize_to_budget(img, 500, pattern_width=2, rotations=7)
+    assert colors == number_of_colors(quantized) == 6
+    assert wfc_quantize.count_image_patterns(quantized, 1, 2, 7) <= 500
+    assert wfc_quantize.count_image_patterns(wfc_quantize.quantize(img, colors + 1), 1, 2, 7) > 500
+    with pytest.raises(ValueError):
+        wfc_quantize.quantize_to_budget(img, 0)
+
+    model = compile_model(img, tile_size=2, pattern_width=1, rotations=7, input_periodic=False, pattern_budget=40)
+    assert model.number_of_patterns <= 40 and model.metadata["colors"] >= 2
+    model = compile_model(img, tile_size=2, pattern_width=1, rotations=7, input_periodic=False, colors=2)
+    assert model.metadata["colors"] == 2
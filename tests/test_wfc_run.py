@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+from typing import List
+
+import pytest
+from tests.conftest import Resources
+import wfc_run
+
+SAMPLES = """<samples>
+	<overlapping name="Chess" N="2" width="8" height="8" periodic="True" screenshots="2"/>
+	<overlapping name="Red Maze" N="2" width="8" height="8" screenshots="2"/>
+</samples>
+"""
+
+
+@pytest.fixture
+def samples(tmp_path, monkeypatch) -> str:
+    # The solved images are written to ./output/
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("output")
+    filename = str(tmp_path / "samples.xml")
+    with open(filename, "w", encoding="utf_8") as samplesf:
+        samplesf.write(SAMPLES)
+    return filename
+
+
+def read_tsv(filename: str) -> List[List[str]]:
+    with open(filename, encoding="utf_8") as logf:
+        text = logf.read()
+    assert text.endswith("\n")
+    return [line.split("\t") for line in text[:-1].split("\n")]
+
+
+def test_run_jobs_pooled(resources: Resources, samples: str) -> None:
+    jobs = wfc_run.make_jobs(samples, "simple")
+    assert [job["index"] for job in jobs] == [0, 1, 2, 3]
+    assert len({job["key"] for job in jobs}) == 4
+
+    results = wfc_run.run_jobs(jobs, "log", workers=2, seed=0, image_folder=resources.get_image("samples"))
+    assert sorted(result["key"] for result in results) == sorted(job["key"] for job in jobs)
+    assert all(result["outcome"] == "success" for result in results)
+
+    #one header and then every attempt's row, each one whole
+    rows = read_tsv("output/log.tsv")
+    assert rows[0][0] == "filename"
+    assert len(rows) == 1 + sum(len(result["log_rows"]) for result in results)
+    assert all(len(row) == len(rows[0]) for row in rows)
+    assert "filename" not in [row[0] for row in rows[1:]]
+    assert sorted(row[0] for row in rows[1:]) == ["Chess"] * 2 + ["Red Maze"] * 2
+
+
+def test_run_jobs_resume(resources: Resources, samples: str, tmp_path) -> None:
+    jobs = [job for job in wfc_run.make_jobs(samples, "simple") if job["screenshot"] == 0]
+    assert [job["sample"]["name"] for job in jobs] == ["Chess", "Red Maze"]
+    run_folder = str(tmp_path / "run")
+    image_folder = resources.get_image("samples")
+
+    def run() -> List[wfc_run.JobResult]:
+        return wfc_run.run_jobs(
+            jobs, "log", workers=2, seed=0, image_folder=image_folder, manifest=wfc_run.RunManifest(run_folder)
+        )
+
+    assert len(run()) == 2
+    log_filename = os.path.join(run_folder, "log.tsv")
+    first_log = read_tsv(log_filename)
+    assert [row[0] for row in first_log] == ["filename", "Chess", "Red Maze"]
+
+    #everything is in the manifest, so nothing runs and the log is rebuilt as it was
+    assert run() == []
+    assert read_tsv(log_filename) == first_log
+
+    #a job whose result has gone missing runs again
+    ids = [wfc_run.job_id(job, False, None, 0) for job in jobs]
+    os.remove(os.path.join(run_folder, "jobs", ids[0] + ".json"))
+    assert [result["key"] for result in run()] == [jobs[0]["key"]]
+    rows = read_tsv(log_filename)
+    assert [row[0] for row in rows] == ["filename", "Chess", "Red Maze"]
+    assert sorted(os.listdir(os.path.join(run_folder, "jobs"))) == sorted(id_ + ".json" for id_ in ids)
+
+    #after the samples file changed, the rows of the jobs no longer in it are dropped
+    missing: wfc_run.RunJob = {**jobs[1], "key": "missing", "sample": {**jobs[1]["sample"], "name": "No Such Sample"}}
+    results = wfc_run.run_jobs([missing], "log", image_folder=image_folder, manifest=wfc_run.RunManifest(run_folder))
+    assert [result["outcome"].startswith("Skipped") for result in results] == [True]
+    assert not os.path.exists(log_filename)
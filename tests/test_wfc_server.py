@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import io
+import threading
+import imageio  # type: ignore
+import numpy as np
+import pytest
+from tests.conftest import PROJECT_ROOT
+from wfc import wfc_server
+import os.path
+
+
+def test_server(tmp_path, monkeypatch) -> None:
+    cache = wfc_server.ModelCache(1, str(tmp_path), os.path.join(PROJECT_ROOT, "images", "samples"))
+    server = wfc_server.GenerationServer(0, cache, workers=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        job = {"sample": "Red Maze", "pattern_width": 2, "size": [8, 6], "seed": 3}
+        status, body, stats = wfc_server.request_generation(url, job)
+        assert status == 200
+        image = imageio.imread(io.BytesIO(body))
+        assert image.shape == (6, 8, 3)
+        assert stats["attempts"] >= 1
+
+        #the same seed gives the same output, served from the warm model
+        status, body, _ = wfc_server.request_generation(url, dict(job, format="npy"))
+        assert status == 200
+        assert (np.load(io.BytesIO(body)) == image).all()
+        assert cache.hits == 1 and cache.misses == 1
+
+        #a second model pushes the first out of the cache, the saved copy is reloaded
+        assert wfc_server.request_generation(url, dict(job, sample="Chess", size=[8, 8]))[0] == 200
+        assert wfc_server.request_generation(url, job)[0] == 200
+        assert cache.misses == 3
+        assert len(cache.models) == 1
+
+        assert wfc_server.request_generation(url, {"sample": "No Such Sample"})[0] == 400
+        assert wfc_server.request_generation(url, dict(job, loc="nowhere"))[0] == 400
+
+        #a solver that fails is the server's error, not the client's
+        def fail(job, model):
+            raise ValueError("broken")
+
+        monkeypatch.setattr(wfc_server, "generate", fail)
+        assert wfc_server.request_generation(url, job)[0] == 500
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cold_build_does_not_hold_up_warm_models(tmp_path, monkeypatch) -> None:
+    cache = wfc_server.ModelCache(2, str(tmp_path), os.path.join(PROJECT_ROOT, "images", "samples"))
+    warm = wfc_server.parse_job({"sample": "Red Maze"})
+    warm_path, warm_model = cache.get(warm)
+
+    started, release = threading.Event(), threading.Event()
+    build = cache._build
+
+    def slow_build(model_id, job):
+        started.set()
+        release.wait(10)
+        return build(model_id, job)
+
+    monkeypatch.setattr(cache, "_build", slow_build)
+    cold = threading.Thread(target=cache.get, args=(wfc_server.parse_job({"sample": "Chess"}),))
+    cold.start()
+    try:
+        assert started.wait(10)
+        served = []
+        getter = threading.Thread(target=lambda: served.append(cache.get(warm)))
+        getter.start()
+        getter.join(5)
+        assert served == [(warm_path, warm_model)] and cache.hits == 1
+    finally:
+        release.set()
+        cold.join()
+    assert cache.misses == 2 and len(cache.models) == 2
+
+
+def test_build_lock_outlives_the_build(tmp_path) -> None:
+    cache = wfc_server.ModelCache(2, str(tmp_path), os.path.join(PROJECT_ROOT, "images", "samples"))
+    cached_when_released = []
+
+    class BuildLocks(dict):
+        def pop(self, model_id, *default):
+            cached_when_released.append(model_id in cache.models)
+            return super().pop(model_id, *default)
+
+    cache.build_locks = BuildLocks()
+    cache.get(wfc_server.parse_job({"sample": "Red Maze"}))
+    #a request between the two would find neither the model nor a build to wait for
+    assert cached_when_released == [True] and not cache.build_locks
+    with pytest.raises(wfc_server.BadRequest):
+        cache.get(wfc_server.parse_job({"sample": "No Such Sample"}))
+    assert cached_when_released == [True, False] and not cache.build_locks
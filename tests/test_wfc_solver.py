@@ -8,11 +8,13 @@ from numpy.typing import NDArray
 import imageio  # type: ignore
 import numpy
 import numpy as np
-from tests.conftest import Resources
+import pytest
+from tests.conftest import Resources, is_consistent, solution_wave
 from wfc import wfc_solver
 from wfc import wfc_tiles
 from wfc import wfc_patterns
 from wfc import wfc_adjacency
+from wfc.wfc_model import WFCModel
 
 
 def test_makeWave() -> None:
@@ -163,3 +165,216 @@ def test_run() -> None:
         happy = True
 
     assert happy
+
+
+def test_run_instrumented() -> None:
+    from wfc.wfc_instrumentation import SolverStats
+
+    wave = wfc_solver.makeWave(3, 3, 4)
+    adjLists = {}
+    adjLists[(+1, 0)] = adjLists[(-1, 0)] = adjLists[(0, +1)] = adjLists[(0, -1)] = [
+        [1],
+        [0],
+        [2],
+    ]
+    adj = wfc_solver.makeAdj(adjLists)
+    stats = SolverStats()
+    result = wfc_solver.run(
+        wave,
+        adj,
+        locationHeuristic=wfc_solver.lexicalLocationHeuristic,
+        patternHeuristic=wfc_solver.lexicalPatternHeuristic,
+        periodic=True,
+        backtracking=True,
+        stats=stats,
+    )
+    assert (result == 2).all()
+    assert stats.choices == 2
+    assert stats.backtracks == 1
+    assert stats.max_backtrack_depth == 1
+    #banning #0 at (0, 0) resolves every cell to #2, so the second choice collapses nothing
+    assert stats.cells_collapsed_by_choice == 1
+    assert stats.cells_collapsed_by_propagation == 12
+    assert stats.propagate_iterations >= stats.propagations
+    assert stats.max_history_depth == 1
+    assert stats.peak_history_bytes == wave.nbytes
+    assert stats.as_dict()["backtracks"] == 1
+
+
+def test_run_deadline() -> None:
+    import time
+
+    wave = wfc_solver.makeWave(3, 3, 4)
+    adjLists = {}
+    adjLists[(+1, 0)] = adjLists[(-1, 0)] = adjLists[(0, +1)] = adjLists[(0, -1)] = [
+        [1],
+        [0],
+        [2],
+    ]
+    adj = wfc_solver.makeAdj(adjLists)
+    with pytest.raises(wfc_solver.TimedOut):
+        wfc_solver.run(
+            wave.copy(),
+            adj,
+            locationHeuristic=wfc_solver.lexicalLocationHeuristic,
+            patternHeuristic=wfc_solver.lexicalPatternHeuristic,
+            periodic=True,
+            deadline=time.perf_counter() - 1,
+        )
+    result = wfc_solver.run(
+        wave.copy(),
+        adj,
+        locationHeuristic=wfc_solver.lexicalLocationHeuristic,
+        patternHeuristic=wfc_solver.lexicalPatternHeuristic,
+        periodic=True,
+        backtracking=True,
+        deadline=time.perf_counter() + 60,
+    )
+    assert (result == 2).all()
+
+
+def test_iter_solve() -> None:
+    wave = wfc_solver.makeWave(3, 3, 4)
+    adjLists = {}
+    adjLists[(+1, 0)] = adjLists[(-1, 0)] = adjLists[(0, +1)] = adjLists[(0, -1)] = [
+        [1],
+        [0],
+        [2],
+    ]
+    adj = wfc_solver.makeAdj(adjLists)
+    solver = wfc_solver.Solver(wave=wave, adj=adj, periodic=True, backtracking=True)
+    steps = solver.iter_solve(
+        wfc_solver.lexicalLocationHeuristic, wfc_solver.lexicalPatternHeuristic, snapshot_every=2, snapshot="collapsed"
+    )
+    records = []
+    try:
+        while True:
+            records.append(next(steps))
+    except StopIteration as stop:
+        solution = stop.value
+    assert (solution == 2).all()
+    #choosing #0 contradicts and is undone in the first step, the second chooses #2
+    assert [r["step"] for r in records] == [1, 2, 2]
+    assert [r["done"] for r in records] == [False, False, True]
+    assert [r["wave"] is None for r in records] == [True, False, False]
+    assert records[1]["resolved"] == 1.0
+    assert records[1]["wave"] is not None and (records[1]["wave"] == 2).all()
+
+    solver = wfc_solver.Solver(wave=wfc_solver.makeWave(3, 3, 4), adj=adj, periodic=True, backtracking=True)
+    first = next(solver.iter_solve(wfc_solver.lexicalLocationHeuristic, wfc_solver.lexicalPatternHeuristic, snapshot_every=1))
+    assert first["wave"] is not None and not first["wave"].flags.writeable
+    #the backtrack restored the unpropagated wave
+    assert first["resolved"] == 0.0
+
+
+def test_grow_region() -> None:
+    cells = numpy.zeros((8, 6), dtype=bool)
+    cells[0, 2] = True
+    region = wfc_solver.grow_region(cells, 1)
+    assert region.sum() == 6 and region[1, 3] and not region[7, 2]
+    region = wfc_solver.grow_region(cells, 1, periodic=True)
+    assert region.sum() == 9 and region[7, 1]
+    assert wfc_solver.grow_region(cells, 3).sum() == 4 * 6
+
+
+def test_repair(knot_model: WFCModel) -> None:
+    from wfc import wfc_control
+
+    model = knot_model
+    #this seed runs into a contradiction, which ends the only attempt without repair
+    np.random.seed(2)
+    with pytest.raises(wfc_solver.TimedOut):
+        wfc_control.execute_wfc(model=model, output_size=(16, 16), attempt_limit=1)
+    np.random.seed(2)
+    rows: List[Dict[str, Any]] = []
+    _, solution = wfc_control.execute_wfc(
+        model=model,
+        output_size=(16, 16),
+        attempt_limit=1,
+        repair=True,
+        instrument=True,
+        return_solution=True,
+        log_stats_to_output=lambda stats, _filename: rows.append(stats),
+    )
+    assert rows[-1]["repairs"] >= 1
+    assert is_consistent(model, solution)
+
+
+@pytest.mark.parametrize("periodic", [True, False])
+def test_propagate_bands(knot_model: WFCModel, periodic: bool) -> None:
+    model = knot_model
+    adj = model.adjacency_matrices()
+    executor = wfc_solver.band_executor(3)
+    np.random.seed(0)
+    wave = numpy.ones((model.number_of_patterns, 70, 64), dtype=bool)
+    for _ in range(5):
+        x, y = np.random.randint(70), np.random.randint(64)
+        pattern = np.random.choice(np.nonzero(wave[:, x, y])[0])
+        wave[:, x, y] = False
+        wave[pattern, x, y] = True
+        banded = wave.copy()
+        try:
+            removed = wfc_solver.propagate(wave, adj, periodic=periodic)
+        except wfc_solver.Contradiction:
+            with pytest.raises(wfc_solver.Contradiction):
+                wfc_solver.propagate(banded, adj, periodic=periodic, executor=executor, bands=3)
+            break
+        #the bands are joined after every pass, which gives the same passes as the serial propagate
+        assert wfc_solver.propagate(banded, adj, periodic=periodic, executor=executor, bands=3) == removed
+        assert (banded == wave).all()
+
+
+def test_observe_batch() -> None:
+    np.random.seed(0)
+    wave = numpy.ones((4, 20, 20), dtype=bool)
+    heuristic = wfc_solver.makeEntropyLocationHeuristic(np.random.random_sample((20, 20)) * 0.1)
+    choices = wfc_solver.observe_batch(wave, heuristic, wfc_solver.lexicalPatternHeuristic, 50, 5, periodic=True)
+    #at most 4 cells fit per axis when they are 5 apart around the 20 cell loop
+    assert 1 < len(choices) <= 16
+    assert choices[0][1:] == heuristic(wave)
+    for n, (_, i, j) in enumerate(choices):
+        for _, k, l in choices[n + 1 :]:
+            assert max(min(abs(i - k), 20 - abs(i - k)), min(abs(j - l), 20 - abs(j - l))) >= 5
+
+
+def test_run_batched(knot_model: WFCModel) -> None:
+    from wfc import wfc_control
+
+    model = knot_model
+    rows: List[Dict[str, Any]] = []
+    np.random.seed(0)
+    _, solution = wfc_control.execute_wfc(
+        model=model,
+        output_size=(24, 24),
+        batch_size=8,
+        batch_spacing=6,
+        instrument=True,
+        return_solution=True,
+        log_stats_to_output=lambda stats, _filename: rows.append(stats),
+    )
+    assert rows[-1]["batches"] > 0
+    assert rows[-1]["batched choices"] > rows[-1]["batches"]
+    assert is_consistent(model, solution)
+
+
+def test_propagate_cells(knot_model: WFCModel) -> None:
+    model = knot_model
+    adj = model.adjacency_matrices()
+    assert wfc_solver.is_symmetric(adj)
+    assert not wfc_solver.is_symmetric(wfc_solver.makeAdj({(1, 0): [[0, 1], [1]], (-1, 0): [[0, 1], [1]]}))
+    #a solved wave with a patch of it opened up again, like the tail of a solve
+    np.random.seed(0)
+    solver = wfc_solver.Solver(wave=numpy.ones((model.number_of_patterns, 16, 12), dtype=bool), adj=adj, periodic=False)
+    solution = solver.solve(wfc_solver.lexicalLocationHeuristic, wfc_solver.makeWeightedPatternHeuristic(model.weights))
+    wave = solution_wave(model, solution)
+    wave[:, 2:14, 0:9] = True
+    wfc_solver.propagate(wave, adj, periodic=False)
+    unresolved = numpy.flatnonzero(wave.sum(axis=0) > 1)
+    x, y = numpy.divmod(unresolved[len(unresolved) // 2], 12)
+    wave[:, x, y] = False
+    wave[numpy.nonzero(solution[x, y] == numpy.arange(model.number_of_patterns))[0], x, y] = True
+    expected = wave.copy()
+    removed, remaining = wfc_solver.propagate_cells(wave, adj, unresolved, periodic=False)
+    assert removed == wfc_solver.propagate(expected, adj, periodic=False)
+    assert (wave == expected).all()
+    assert (remaining == numpy.flatnonzero(expected.sum(axis=0) > 1)).all()
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import imageio  # type: ignore
+import numpy as np
 from tests.conftest import Resources
 from wfc import wfc_tiles
 
@@ -28,3 +29,25 @@ def test_make_tile_catalog(resources: Resources) -> None:
     print("unique tiles")
     print(ut)
     assert ut[1][0] == 7
+
+
+def test_render_tile_indices(resources: Resources) -> None:
+    filename = resources.get_image("samples/Red Maze.png")
+    img = imageio.imread(filename)
+    tc, tg, _cl, _ut = wfc_tiles.make_tile_catalog(img, 2)
+    tile_ids, tile_atlas = wfc_tiles.make_tile_atlas(tc)
+    assert tile_atlas.shape == (len(tc), 2, 2, img.shape[2])
+    assert tile_atlas.dtype == img.dtype
+    indices = wfc_tiles.tile_grid_to_indices(tg, tile_ids)
+    assert np.array_equal(wfc_tiles.render_tile_indices(indices, tile_atlas), img)
+
+
+def test_wave_to_average_image() -> None:
+    tile_atlas = np.array([[[[0, 0, 0]]], [[[255, 255, 255]]], [[[255, 0, 0]]]], dtype=np.uint8)
+    wave = np.zeros((3, 1, 2), dtype=bool)
+    wave[:2, 0, 0] = True
+    wave[2, 0, 1] = True
+    img = wfc_tiles.wave_to_average_image(wave, np.array([0, 1, 2]), tile_atlas)
+    assert img.shape == (1, 2, 3)
+    assert np.array_equal(img[0, 0], [127.5, 127.5, 127.5])
+    assert np.array_equal(img[0, 1], [255, 0, 0])
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import sys
+import numpy
+from wfc import wfc_solver
+from wfc import wfc_trace
+from wfc.wfc_model import compile_model
+
+
+def test_trace_replay(tmp_path) -> None:
+    wave = wfc_solver.makeWave(3, 3, 4)
+    adjLists = {}
+    # checkerboard #0/#1 or solid fill #2, the checkerboard does not fit periodically
+    adjLists[(+1, 0)] = adjLists[(-1, 0)] = adjLists[(0, +1)] = adjLists[(0, -1)] = [
+        [1],
+        [0],
+        [2],
+    ]
+    adj = wfc_solver.makeAdj(adjLists)
+    trace_filename = str(tmp_path / "run.trace")
+
+    with wfc_trace.TraceRecorder(trace_filename, wave, periodic=True, backtracking=True, chunk_size=2) as trace:
+        result = wfc_solver.run(
+            wave.copy(),
+            adj,
+            locationHeuristic=wfc_solver.lexicalLocationHeuristic,
+            patternHeuristic=wfc_solver.lexicalPatternHeuristic,
+            periodic=True,
+            backtracking=True,
+            trace=trace,
+        )
+
+    header, initial_wave, events = wfc_trace.read_trace(trace_filename)
+    assert header["shape"] == [3, 3, 4]
+    assert numpy.array_equal(initial_wave, wave)
+    assert [e["kind"] for e in events] == [
+        wfc_trace.EVENT_PROPAGATE,
+        wfc_trace.EVENT_CHOICE,
+        wfc_trace.EVENT_BACKTRACK,
+        wfc_trace.EVENT_PROPAGATE,
+        wfc_trace.EVENT_CHOICE,
+        wfc_trace.EVENT_PROPAGATE,
+    ]
+    assert (events[4]["pattern"], events[4]["i"], events[4]["j"]) == (2, 0, 0)
+    #banning #0 at (0, 0) leaves only the solid fill
+    assert events[3]["count"] == 23
+
+    replayed = [(choices, w.copy()) for choices, _event, w in wfc_trace.replay_trace(trace_filename, adj)]
+    assert numpy.array_equal(numpy.argmax(replayed[-1][1], axis=0), result)
+    assert numpy.array_equal(wfc_trace.wave_after_choices(trace_filename, adj, 0), wave)
+    assert (wfc_trace.wave_after_choices(trace_filename, adj, 1).sum(axis=0) == 1).all()
+
+
+def test_animate_empty_trace(tmp_path, monkeypatch) -> None:
+    import imageio  # type: ignore
+
+    image = numpy.zeros((4, 4, 3), dtype=numpy.uint8)
+    image[::2] = 255
+    model = compile_model(image, pattern_width=2, rotations=0)
+    model.save(str(tmp_path / "model"))
+    trace_filename = str(tmp_path / "empty.trace")
+    wfc_trace.TraceRecorder(trace_filename, numpy.ones((model.number_of_patterns, 4, 4), dtype=numpy.bool_)).close()
+
+    gif = str(tmp_path / "empty.gif")
+    monkeypatch.setattr(sys, "argv", ["wfc_trace", trace_filename, str(tmp_path / "model"), "--gif", gif])
+    wfc_trace.main()
+    assert len(imageio.mimread(gif)) == 1
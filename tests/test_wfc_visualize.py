@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import os
+import numpy as np
+from wfc import wfc_visualize
+
+
+def test_async_frame_renderer(tmp_path) -> None:
+    tile_atlas = np.array([[[[0, 0, 0]]], [[[255, 255, 255]]]], dtype=np.uint8)
+    tables = (np.array([11, 22]), np.array([0, 1]), tile_atlas)
+    #every other frame is skipped, never more as the pool is never that far behind
+    renderer = wfc_visualize.AsyncFrameRenderer(1, tables, max_pending_frames=10, frame_interval=2)
+    wave = np.ones((2, 3, 3), dtype=bool)
+    counters = np.zeros((3, 3))
+
+    for frame in range(4):
+        renderer.submit(str(tmp_path / f"frame_{frame}.png"), wave, counters, counters, counters, 3)
+    wave[1] = False
+    renderer.submit(str(tmp_path / "final.png"), wave, counters, counters, counters, 3, final=True)
+    assert renderer.drain() == {"frames rendered": 3, "frames skipped": 2}
+    assert renderer.executor is None
+    assert os.path.exists(tmp_path / "frame_0.png") and not os.path.exists(tmp_path / "frame_1.png")
+    assert os.path.exists(tmp_path / "final.png")
+
+    #the next attempt counts its own frames
+    renderer.submit(str(tmp_path / "again.png"), wave, counters, counters, counters, 3, final=True)
+    assert renderer.drain() == {"frames rendered": 1, "frames skipped": 0}
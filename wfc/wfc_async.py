@@ -0,0 +1,67 @@
+"""asyncio entry points for execute_wfc, with cancellation."""
+#execute_wfc blocks for as long as the solve takes, so here it runs on an executor
+# (threads by default) and the coroutine waits for it. Cancelling the coroutine, directly
+# or through asyncio.wait_for, sets a flag which the solver polls before every step, so an
+# abandoned solve stops within one step instead of running to the end.
+#
+# The heuristics draw from numpy's global random state, which the threads share: seeding
+# makes a single solve reproducible, but not several solves running at once.
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+from numpy.typing import NDArray
+from . import wfc_control
+
+# The image, or with return_solution the image and its grid of pattern indices
+WFCResult = Union[NDArray[np.integer], Tuple[NDArray[np.integer], NDArray[np.int64]]]
+
+
+async def execute_wfc_async(
+    *args: Any,
+    executor: Optional[concurrent.futures.Executor] = None,
+    **kwargs: Any,
+) -> WFCResult:
+    """Run execute_wfc(*args, **kwargs) on the executor, the event loop's default one if None.
+
+    When the coroutine is cancelled, the solve is stopped at its next step
+    and the cancellation is only passed on once it has stopped, so the
+    executor's worker is free again by then.
+    """
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    solve = loop.run_in_executor(
+        executor, functools.partial(wfc_control.execute_wfc, *args, should_stop=stop.is_set, **kwargs)
+    )
+    try:
+        return await asyncio.shield(solve)
+    except asyncio.CancelledError:
+        stop.set()
+        try:
+            await solve
+        except Exception:  # StopEarly, or whatever else ended the solve
+            pass
+        raise
+
+
+async def generate_many(
+    jobs: Iterable[Dict[str, Any]],
+    concurrency: int = 4,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> List[Union[WFCResult, BaseException]]:
+    """Run execute_wfc for each dictionary of keyword arguments, at most concurrency at a time.
+
+    The results are in the order of the jobs; a job that failed has its
+    exception in place of the image.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(job: Dict[str, Any]) -> WFCResult:
+        async with semaphore:
+            return await execute_wfc_async(executor=executor, **job)
+
+    return await asyncio.gather(*(bounded(job) for job in jobs), return_exceptions=True)
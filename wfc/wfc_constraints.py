@@ -0,0 +1,136 @@
+"""Spatial constraints on which patterns may appear where, compiled into the initial wave."""
+#A constraint names a region of the output (a boolean mask indexed [x, y], like the wave)
+# and a set of patterns, and either allows only those patterns there or forbids them
+# there. The ground rule of makeWave is the same thing: only ground patterns on the bottom
+# row, and none elsewhere. compile_domain applies the constraints to a full wave and
+# propagates it once, so every attempt starts from the reduced domains instead of finding
+# the restrictions again through contradictions. The result is packed to bits and cached
+# on the model, so later runs with the same size and constraints skip the propagation.
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Iterable, Optional, Sequence, Tuple, TypedDict
+import numpy as np
+from numpy.typing import NDArray
+from .wfc_model import WFCModel
+from .wfc_solver import Contradiction, propagate
+
+DOMAIN_CACHE_SIZE = 8  # Compiled domains kept per model.
+
+
+class DomainConstraint(TypedDict):
+    region: NDArray[np.bool_]  # Of the output size, True for the cells the constraint applies to.
+    patterns: NDArray[np.bool_]  # Indexed by pattern.
+    allow: bool  # Only these patterns in the region, or (False) none of them there.
+
+
+def allow(region: NDArray[np.bool_], patterns: NDArray[np.bool_]) -> DomainConstraint:
+    return {"region": np.asarray(region, dtype=np.bool_), "patterns": np.asarray(patterns, dtype=np.bool_), "allow": True}
+
+
+def forbid(region: NDArray[np.bool_], patterns: NDArray[np.bool_]) -> DomainConstraint:
+    return {"region": np.asarray(region, dtype=np.bool_), "patterns": np.asarray(patterns, dtype=np.bool_), "allow": False}
+
+
+def region_rows(output_size: Tuple[int, int], start: int, stop: Optional[int] = None) -> NDArray[np.bool_]:
+    """The rows start to stop (exclusive, negative counts from the bottom) of the output."""
+    region = np.zeros(output_size, dtype=np.bool_)
+    region[:, slice(start, stop)] = True
+    return region
+
+
+def region_columns(output_size: Tuple[int, int], start: int, stop: Optional[int] = None) -> NDArray[np.bool_]:
+    region = np.zeros(output_size, dtype=np.bool_)
+    region[slice(start, stop), :] = True
+    return region
+
+
+def region_border(output_size: Tuple[int, int], width: int = 1) -> NDArray[np.bool_]:
+    """The cells within width of the edge of the output: none for a width of 0, all once it reaches the middle."""
+    width_x, width_y = output_size
+    to_edge_x = np.minimum(np.arange(width_x), np.arange(width_x)[::-1])
+    to_edge_y = np.minimum(np.arange(width_y), np.arange(width_y)[::-1])
+    return np.minimum.outer(to_edge_x, to_edge_y) < width
+
+
+def region_cells(output_size: Tuple[int, int], cells: Iterable[Tuple[int, int]]) -> NDArray[np.bool_]:
+    region = np.zeros(output_size, dtype=np.bool_)
+    for x, y in cells:
+        region[x, y] = True
+    return region
+
+
+def patterns_showing(model: WFCModel, color: Sequence[int]) -> NDArray[np.bool_]:
+    """The patterns which place a tile of only this color, e.g. to seed a grain of it."""
+    tiles = model.tile_atlas[model.pattern_tile_indices]
+    return (tiles == np.asarray(color, dtype=tiles.dtype)).all(axis=(1, 2, 3))
+
+
+def patterns_by_index(model: WFCModel, indices: Iterable[int]) -> NDArray[np.bool_]:
+    patterns = np.zeros(model.number_of_patterns, dtype=np.bool_)
+    patterns[list(indices)] = True
+    return patterns
+
+
+def ground_constraints(model: WFCModel, output_size: Tuple[int, int]) -> Sequence[DomainConstraint]:
+    """makeWave's ground rule as constraints: ground patterns on the bottom row and nowhere else."""
+    if model.ground is None:
+        return []
+    ground = patterns_by_index(model, model.ground.tolist())
+    bottom = region_rows(output_size, -1)
+    return [allow(bottom, ground), forbid(~bottom, ground)]
+
+
+def apply_constraints(wave: NDArray[np.bool_], constraints: Iterable[DomainConstraint]) -> None:
+    """Remove the patterns the constraints rule out from the wave, in place."""
+    for constraint in constraints:
+        region, patterns = constraint["region"], constraint["patterns"]
+        if region.shape != wave.shape[1:] or patterns.shape != wave.shape[:1]:
+            raise ValueError(
+                f"A constraint for a {region.shape} output and {patterns.shape[0]} patterns "
+                f"does not fit a wave of shape {wave.shape}."
+            )
+        banned = ~patterns if constraint["allow"] else patterns
+        wave[banned] &= ~region
+
+
+def constraints_digest(constraints: Iterable[DomainConstraint]) -> str:
+    digest = hashlib.sha1()
+    for constraint in constraints:
+        digest.update(np.packbits(constraint["region"]).tobytes())
+        digest.update(np.packbits(constraint["patterns"]).tobytes())
+        digest.update(b"A" if constraint["allow"] else b"F")
+    return digest.hexdigest()
+
+
+def compile_domain(
+    model: WFCModel,
+    output_size: Tuple[int, int],
+    constraints: Sequence[DomainConstraint] = (),
+    periodic: bool = True,
+    adjacency: Optional[Any] = None,
+) -> NDArray[np.uint8]:
+    """The initial wave under the ground rule and the constraints, propagated and packed to bits along the pattern axis.
+
+    Cached on the model.  Raises Contradiction when the constraints leave no
+    pattern for some cell.
+    """
+    key = (tuple(output_size), periodic, constraints_digest(constraints))
+    if key in model.domain_cache:
+        return model.domain_cache[key]
+    wave = np.ones((model.number_of_patterns,) + tuple(output_size), dtype=np.bool_)
+    apply_constraints(wave, ground_constraints(model, output_size))
+    apply_constraints(wave, constraints)
+    try:
+        propagate(wave, adjacency if adjacency is not None else model.adjacency_matrices(), periodic=periodic)
+    except Contradiction as exc:
+        raise Contradiction(f"The constraints leave no solution: {exc}") from exc
+    packed = np.packbits(wave, axis=0)
+    while len(model.domain_cache) >= DOMAIN_CACHE_SIZE:
+        del model.domain_cache[next(iter(model.domain_cache))]
+    model.domain_cache[key] = packed
+    return packed
+
+
+def unpack_domain(packed: NDArray[np.uint8], number_of_patterns: int) -> NDArray[np.bool_]:
+    return np.unpackbits(packed, axis=0, count=number_of_patterns).astype(np.bool_)
@@ -5,20 +5,20 @@
 #annotations enables postponed evaluation
 from __future__ import annotations
 #self explanatory
+import contextlib
 import datetime
 #built in python module that imports these classes and variables
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, Literal, Optional, Sequence, Tuple, Union
 #the next 4 modules were all created by the programmer
-from .wfc_tiles import make_tile_catalog
-from .wfc_patterns import (
-    pattern_grid_to_tiles,
-    make_pattern_catalog_with_rotations,
-)
-from .wfc_adjacency import adjacency_extraction
+from .wfc_model import WFCModel, compile_model, compress_wave, expand_solution
+from .wfc_trace import TraceRecorder
+from .wfc_instrumentation import SolverStats
+from .wfc_memory import PeakMemory, plan_memory
+from .wfc_constraints import DomainConstraint, compile_domain, unpack_domain
+from . import wfc_numba
+from .wfc_numba import resolve_backend
 from .wfc_solver import (
     run,
-    makeWave,
-    makeAdj,
     lexicalLocationHeuristic,
     lexicalPatternHeuristic,
     makeWeightedPatternHeuristic,
@@ -39,13 +39,10 @@ from .wfc_visualize import (
     figure_list_of_tiles,
     figure_false_color_tile_grid,
     figure_pattern_catalog,
-    render_tiles_to_output,
     figure_adjacencies,
     make_solver_visualizers,
     make_solver_loggers,
-    tile_grid_to_image,
 )
-import imageio  # type: ignore
 import numpy as np
 import time
 import logging
@@ -67,8 +64,8 @@ def visualize_patterns(pattern_catalog, tile_catalog, pattern_weights, pattern_w
         )
 
 
-def make_log_stats() -> Callable[[Dict[str, Any], str], None]:
-    log_line = 0
+def make_log_stats(header_written: bool = False) -> Callable[[Dict[str, Any], str], None]:
+    log_line = 1 if header_written else 0
 
     def log_stats(stats: Dict[str, Any], filename: str) -> None:
         nonlocal log_line
@@ -85,6 +82,44 @@ def make_log_stats() -> Callable[[Dict[str, Any], str], None]:
 
     return log_stats
 
+def make_heuristics(
+    encoded_weights: NDArray[np.float64],
+    loc_heuristic: str,
+    choice_heuristic: str,
+    output_size: Tuple[int, ...],
+    backend: str = "numpy",
+) -> Tuple[Callable[[NDArray[np.bool_]], Tuple[int, int]], Callable[[NDArray[np.bool_], NDArray[np.bool_]], int]]:
+    """The location and pattern heuristics named by execute_wfc's loc_heuristic and choice_heuristic."""
+    choice_random_weighting: NDArray[np.float64] = np.random.random_sample(output_size) * 0.1
+
+    pattern_heuristic: Callable[[NDArray[np.bool_], NDArray[np.bool_]], int] = lexicalPatternHeuristic
+    if choice_heuristic == "rarest":
+        pattern_heuristic = makeRarestPatternHeuristic(encoded_weights)
+    if choice_heuristic == "weighted":
+        pattern_heuristic = makeWeightedPatternHeuristic(encoded_weights)
+    if choice_heuristic == "random":
+        pattern_heuristic = makeRandomPatternHeuristic(encoded_weights)
+
+    logger.debug(loc_heuristic)
+    location_heuristic: Callable[[NDArray[np.bool_]], Tuple[int, int]] = lexicalLocationHeuristic
+    if loc_heuristic == "anti-entropy":
+        location_heuristic = makeAntiEntropyLocationHeuristic(choice_random_weighting)
+    if loc_heuristic == "entropy":
+        if resolve_backend(backend) == "numba":
+            location_heuristic = wfc_numba.makeEntropyLocationHeuristic(choice_random_weighting)
+        else:
+            location_heuristic = makeEntropyLocationHeuristic(choice_random_weighting)
+    if loc_heuristic == "random":
+        location_heuristic = makeRandomLocationHeuristic(choice_random_weighting)
+    if loc_heuristic == "simple":
+        location_heuristic = simpleLocationHeuristic
+    if loc_heuristic == "spiral":
+        location_heuristic = makeSpiralLocationHeuristic(choice_random_weighting)
+    if loc_heuristic == "hilbert":
+        location_heuristic = makeHilbertLocationHeuristic(choice_random_weighting)
+    return location_heuristic, pattern_heuristic
+
+
 #This function launches the algorithm. 
 def execute_wfc(
     filename: Optional[str] = None,
@@ -107,13 +142,35 @@ def execute_wfc(
     log_stats_to_output: Optional[Callable[[Dict[str, Any], str], None]] = None,
     *,
     image: Optional[NDArray[np.integer]] = None,
-) -> NDArray[np.integer]:
+    model: Optional[WFCModel] = None,
+    visualize_workers: int = 0,
+    trace_filename: Optional[str] = None,
+    instrument: bool = False,
+    memory_budget: Optional[Union[int, str]] = None,
+    memory_policy: Literal["adapt", "raise"] = "adapt",
+    measure_memory: bool = False,
+    time_limit: Optional[float] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    return_solution: bool = False,
+    constraints: Optional[Sequence[DomainConstraint]] = None,
+    repair: bool = False,
+    backend: Literal["numpy", "numba"] = "numpy",
+    propagate_threads: int = 0,
+    batch_size: int = 1,
+    batch_spacing: int = 8,
+    compress_patterns: bool = False,
+    colors: Optional[int] = None,
+    pattern_budget: Optional[int] = None,
+) -> Union[NDArray[np.integer], Tuple[NDArray[np.integer], NDArray[np.int64]]]:
+    """Generate an image, or with return_solution the image and the grid of pattern indices it was made from."""
     timecode = datetime.datetime.now().isoformat().replace(":", ".")
     time_begin = time.perf_counter()
+    deadline = None if time_limit is None else time_begin + time_limit
     output_destination = r"./output/"
     input_folder = r"./images/samples/"
 
     rotations -= 1  # change to zero-based
+    backend = resolve_backend(backend)  # numpy when numba is missing
 
     input_stats = {
         "filename": str(filename),
@@ -129,29 +186,88 @@ def execute_wfc(
         "choice heuristic": choice_heuristic,
         "global constraint": global_constraint,
         "backtracking": backtracking,
+        "backend": backend,
     }
 
-    # Load the image
-    if filename:
-        if image is not None:
-            raise TypeError("Only filename or image can be provided, not both.")
-        image = imageio.imread(input_folder + filename + ".png")[:, :, :3]  # TODO: handle alpha channels
-
-    if image is None:
-        raise TypeError("An image must be given.")
+    # Load the image and preprocess it, unless we were handed a compiled model
+    if model is None:
+        if filename:
+            if image is not None:
+                raise TypeError("Only filename or image can be provided, not both.")
+            import imageio  # type: ignore
+
+            image = imageio.imread(input_folder + filename + ".png")[:, :, :3]  # TODO: handle alpha channels
+
+        if image is None:
+            raise TypeError("An image or a model must be given.")
+
+        model = compile_model(
+            image,
+            tile_size=tile_size,
+            pattern_width=pattern_width,
+            rotations=rotations,
+            input_periodic=input_periodic,
+            ground=ground,
+            metadata={"filename": filename},
+            output_periodic=output_periodic,
+            colors=colors,
+            pattern_budget=pattern_budget,
+        )
+    elif image is not None:
+        raise TypeError("Only a model or an image can be provided, not both.")
+    else:
+        tile_size = model.tile_size
+        pattern_width = model.pattern_width
+        input_stats.update(
+            {
+                "tile_size": tile_size,
+                "pattern_width": pattern_width,
+                "rotations": model.metadata.get("rotations"),
+                "ground": model.metadata.get("ground"),
+                "input_periodic": model.metadata.get("input_periodic"),
+            }
+        )
 
-    # TODO: generalize this to more than the four cardinal directions
-    direction_offsets = list(enumerate([(0, -1), (1, 0), (0, 1), (-1, 0)]))
+    input_stats["colors"] = model.metadata.get("colors")
+
+    # Patterns which propagation can not tell apart are solved as one class, see WFCModel.compressed
+    pattern_classes: Optional[NDArray[np.int64]] = None
+    solve_model = model
+    if compress_patterns:
+        solve_model, pattern_classes = model.compressed()
+        input_stats["pattern classes"] = solve_model.number_of_patterns
+
+    ### Memory ###
+
+    history_limit = None
+    if memory_budget is not None:
+        # Refuse, or cut down backtracking and visualization, before anything large is allocated
+        memory_plan = plan_memory(
+            memory_budget,
+            solve_model.number_of_patterns,
+            output_size,
+            backtracking=backtracking,
+            visualize=visualize,
+            policy=memory_policy,
+            render_workers=visualize_workers,
+            tile_size=model.tile_size,
+            color_channels=model.tile_atlas.shape[3],
+        )
+        backtracking = memory_plan["backtracking"]
+        visualize = memory_plan["visualize"]
+        history_limit = memory_plan["history_limit"]
+        input_stats.update(
+            {
+                "backtracking": backtracking,
+                "history limit": history_limit,
+                "estimated bytes": memory_plan["estimate"]["total"],
+            }
+        )
 
-    tile_catalog, tile_grid, _code_list, _unique_tiles = make_tile_catalog(image, tile_size)
-    (
-        pattern_catalog,
-        pattern_weights,
-        pattern_list,
-        pattern_grid,
-    ) = make_pattern_catalog_with_rotations(
-        tile_grid, pattern_width, input_is_periodic=input_periodic, rotations=rotations
-    )
+    direction_offsets = solve_model.direction_offsets
+    tile_catalog = solve_model.tile_catalog
+    pattern_catalog = solve_model.pattern_catalog
+    pattern_weights = solve_model.pattern_weights
 
     logger.debug("pattern catalog")
 
@@ -168,31 +284,11 @@ def execute_wfc(
             output_filename=f"visualization/pattern_catalog_{filename}_{timecode}",
         )
 
-    logger.debug("profiling adjacency relations")
-    if False:
-        import pprofile  # type: ignore
-        profiler = pprofile.Profile()
-        with profiler:
-            adjacency_relations = adjacency_extraction(
-                pattern_grid,
-                pattern_catalog,
-                direction_offsets,
-                [pattern_width, pattern_width],
-            )
-        profiler.dump_stats(f"logs/profile_adj_{filename}_{timecode}.txt")
-    else:
-        adjacency_relations = adjacency_extraction(
-            pattern_grid,
-            pattern_catalog,
-            direction_offsets,
-            (pattern_width, pattern_width),
-        )
-
     logger.debug("adjacency_relations")
 
     if visualize:
         figure_adjacencies(
-            adjacency_relations,
+            solve_model.adjacency_relations(),
             direction_offsets,
             tile_catalog,
             pattern_catalog,
@@ -203,40 +299,19 @@ def execute_wfc(
         # figure_adjacencies(adjacency_relations, direction_offsets, tile_catalog, pattern_catalog, pattern_width, [tile_size, tile_size], output_filename=f"visualization/adjacency_{filename}_{timecode}_B", render_b_first=True)
 
     logger.debug(f"output size: {output_size}\noutput periodic: {output_periodic}")
-    number_of_patterns = len(pattern_weights)
+    number_of_patterns = model.number_of_patterns
     logger.debug(f"# patterns: {number_of_patterns}")
-    decode_patterns = dict(enumerate(pattern_list))
-    encode_patterns = {x: i for i, x in enumerate(pattern_list)}
-    _encode_directions = {j: i for i, j in direction_offsets}
-
-    adjacency_list: Dict[Tuple[int, int], List[Set[int]]] = {}
-    for _, adjacency in direction_offsets:
-        adjacency_list[adjacency] = [set() for _ in pattern_weights]
-    # logger.debug(adjacency_list)
-    for adjacency, pattern1, pattern2 in adjacency_relations:
-        # logger.debug(adjacency)
-        # logger.debug(decode_patterns[pattern1])
-        adjacency_list[adjacency][encode_patterns[pattern1]].add(encode_patterns[pattern2])
-
-    logger.debug(f"adjacency: {len(adjacency_list)}")
+    decode_patterns = dict(enumerate(solve_model.pattern_ids.tolist()))
 
     time_adjacency = time.perf_counter()
 
     ### Ground ###
 
-    ground_list: Optional[NDArray[np.int64]] = None
-    if ground:
-        ground_list = np.vectorize(lambda x: encode_patterns[x])(
-            pattern_grid.flat[(ground - 1) :]
-        )
-    if ground_list is None or ground_list.size == 0:
-        ground_list = None
+    ground_list: Optional[NDArray[np.int64]] = solve_model.ground
 
     if ground_list is not None:
         ground_catalog = {
-            encode_patterns[k]: v
-            for k, v in pattern_catalog.items()
-            if encode_patterns[k] in ground_list
+            int(solve_model.pattern_ids[k]): solve_model.pattern_contents[k] for k in ground_list
         }
         if visualize:
             figure_pattern_catalog(
@@ -247,40 +322,28 @@ def execute_wfc(
                 output_filename=f"visualization/patterns_ground_{filename}_{timecode}",
             )
 
-    wave = makeWave(
-        number_of_patterns, output_size[0], output_size[1], ground=ground_list
-    )
-    adjacency_matrix = makeAdj(adjacency_list)
+    adjacency_matrix = solve_model.adjacency_matrices()
+    # The ground rule and the constraints, propagated once (and cached on the model) for every attempt
+    domain: Optional[NDArray[np.bool_]] = None
+    if pattern_classes is not None and constraints:
+        # The constraints name patterns, which may split a class between cells
+        domain = unpack_domain(
+            compile_domain(model, output_size, constraints, periodic=output_periodic), number_of_patterns
+        )
+        wave = compress_wave(domain, pattern_classes)
+    else:
+        wave = unpack_domain(
+            compile_domain(
+                solve_model, output_size, constraints or (), periodic=output_periodic, adjacency=adjacency_matrix
+            ),
+            solve_model.number_of_patterns,
+        )
 
     ### Heuristics ###
 
-    encoded_weights: NDArray[np.float64] = np.zeros((number_of_patterns), dtype=np.float64)
-    for w_id, w_val in pattern_weights.items():
-        encoded_weights[encode_patterns[w_id]] = w_val
-    choice_random_weighting: NDArray[np.float64] = np.random.random_sample(wave.shape[1:]) * 0.1
-
-    pattern_heuristic: Callable[[NDArray[np.bool_], NDArray[np.bool_]], int] = lexicalPatternHeuristic
-    if choice_heuristic == "rarest":
-        pattern_heuristic = makeRarestPatternHeuristic(encoded_weights)
-    if choice_heuristic == "weighted":
-        pattern_heuristic = makeWeightedPatternHeuristic(encoded_weights)
-    if choice_heuristic == "random":
-        pattern_heuristic = makeRandomPatternHeuristic(encoded_weights)
-
-    logger.debug(loc_heuristic)
-    location_heuristic: Callable[[NDArray[np.bool_]], Tuple[int, int]] = lexicalLocationHeuristic
-    if loc_heuristic == "anti-entropy":
-        location_heuristic = makeAntiEntropyLocationHeuristic(choice_random_weighting)
-    if loc_heuristic == "entropy":
-        location_heuristic = makeEntropyLocationHeuristic(choice_random_weighting)
-    if loc_heuristic == "random":
-        location_heuristic = makeRandomLocationHeuristic(choice_random_weighting)
-    if loc_heuristic == "simple":
-        location_heuristic = simpleLocationHeuristic
-    if loc_heuristic == "spiral":
-        location_heuristic = makeSpiralLocationHeuristic(choice_random_weighting)
-    if loc_heuristic == "hilbert":
-        location_heuristic = makeHilbertLocationHeuristic(choice_random_weighting)
+    location_heuristic, pattern_heuristic = make_heuristics(
+        solve_model.weights, loc_heuristic, choice_heuristic, wave.shape[1:], backend=backend
+    )
 
     ### Visualization ###
 
@@ -307,6 +370,7 @@ def execute_wfc(
             pattern_catalog=pattern_catalog,
             tile_catalog=tile_catalog,
             tile_size=[tile_size, tile_size],
+            render_workers=visualize_workers,
         )
     if filename and logging:
         (
@@ -325,15 +389,20 @@ def execute_wfc(
             pattern_catalog=pattern_catalog,
             tile_catalog=tile_catalog,
             tile_size=[tile_size, tile_size],
+            render_workers=visualize_workers,
         )
         log = make_solver_loggers(f"{filename}_{timecode}", input_stats.copy())
 
         def visfunc(idx: int):
             def vf(*args, **kwargs):
+                vis_result = None
                 if vis[idx]:
-                    vis[idx](*args, **kwargs)
+                    vis_result = vis[idx](*args, **kwargs)
                 if log[idx]:
-                    return log[idx](*args, **kwargs)
+                    log_result = log[idx](*args, **kwargs)
+                    if isinstance(vis_result, dict) and isinstance(log_result, dict):
+                        log_result.update(vis_result)
+                    return log_result
 
             return vf
 
@@ -356,12 +425,18 @@ def execute_wfc(
     def combinedConstraints(wave: NDArray[np.bool_]) -> bool:
         return all(fn(wave) for fn in combined_constraints)
 
+    ### Tracing ###
+
+    if trace_filename:
+        # Keep the model next to the traces, replaying needs its adjacency and tiles
+        solve_model.save(trace_filename + ".model")
+
     ### Solving ###
 
     time_solve_start = None
     time_solve_end = None
 
-    solution_tile_grid = None
+    solution_image = None
     logger.debug("solving...")
     attempts = 0
     # kinda important
@@ -369,42 +444,59 @@ def execute_wfc(
         attempts += 1
         time_solve_start = time.perf_counter()
         stats = {}
+        solver_stats = SolverStats() if instrument else None
+        peak_memory = PeakMemory() if measure_memory else None
+        trace = None
+        if trace_filename:
+            trace = TraceRecorder(
+                f"{trace_filename}_{attempts}.trace",
+                wave,
+                periodic=output_periodic,
+                backtracking=backtracking,
+            )
         # profiler = pprofile.Profile()
         # with profiler:
         # with PyCallGraph(output=GraphvizOutput(output_file=f"visualization/pycallgraph_{filename}_{timecode}.png")):
         try:
             # pretty important (see wfc_solver)
-            solution = run(
-                wave.copy(),
-                adjacency_matrix,
-                locationHeuristic=location_heuristic,
-                patternHeuristic=pattern_heuristic,
-                periodic=output_periodic,
-                backtracking=backtracking,
-                onChoice=visualize_choice,
-                onBacktrack=visualize_backtracking,
-                onObserve=visualize_wave,
-                onPropagate=visualize_propagate,
-                onFinal=visualize_final,
-                checkFeasible=combinedConstraints,
-            )
-            if visualize_after:
-                stats = visualize_after()
+            with peak_memory if peak_memory else contextlib.nullcontext():
+                solution = run(
+                    wave.copy(),
+                    adjacency_matrix,
+                    locationHeuristic=location_heuristic,
+                    patternHeuristic=pattern_heuristic,
+                    periodic=output_periodic,
+                    backtracking=backtracking,
+                    onChoice=visualize_choice,
+                    onBacktrack=visualize_backtracking,
+                    onObserve=visualize_wave,
+                    onPropagate=visualize_propagate,
+                    onFinal=visualize_final,
+                    checkFeasible=combinedConstraints,
+                    trace=trace,
+                    stats=solver_stats,
+                    history_limit=history_limit,
+                    deadline=deadline,
+                    should_stop=should_stop,
+                    repair=repair,
+                    backend=backend,
+                    threads=propagate_threads,
+                    batch_size=batch_size,
+                    batch_spacing=batch_spacing,
+                )
             # logger.debug(solution)
             # logger.debug(stats)
-            solution_as_ids = np.vectorize(lambda x: decode_patterns[x])(solution)
-            solution_tile_grid = pattern_grid_to_tiles(
-                solution_as_ids, pattern_catalog
-            )
+            if pattern_classes is not None:
+                solution = expand_solution(solution, pattern_classes, model.weights, domain)
+            solution_image = model.solution_to_image(solution)
 
             logger.debug("Solution:")
-            # logger.debug(solution_tile_grid)
             if filename:
-                render_tiles_to_output(
-                    solution_tile_grid,
-                    tile_catalog,
-                    (tile_size, tile_size),
+                import imageio  # type: ignore
+
+                imageio.imwrite(
                     output_destination + filename + "_" + timecode + ".png",
+                    model.solution_to_image(solution.T).astype(np.uint8),
                 )
 
             time_solve_end = time.perf_counter()
@@ -415,16 +507,17 @@ def execute_wfc(
             raise
         except TimedOut:
             logger.debug("Timed Out")
-            if visualize_after:
-                stats = visualize_after()
             stats.update({"outcome": "timed_out"})
         except Contradiction as exc:
             logger.warning(f"Contradiction: {exc}")
-            if visualize_after:
-                stats = visualize_after()
             stats.update({"outcome": "contradiction"})
         finally:
             # profiler.dump_stats(f"logs/profile_{filename}_{timecode}.txt")
+            if visualize_after:
+                # Whatever ended the attempt, so that a cancelled solve does not leave the render pool running
+                stats = dict(visualize_after() or {}, **stats)
+            if trace:
+                trace.close()
             outstats = {}
             outstats.update(input_stats)
             solve_duration = time.perf_counter() - time_solve_start
@@ -444,10 +537,19 @@ def execute_wfc(
                 }
             )
             outstats.update(stats)
+            if solver_stats is not None:
+                logger.debug(solver_stats)
+                outstats.update(solver_stats.as_dict())
+            if peak_memory:
+                outstats.update({"peak traced bytes": peak_memory.peak})
             if log_stats_to_output is not None:
                 log_stats_to_output(outstats, output_destination + log_filename + ".tsv")
-        if solution_tile_grid is not None:
-            return tile_grid_to_image(solution_tile_grid, tile_catalog, (tile_size, tile_size))
+        if solution_image is not None:
+            if return_solution:
+                return solution_image, solution
+            return solution_image
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimedOut(f"Time limit of {time_limit}s exceeded after {attempts} attempts.")
 
     raise TimedOut("Attempt limit exceeded.")
  
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Regenerate a region of an existing solution, leaving the rest of it as it is."""
+#Only the cells under the mask are solved again. Every other cell keeps its pattern, so the
+# only ones that constrain the region are its direct neighbours: the region's bounding box
+# plus a border of pinned cells is solved as a small wave of its own, and the cost of
+# repainting a patch depends on the size of the patch, not of the map.
+from __future__ import annotations
+
+import logging
+from typing import Literal, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from .wfc_control import make_heuristics
+from .wfc_model import WFCModel
+from .wfc_solver import Contradiction, Solver, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+def region_window(
+    mask: NDArray[np.bool_], border: int, periodic: bool
+) -> Tuple[Optional[Tuple[NDArray[np.int64], NDArray[np.int64]]], bool]:
+    """The x and y indices of the cells to solve around the mask, and whether they wrap.
+
+    For a periodic output the window may wrap around the edges.  When it
+    would cover a whole row or column of the map (or the mask straddles an
+    edge), the whole map is returned with wrapping on, as there is then no
+    edge for a local window to have.
+    """
+    width, height = mask.shape
+    xs = np.nonzero(mask.any(axis=1))[0]
+    ys = np.nonzero(mask.any(axis=0))[0]
+    if len(xs) == 0:
+        return None, False
+    x_range = np.arange(xs[0] - border, xs[-1] + border + 1)
+    y_range = np.arange(ys[0] - border, ys[-1] + border + 1)
+    if not periodic:
+        return (x_range[(x_range >= 0) & (x_range < width)], y_range[(y_range >= 0) & (y_range < height)]), False
+    if len(x_range) >= width or len(y_range) >= height:
+        return (np.arange(width), np.arange(height)), True
+    return (x_range % width, y_range % height), False
+
+
+def resolve_region(
+    model: WFCModel,
+    solution: NDArray[np.integer],
+    mask: NDArray[np.bool_],
+    *,
+    border: int = 1,
+    periodic: bool = True,
+    loc_heuristic: Literal["lexical", "hilbert", "spiral", "entropy", "anti-entropy", "simple", "random"] = "entropy",
+    choice_heuristic: Literal["lexical", "rarest", "weighted", "random"] = "weighted",
+    backtracking: bool = False,
+    attempt_limit: int = 10,
+) -> NDArray[np.int64]:
+    """Solve the masked cells of a solution again, returning the new solution.
+
+    solution is a grid of pattern indices, as returned by
+    execute_wfc(return_solution=True), and mask has the same shape, True for
+    the cells to regenerate.  Cells outside the mask are pinned to their
+    patterns, and border rings of them around the mask are included in the
+    local wave.  Raises Contradiction when no attempt succeeds, e.g. when the
+    pinned cells leave no pattern that fits.
+    """
+    if mask.shape != solution.shape:
+        raise ValueError(f"The mask has shape {mask.shape}, the solution {solution.shape}.")
+    if border < 1:
+        raise ValueError("The border must be at least one cell, the neighbours are what constrain the region.")
+    window, wraps = region_window(mask, border, periodic)
+    if window is None:
+        return solution.astype(np.int64)
+    xs, ys = window
+    cells = np.ix_(xs, ys)
+    number_of_patterns = model.number_of_patterns
+
+    local_wave = np.zeros((number_of_patterns, len(xs), len(ys)), dtype=np.bool_)
+    local_mask = mask[cells]
+    local_wave[:, local_mask] = True
+    pinned = ~local_mask
+    local_wave[solution[cells][pinned], np.nonzero(pinned)[0], np.nonzero(pinned)[1]] = True
+    if model.ground is not None:
+        # As in makeWave: ground patterns on the bottom row of the map and nowhere else
+        bottom = ys == mask.shape[1] - 1
+        ground = np.zeros(number_of_patterns, dtype=np.bool_)
+        ground[model.ground] = True
+        local_wave[:, :, bottom] &= ground[:, None, None] | ~local_mask[None, :, bottom]
+        local_wave[:, :, ~bottom] &= ~ground[:, None, None] | ~local_mask[None, :, ~bottom]
+
+    adjacency = model.adjacency_matrices()
+    logger.debug(f"Solving a {len(xs)}x{len(ys)} window for {local_mask.sum()} masked cells.")
+    for attempt in range(1, attempt_limit + 1):
+        location_heuristic, pattern_heuristic = make_heuristics(
+            model.weights, loc_heuristic, choice_heuristic, local_wave.shape[1:]
+        )
+        solver = Solver(wave=local_wave.copy(), adj=adjacency, periodic=wraps, backtracking=backtracking)
+        try:
+            local_solution = solver.solve(location_heuristic, pattern_heuristic)
+        except (Contradiction, TimedOut) as exc:
+            logger.debug(f"Attempt {attempt} to solve the region failed: {exc}")
+            continue
+        result = solution.astype(np.int64)
+        result[cells] = np.where(local_mask, local_solution, result[cells])
+        return result
+    raise Contradiction(f"The region could not be solved in {attempt_limit} attempts.")
@@ -0,0 +1,104 @@
+"""Per-phase timers and counters for the solver."""
+#Instrumentation is opt-in: the solver only touches a SolverStats object when one was
+# passed in, so an uninstrumented solve pays for a few `is not None` checks per step.
+from __future__ import annotations
+
+from typing import Any, Dict
+
+
+class SolverStats:
+    """Timers and counters collected over one solve.
+
+    Times are in seconds, measured with time.perf_counter.  Time spent in the
+    on_* callbacks (visualization, logging) is not counted in any phase.
+    """
+
+    def __init__(self) -> None:
+        self.propagate_time = 0.0
+        self.location_time = 0.0
+        self.pattern_time = 0.0
+        self.propagations = 0
+        self.propagate_iterations = 0  # Passes of the propagation loop until the fixpoint.
+        self.max_propagate_iterations = 0
+        self.choices = 0
+        self.backtracks = 0
+        self.cells_collapsed_by_choice = 0
+        self.cells_collapsed_by_propagation = 0
+        self.backtrack_depth = 0  # Backtracks in a row since the last successful choice.
+        self.max_backtrack_depth = 0
+        self.max_history_depth = 0
+        self.peak_wave_bytes = 0
+        self.peak_history_bytes = 0
+        self.repairs = 0
+        self.cells_repaired = 0
+        self.batches = 0  # Observations of more than one cell before a propagation.
+        self.batched_choices = 0
+        self.batch_contradictions = 0  # Batches which ran into a contradiction.
+        self.active_propagations = 0  # Propagations of the unresolved cells only, late in the solve.
+
+    @property
+    def observe_time(self) -> float:
+        return self.location_time + self.pattern_time
+
+    def record_propagate(self, duration: float, iterations: int, collapsed: int) -> None:
+        self.propagate_time += duration
+        self.propagations += 1
+        self.propagate_iterations += iterations
+        self.max_propagate_iterations = max(self.max_propagate_iterations, iterations)
+        self.cells_collapsed_by_propagation += collapsed
+
+    def record_choice(self, collapsed: bool) -> None:
+        self.choices += 1
+        self.backtrack_depth = 0
+        if collapsed:
+            self.cells_collapsed_by_choice += 1
+
+    def record_backtrack(self) -> None:
+        self.backtracks += 1
+        self.backtrack_depth += 1
+        self.max_backtrack_depth = max(self.max_backtrack_depth, self.backtrack_depth)
+
+    def record_repair(self, cells: int) -> None:
+        self.repairs += 1
+        self.cells_repaired += cells
+
+    def record_batch(self, cells: int) -> None:
+        self.batches += 1
+        self.batched_choices += cells
+
+    def record_batch_contradiction(self) -> None:
+        self.batch_contradictions += 1
+
+    def record_memory(self, wave_bytes: int, history_depth: int, history_bytes: int) -> None:
+        self.peak_wave_bytes = max(self.peak_wave_bytes, wave_bytes)
+        self.max_history_depth = max(self.max_history_depth, history_depth)
+        self.peak_history_bytes = max(self.peak_history_bytes, history_bytes)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The stats as a flat dictionary, in the form used for the TSV log rows."""
+        return {
+            "propagate time": self.propagate_time,
+            "observe time": self.observe_time,
+            "location heuristic time": self.location_time,
+            "pattern heuristic time": self.pattern_time,
+            "propagations": self.propagations,
+            "propagate iterations": self.propagate_iterations,
+            "max propagate iterations": self.max_propagate_iterations,
+            "choices": self.choices,
+            "backtracks": self.backtracks,
+            "cells collapsed by choice": self.cells_collapsed_by_choice,
+            "cells collapsed by propagation": self.cells_collapsed_by_propagation,
+            "max backtrack depth": self.max_backtrack_depth,
+            "max history depth": self.max_history_depth,
+            "peak wave bytes": self.peak_wave_bytes,
+            "peak history bytes": self.peak_history_bytes,
+            "repairs": self.repairs,
+            "cells repaired": self.cells_repaired,
+            "batches": self.batches,
+            "batched choices": self.batched_choices,
+            "batch contradictions": self.batch_contradictions,
+            "active set propagations": self.active_propagations,
+        }
+
+    def __repr__(self) -> str:
+        return f"SolverStats({self.as_dict()!r})"
@@ -0,0 +1,235 @@
+"""Estimate, limit and measure the memory used by a solve."""
+#The wave has one byte per pattern per cell, and everything large the solver does is a
+# multiple of it: propagate holds a padded copy and one support array per direction,
+# and backtracking keeps a full copy of the wave for every choice it can undo. A
+# 1024x1024 output with a few hundred patterns therefore needs gigabytes before the
+# first choice is made, and with backtracking the worst case is a wave per cell.
+# estimate_solver_memory predicts this from the pattern count and output size alone, so
+# a run can be refused or reconfigured before it is started.
+from __future__ import annotations
+
+import argparse
+import logging
+import re
+import tracemalloc
+from typing import Dict, Literal, Optional, Tuple, TypedDict, Union
+
+logger = logging.getLogger(__name__)
+
+SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+class MemoryBudgetExceeded(Exception):
+    """The solve is estimated to need more memory than the budget allows."""
+
+    pass
+
+
+class MemoryPlan(TypedDict):
+    backtracking: bool
+    history_limit: Optional[int]
+    visualize: bool
+    estimate: Dict[str, int]
+
+
+def parse_size(size: Union[int, str]) -> int:
+    """Turn a byte count such as 512M or 8G (powers of 1024) into an int."""
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size.upper())
+    if not match:
+        raise ValueError(f"Can not read {size!r} as a memory size.")
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+def format_size(size: int) -> str:
+    for suffix in ("T", "G", "M", "K"):
+        if size >= SIZE_SUFFIXES[suffix]:
+            return f"{size / SIZE_SUFFIXES[suffix]:.1f}{suffix}"
+    return f"{size}B"
+
+
+def estimate_solver_memory(
+    number_of_patterns: int,
+    output_size: Tuple[int, int],
+    *,
+    backtracking: bool = False,
+    history_limit: Optional[int] = None,
+    visualize: bool = False,
+    render_workers: int = 0,
+    tile_size: int = 1,
+    color_channels: int = 3,
+    directions: int = 4,
+) -> Dict[str, int]:
+    """Estimate the peak bytes of a solve, broken down by what holds them.
+
+    The terms are upper bounds measured against the current implementation:
+    the history assumes every cell is collapsed by a choice, and the adjacency
+    assumes every pair of patterns is compatible.
+    """
+    width, height = output_size
+    cells = width * height
+    wave_bytes = number_of_patterns * cells
+    estimate = {
+        # execute_wfc keeps the initial wave, the solver works on a copy.
+        "wave": 2 * wave_bytes,
+        # Two padded waves (the previous pass's is still referenced while the next is made),
+        # one support per direction, the reshaped copy fed to the matmul and its result,
+        # and the int64 per-cell counts of the contradiction check.
+        "propagate": 2 * number_of_patterns * (width + 2) * (height + 2) + (directions + 2) * wave_bytes + 2 * 8 * cells,
+        # A few int64/float64 maps of the output, e.g. the pattern counts per cell.
+        "heuristics": 3 * 8 * cells,
+        # Dense and sparse (data plus int32 indices) adjacency for every direction.
+        "adjacency": 6 * directions * number_of_patterns * number_of_patterns,
+        "history": 0,
+        "visualizer": 0,
+    }
+    if backtracking:
+        snapshots = cells if history_limit is None else min(history_limit, cells)
+        estimate["history"] = snapshots * wave_bytes
+    if visualize:
+        # wave_to_average_image works on a float64 copy of the wave and a float64 image.
+        pixels = cells * tile_size * tile_size * color_channels
+        estimate["visualizer"] = max(1, render_workers) * (8 * wave_bytes + 2 * 8 * pixels)
+    estimate["total"] = sum(estimate.values())
+    return estimate
+
+
+def plan_memory(
+    budget: Union[int, str],
+    number_of_patterns: int,
+    output_size: Tuple[int, int],
+    *,
+    backtracking: bool = False,
+    visualize: bool = False,
+    policy: Literal["adapt", "raise"] = "adapt",
+    **estimate_options,
+) -> MemoryPlan:
+    """Fit a solve into the memory budget.
+
+    With policy "raise" a MemoryBudgetExceeded is raised when the estimate is
+    over budget.  With "adapt" the visualizer is dropped first, then the
+    backtracking history is limited to the snapshots that fit (or backtracking
+    is switched off), and only if the solve still does not fit is it refused.
+    """
+    budget = parse_size(budget)
+    estimate = estimate_solver_memory(
+        number_of_patterns, output_size, backtracking=backtracking, visualize=visualize, **estimate_options
+    )
+    plan: MemoryPlan = {"backtracking": backtracking, "history_limit": None, "visualize": visualize, "estimate": estimate}
+    if estimate["total"] <= budget:
+        return plan
+    breakdown = ", ".join(f"{k} {format_size(v)}" for k, v in estimate.items())
+    if policy == "raise":
+        raise MemoryBudgetExceeded(f"Estimated {breakdown}, over the budget of {format_size(budget)}.")
+
+    if visualize:
+        logger.warning("Turning visualization off to stay within the memory budget.")
+        plan["visualize"] = False
+    if backtracking:
+        without_history = estimate_solver_memory(
+            number_of_patterns, output_size, backtracking=False, visualize=False, **estimate_options
+        )["total"]
+        wave_bytes = number_of_patterns * output_size[0] * output_size[1]
+        history_limit = (budget - without_history) // wave_bytes
+        if history_limit >= 1:
+            logger.warning(f"Limiting the backtracking history to {history_limit} snapshots to stay within the memory budget.")
+            plan["history_limit"] = history_limit
+        else:
+            logger.warning("Turning backtracking off to stay within the memory budget.")
+            plan["backtracking"] = False
+    plan["estimate"] = estimate_solver_memory(
+        number_of_patterns,
+        output_size,
+        backtracking=plan["backtracking"],
+        history_limit=plan["history_limit"],
+        visualize=plan["visualize"],
+        **estimate_options,
+    )
+    if plan["estimate"]["total"] > budget:
+        breakdown = ", ".join(f"{k} {format_size(v)}" for k, v in plan["estimate"].items())
+        raise MemoryBudgetExceeded(
+            f"Estimated {breakdown} without visualization or backtracking, over the budget of {format_size(budget)}."
+        )
+    return plan
+
+
+class PeakMemory:
+    """Measures the peak memory allocated (by Python and numpy) inside a with block, using tracemalloc."""
+
+    def __init__(self) -> None:
+        self.peak = 0
+        self._was_tracing = False
+
+    def __enter__(self) -> PeakMemory:
+        self._was_tracing = tracemalloc.is_tracing()
+        if not self._was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.peak = tracemalloc.get_traced_memory()[1] - self._baseline
+        if not self._was_tracing:
+            tracemalloc.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Estimate the peak memory of a WFC solve before running it.")
+    parser.add_argument("--patterns", type=int, default=None, help="The number of patterns in the model.")
+    parser.add_argument("--image", type=str, default=None, help="Count the patterns of this input image instead.")
+    parser.add_argument("-N", "--pattern-width", type=int, default=2)
+    parser.add_argument("--rotations", type=int, default=8)
+    parser.add_argument("--tile-size", type=int, default=1)
+    parser.add_argument("--size", type=int, nargs=2, default=[48, 48], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--backtracking", action="store_true")
+    parser.add_argument("--visualize", action="store_true")
+    parser.add_argument("--budget", type=str, default=None, help="E.g. 8G, show how the run would be adapted to it.")
+    args = parser.parse_args()
+
+    if args.image:
+        import imageio  # type: ignore
+        from .wfc_model import compile_model
+
+        image = imageio.imread(args.image)[:, :, :3]
+        number_of_patterns = compile_model(
+            image, tile_size=args.tile_size, pattern_width=args.pattern_width, rotations=args.rotations - 1
+        ).number_of_patterns
+    elif args.patterns:
+        number_of_patterns = args.patterns
+    else:
+        parser.error("Give --patterns or --image.")
+
+    output_size = (args.size[0], args.size[1])
+    estimate = estimate_solver_memory(
+        number_of_patterns,
+        output_size,
+        backtracking=args.backtracking,
+        visualize=args.visualize,
+        tile_size=args.tile_size,
+    )
+    print(f"{number_of_patterns} patterns, {output_size[0]}x{output_size[1]} output")
+    for name, size in estimate.items():
+        print(f"{name:>12} {format_size(size):>10}")
+    if args.budget:
+        try:
+            plan = plan_memory(
+                args.budget,
+                number_of_patterns,
+                output_size,
+                backtracking=args.backtracking,
+                visualize=args.visualize,
+                tile_size=args.tile_size,
+            )
+        except MemoryBudgetExceeded as exc:
+            print(f"Refused: {exc}")
+        else:
+            print(
+                f"Within {args.budget}: backtracking {plan['backtracking']}, history limit {plan['history_limit']}, "
+                f"visualize {plan['visualize']}, total {format_size(plan['estimate']['total'])}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""Compiled WFC models which can be saved to disk and reloaded quickly."""
+#This module bundles everything the solver needs (patterns, weights, adjacency and tiles)
+# so that the preprocessing only has to happen once per input. The saved format is a
+# directory of .npy arrays plus a small JSON header, so loading is a handful of np.load
+# calls with mmap_mode="r" and does not depend on matplotlib, scipy or imageio.
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List, Literal, Mapping, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from .wfc_tiles import make_tile_catalog, make_tile_atlas, render_tile_indices, tile_grid_to_indices
+from .wfc_patterns import make_pattern_catalog_with_rotations
+from .wfc_adjacency import adjacency_extraction
+from .wfc_quantize import MAX_COLORS, quantize, quantize_to_budget
+from .wfc_solver import Contradiction
+
+MODEL_FORMAT = "wfc-model"
+MODEL_FORMAT_VERSION = 1
+MODEL_HEADER = "model.json"
+
+# TODO: generalize this to more than the four cardinal directions
+CARDINAL_DIRECTIONS: List[Tuple[int, int]] = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+
+
+class ModelFormatError(Exception):
+    """The saved model is missing, damaged, or was written by an incompatible version."""
+
+    pass
+
+
+class WFCModel:
+    """The preprocessed input of a WFC run: patterns, weights, adjacency and tiles.
+
+    Patterns are referred to by their dense index, i.e. the position in
+    pattern_ids.  adjacency[d, a, b] is True when pattern b may be placed at
+    offset directions[d] from pattern a.
+    """
+
+    def __init__(
+        self,
+        *,
+        pattern_ids: NDArray[np.int64],
+        pattern_contents: NDArray[np.int64],
+        weights: NDArray[np.float64],
+        directions: NDArray[np.int64],
+        adjacency: Optional[NDArray[np.bool_]] = None,
+        adjacency_bits: Optional[NDArray[np.uint8]] = None,
+        tile_ids: NDArray[np.int64],
+        tile_atlas: NDArray[np.integer],
+        ground: Optional[NDArray[np.int64]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        if adjacency is None and adjacency_bits is None:
+            raise TypeError("Either adjacency or adjacency_bits must be given.")
+        self.pattern_ids = pattern_ids
+        self.pattern_contents = pattern_contents
+        self.weights = weights
+        self.directions = directions
+        self._adjacency = adjacency
+        self._adjacency_bits = adjacency_bits
+        self.tile_ids = tile_ids
+        self.tile_atlas = tile_atlas
+        self.ground = ground
+        self.metadata: Dict[str, Any] = dict(metadata or {})
+        self._pattern_tile_indices: Optional[NDArray[np.intp]] = None
+        self._compressed: Optional[Tuple[WFCModel, NDArray[np.int64]]] = None
+        self.domain_cache: Dict[Any, NDArray[np.uint8]] = {}  # Compiled initial waves, see wfc_constraints.
+
+    @property
+    def number_of_patterns(self) -> int:
+        return len(self.pattern_ids)
+
+    @property
+    def tile_size(self) -> int:
+        return self.tile_atlas.shape[1]
+
+    @property
+    def pattern_width(self) -> int:
+        return self.pattern_contents.shape[1]
+
+    @property
+    def adjacency(self) -> NDArray[np.bool_]:
+        """Dense adjacency of shape (directions, patterns, patterns), unpacked on first use."""
+        if self._adjacency is None:
+            assert self._adjacency_bits is not None
+            self._adjacency = np.unpackbits(
+                self._adjacency_bits, axis=-1, count=self.number_of_patterns
+            ).astype(np.bool_)
+        return self._adjacency
+
+    @property
+    def adjacency_bits(self) -> NDArray[np.uint8]:
+        """The adjacency with each row packed into a bitset."""
+        if self._adjacency_bits is None:
+            assert self._adjacency is not None
+            self._adjacency_bits = np.packbits(self._adjacency, axis=-1)
+        return self._adjacency_bits
+
+    @property
+    def direction_offsets(self) -> List[Tuple[int, Tuple[int, int]]]:
+        return list(enumerate((int(dx), int(dy)) for dx, dy in self.directions))
+
+    @property
+    def pattern_catalog(self) -> Dict[int, NDArray[np.int64]]:
+        """Pattern hashes to their constituent tiles, as made by make_pattern_catalog."""
+        return {int(p): self.pattern_contents[i] for i, p in enumerate(self.pattern_ids)}
+
+    @property
+    def pattern_weights(self) -> Dict[int, float]:
+        return {int(p): self.weights[i].item() for i, p in enumerate(self.pattern_ids)}
+
+    @property
+    def tile_catalog(self) -> Dict[int, NDArray[np.integer]]:
+        """Tile hashes to tile pixels, as made by make_tile_catalog."""
+        return {int(t): self.tile_atlas[i] for i, t in enumerate(self.tile_ids)}
+
+    @property
+    def pattern_tiles(self) -> NDArray[np.int64]:
+        """The hash of the anchor tile each pattern places, indexed by pattern."""
+        return self.pattern_contents[:, 0, 0]
+
+    @property
+    def pattern_tile_indices(self) -> NDArray[np.intp]:
+        """The atlas index of the anchor tile each pattern places, indexed by pattern."""
+        if self._pattern_tile_indices is None:
+            self._pattern_tile_indices = tile_grid_to_indices(self.pattern_tiles, self.tile_ids)
+        return self._pattern_tile_indices
+
+    def solution_to_image(self, solution: NDArray[np.integer]) -> NDArray[np.integer]:
+        """Turn a grid of pattern indices, as returned by the solver, into an image."""
+        return render_tile_indices(self.pattern_tile_indices[solution], self.tile_atlas)
+
+    def compressed(self) -> Tuple[WFCModel, NDArray[np.int64]]:
+        """The model of the pattern classes (see pattern_classes), and the class of each pattern.
+
+        A class is represented by its first pattern and weighs as much as all
+        of its patterns together.  Made on first use.
+        """
+        if self._compressed is None:
+            classes = pattern_classes(self.adjacency, self.ground)
+            first = np.unique(classes, return_index=True)[1]
+            class_model = WFCModel(
+                pattern_ids=self.pattern_ids[first],
+                pattern_contents=self.pattern_contents[first],
+                weights=np.bincount(classes, weights=self.weights, minlength=len(first)).astype(np.float64),
+                directions=self.directions,
+                adjacency=self.adjacency[:, first][:, :, first],
+                tile_ids=self.tile_ids,
+                tile_atlas=self.tile_atlas,
+                ground=None if self.ground is None else np.unique(classes[self.ground]),
+                metadata={**self.metadata, "compressed from": self.number_of_patterns},
+            )
+            self._compressed = (class_model, classes)
+        return self._compressed
+
+    def adjacency_matrices(self) -> Dict[Tuple[int, int], Any]:
+        """Sparse adjacency matrices keyed by direction, in the form used by the solver."""
+        from scipy import sparse  # type: ignore
+
+        return {
+            direction: sparse.csr_matrix(self.adjacency[d])
+            for d, direction in self.direction_offsets
+        }
+
+    def adjacency_relations(self) -> List[Tuple[Tuple[int, int], int, int]]:
+        """List the legal adjacencies as (direction, pattern hash, pattern hash) triples."""
+        legal = []
+        for d, direction in self.direction_offsets:
+            for a, b in zip(*np.nonzero(self.adjacency[d])):
+                legal.append((direction, int(self.pattern_ids[a]), int(self.pattern_ids[b])))
+        return legal
+
+    def _arrays(self) -> Dict[str, NDArray[Any]]:
+        arrays: Dict[str, NDArray[Any]] = {
+            "pattern_ids": self.pattern_ids,
+            "pattern_contents": self.pattern_contents,
+            "weights": self.weights,
+            "directions": self.directions,
+            "adjacency_bits": self.adjacency_bits,
+            "tile_ids": self.tile_ids,
+            "tile_atlas": self.tile_atlas,
+        }
+        if self.ground is not None:
+            arrays["ground"] = self.ground
+        return arrays
+
+    def save(self, path: str) -> None:
+        """Write the model to the directory at path, replacing any model already there."""
+        os.makedirs(path, exist_ok=True)
+        arrays = self._arrays()
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(array))
+        header = {
+            "format": MODEL_FORMAT,
+            "version": MODEL_FORMAT_VERSION,
+            "number_of_patterns": self.number_of_patterns,
+            "arrays": sorted(arrays),
+            "metadata": self.metadata,
+        }
+        # The header is written last and atomically, so a model is never seen half-written.
+        header_tmp = os.path.join(path, MODEL_HEADER + ".tmp")
+        with open(header_tmp, "w", encoding="utf_8") as headerf:
+            json.dump(header, headerf, indent=1)
+        os.replace(header_tmp, os.path.join(path, MODEL_HEADER))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> WFCModel:
+        """Read a model written by save.  With mmap the arrays are memory-mapped read-only."""
+        try:
+            with open(os.path.join(path, MODEL_HEADER), encoding="utf_8") as headerf:
+                header = json.load(headerf)
+        except (OSError, ValueError) as exc:
+            raise ModelFormatError(f"Can not read model header in {path}: {exc}") from exc
+        if header.get("format") != MODEL_FORMAT:
+            raise ModelFormatError(f"{path} is not a WFC model.")
+        if header.get("version") != MODEL_FORMAT_VERSION:
+            raise ModelFormatError(
+                f"{path} has model format version {header.get('version')}, expected {MODEL_FORMAT_VERSION}."
+            )
+        mmap_mode: Optional[Literal["r"]] = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in header["arrays"]
+        }
+        return cls(**arrays, metadata=header.get("metadata"))
+
+
+def supported_patterns(adjacency: NDArray[np.bool_]) -> NDArray[np.bool_]:
+    """The patterns which can appear in a periodic output, by arc consistency on the adjacency itself.
+
+    A pattern is dropped when in some direction none of the patterns still
+    kept may be next to it, until no more are dropped.
+    """
+    supported = np.ones(adjacency.shape[1], dtype=np.bool_)
+    while True:
+        kept = supported & adjacency[:, :, supported].any(axis=2).all(axis=0)
+        if (kept == supported).all():
+            return supported
+        supported = kept
+
+
+def pattern_classes(adjacency: NDArray[np.bool_], ground: Optional[NDArray[np.int64]] = None) -> NDArray[np.int64]:
+    """The class of each pattern, numbered in the order of the first pattern of each class.
+
+    Patterns are in one class when they may be next to the same patterns in
+    every direction, and have the same patterns next to them, and are all
+    ground patterns or none.  Propagation can not tell them apart.
+    """
+    number_of_patterns = adjacency.shape[1]
+    signature = [
+        adjacency.transpose(1, 0, 2).reshape(number_of_patterns, -1),
+        adjacency.transpose(2, 0, 1).reshape(number_of_patterns, -1),
+    ]
+    if ground is not None:
+        is_ground = np.zeros((number_of_patterns, 1), dtype=np.bool_)
+        is_ground[ground] = True
+        signature.append(is_ground)
+    _, first, inverse = np.unique(
+        np.packbits(np.concatenate(signature, axis=1), axis=1), axis=0, return_index=True, return_inverse=True
+    )
+    # np.unique orders the classes by signature
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse.reshape(-1)]
+
+
+def compress_wave(wave: NDArray[np.bool_], classes: NDArray[np.int64]) -> NDArray[np.bool_]:
+    """The wave over pattern classes: a class is possible in a cell when any of its patterns is."""
+    order = np.argsort(classes, kind="stable")
+    starts = np.searchsorted(classes[order], np.arange(classes.max() + 1))
+    return np.logical_or.reduceat(wave[order], starts, axis=0)
+
+
+def expand_solution(
+    solution: NDArray[np.integer],
+    classes: NDArray[np.int64],
+    weights: NDArray[np.float64],
+    domain: Optional[NDArray[np.bool_]] = None,
+) -> NDArray[np.int64]:
+    """Draw a pattern of its class for each cell of a solution over classes, in proportion to the weights.
+
+    With domain (the wave over patterns the classes were compressed from),
+    only the patterns it allows in a cell are drawn there.  The patterns of
+    a class are interchangeable, so drawing them now instead of when each
+    cell was observed makes no difference to which solutions can come out.
+    """
+    first = np.unique(classes, return_index=True)[1]
+    expanded = first[solution]
+    for c in np.flatnonzero(np.bincount(classes) > 1):
+        xs, ys = np.nonzero(solution == c)
+        if len(xs) == 0:
+            continue
+        members = np.flatnonzero(classes == c)
+        member_weights = np.repeat(weights[members, None], len(xs), axis=1)
+        if domain is not None:
+            member_weights *= domain[members[:, None], xs, ys]
+        cumulative = np.cumsum(member_weights, axis=0)
+        draw = np.random.random_sample(len(xs)) * cumulative[-1]
+        expanded[xs, ys] = members[(cumulative > draw).argmax(axis=0)]
+    return expanded
+
+
+def compile_model(
+    image: NDArray[np.integer],
+    tile_size: int = 1,
+    pattern_width: int = 2,
+    rotations: int = 7,
+    input_periodic: bool = True,
+    ground: Optional[int] = None,
+    metadata: Optional[Mapping[str, Any]] = None,
+    prune: bool = True,
+    output_periodic: bool = True,
+    colors: Optional[int] = None,
+    pattern_budget: Optional[int] = None,
+) -> WFCModel:
+    """Run the tile, pattern and adjacency extraction on an image and collect the results.
+
+    rotations is zero-based, as in make_pattern_catalog_with_rotations.
+    With prune and output_periodic, the patterns which can never be
+    surrounded by others (see supported_patterns) are left out, as the first
+    propagation of a periodic output would remove them anyway.  Raises
+    Contradiction when that leaves no pattern, or no ground pattern, as then
+    no output can be solved.  A non-periodic output is padded at its edges,
+    where any pattern may stand, so for one nothing is pruned.
+    With colors, the image is first quantized to that many colors.  With
+    pattern_budget, it is quantized to the most colors (up to colors, or
+    wfc_quantize.MAX_COLORS) that give at most that many patterns, see
+    quantize_to_budget.
+    """
+    direction_offsets = list(enumerate(CARDINAL_DIRECTIONS))
+
+    if pattern_budget is not None:
+        image, colors = quantize_to_budget(
+            image, pattern_budget, tile_size, pattern_width, rotations, input_periodic, max_colors=colors or MAX_COLORS
+        )
+    elif colors is not None:
+        image = quantize(image, colors)
+
+    tile_catalog, tile_grid, _code_list, _unique_tiles = make_tile_catalog(image, tile_size)
+    (
+        pattern_catalog,
+        pattern_weights,
+        pattern_list,
+        pattern_grid,
+    ) = make_pattern_catalog_with_rotations(
+        tile_grid, pattern_width, input_is_periodic=input_periodic, rotations=rotations
+    )
+    adjacency_relations = adjacency_extraction(
+        pattern_grid,
+        pattern_catalog,
+        direction_offsets,
+        (pattern_width, pattern_width),
+    )
+
+    number_of_patterns = len(pattern_list)
+    encode_patterns = {x: i for i, x in enumerate(pattern_list)}
+    encode_directions = {j: i for i, j in direction_offsets}
+
+    adjacency = np.zeros(
+        (len(direction_offsets), number_of_patterns, number_of_patterns), dtype=np.bool_
+    )
+    for direction, pattern1, pattern2 in adjacency_relations:
+        adjacency[
+            encode_directions[direction], encode_patterns[pattern1], encode_patterns[pattern2]
+        ] = True
+
+    weights: NDArray[np.float64] = np.zeros((number_of_patterns), dtype=np.float64)
+    for w_id, w_val in pattern_weights.items():
+        weights[encode_patterns[w_id]] = w_val
+
+    ground_list: Optional[NDArray[np.int64]] = None
+    if ground:
+        ground_list = np.array(
+            [encode_patterns[x] for x in pattern_grid.flat[(ground - 1) :]], dtype=np.int64
+        )
+        if ground_list.size == 0:
+            ground_list = None
+
+    pruned = 0
+    if prune and output_periodic:
+        # Every attempt would remove these in its first propagation, and a model without any is infeasible
+        supported = supported_patterns(adjacency)
+        pruned = int(number_of_patterns - supported.sum())
+        if not supported.any():
+            raise Contradiction(
+                f"None of the {number_of_patterns} patterns can be surrounded by others, no output can be solved."
+            )
+        if pruned:
+            kept = np.flatnonzero(supported)
+            renumber = np.full(number_of_patterns, -1, dtype=np.int64)
+            renumber[kept] = np.arange(len(kept))
+            pattern_list = pattern_list[kept]
+            adjacency = adjacency[:, kept][:, :, kept]
+            weights = weights[kept]
+            if ground_list is not None:
+                ground_list = renumber[ground_list]
+                ground_list = ground_list[ground_list >= 0]
+                if ground_list.size == 0:
+                    raise Contradiction("None of the ground patterns can be surrounded by others, no output can be solved.")
+
+    tile_ids, tile_atlas = make_tile_atlas(tile_catalog)
+    model_metadata: Dict[str, Any] = {
+        "tile_size": tile_size,
+        "pattern_width": pattern_width,
+        "rotations": rotations,
+        "input_periodic": input_periodic,
+        "ground": ground,
+        "pruned patterns": pruned,
+        "colors": colors,
+    }
+    model_metadata.update(metadata or {})
+
+    return WFCModel(
+        pattern_ids=np.asarray(pattern_list, dtype=np.int64),
+        pattern_contents=np.stack([pattern_catalog[p] for p in pattern_list]).astype(np.int64),
+        weights=weights,
+        directions=np.array(CARDINAL_DIRECTIONS, dtype=np.int64),
+        adjacency=adjacency,
+        tile_ids=tile_ids,
+        tile_atlas=tile_atlas,
+        ground=ground_list,
+        metadata=model_metadata,
+    )
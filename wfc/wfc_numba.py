@@ -0,0 +1,269 @@
+"""An optional backend which runs propagation and the entropy heuristic as numba-compiled loops."""
+#The numpy propagate recomputes the support of every pattern in every cell on each pass,
+# even when a step only changed a handful of cells. Here propagation is a worklist: only
+# the neighbours of cells that lost a pattern are checked again, one pattern at a time,
+# against the sparse adjacency rows. Both reach the same fixpoint (the largest arc
+# consistent subset of the wave), so a solve with the same seed makes the same choices.
+#
+#numba is only detected when this module is imported; the kernels are compiled the first
+# time they are used (and cached on disk by numba). Without numba the solver keeps the
+# numpy path. Sampling a pattern stays on numpy's global random state, which numba's
+# generator does not share, so that the draws, and with them the results, are the same.
+#
+#When a cell runs out of patterns, only that cell is reported in Contradiction.cells,
+# where the numpy path reports every cell emptied by its last pass, so repairs (which
+# start from those cells) can go differently on the two backends.
+from __future__ import annotations
+
+import importlib.util
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Callable, Collection, Literal, Mapping, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from .wfc_solver import Contradiction
+
+if TYPE_CHECKING:
+    from .wfc_instrumentation import SolverStats
+
+logger = logging.getLogger(__name__)
+
+HAVE_NUMBA = importlib.util.find_spec("numba") is not None
+
+Backend = Literal["numpy", "numba"]
+BACKENDS = ("numpy", "numba")
+
+
+def resolve_backend(backend: str) -> Backend:
+    """The backend to use for the one asked for, numpy when numba is not installed."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}.")
+    if backend == "numba" and HAVE_NUMBA:
+        return "numba"
+    if backend == "numba":
+        logger.warning("numba is not installed, using the numpy backend.")
+    return "numpy"
+
+
+def _propagate_cells(
+    wave: NDArray[np.bool_],
+    indptr: NDArray[np.int64],
+    indices: NDArray[np.int64],
+    offsets: NDArray[np.int64],
+    periodic: bool,
+    stack: NDArray[np.int64],
+    queued: NDArray[np.bool_],
+    pending: int,
+) -> Tuple[int, int, int]:
+    """Remove unsupported patterns, starting from the first pending cells of the stack.
+
+    Returns the number of patterns removed, the number of cells checked and
+    the index of the cell that was emptied, or -1.
+    """
+    number_of_patterns, width, height = wave.shape
+    directions = offsets.shape[0]
+    removed = 0
+    visits = 0
+    while pending > 0:
+        pending -= 1
+        cell = stack[pending]
+        x = cell // height
+        y = cell % height
+        queued[x, y] = False
+        visits += 1
+        changed = False
+        remaining = 0
+        for q in range(number_of_patterns):
+            if not wave[q, x, y]:
+                continue
+            supported = True
+            for d in range(directions):
+                row = d * number_of_patterns + q
+                nx = x + offsets[d, 0]
+                ny = y + offsets[d, 1]
+                if periodic:
+                    nx %= width
+                    ny %= height
+                elif nx < 0 or nx >= width or ny < 0 or ny >= height:
+                    # As the padding of the numpy path: off the edge, anything with a neighbour at all fits
+                    if indptr[row + 1] == indptr[row]:
+                        supported = False
+                        break
+                    continue
+                found = False
+                for k in range(indptr[row], indptr[row + 1]):
+                    if wave[indices[k], nx, ny]:
+                        found = True
+                        break
+                if not found:
+                    supported = False
+                    break
+            if supported:
+                remaining += 1
+            else:
+                wave[q, x, y] = False
+                removed += 1
+                changed = True
+        if remaining == 0:
+            return removed, visits, cell
+        if changed:
+            # The cells which have this one as a neighbour may have lost their support
+            for d in range(directions):
+                mx = x - offsets[d, 0]
+                my = y - offsets[d, 1]
+                if periodic:
+                    mx %= width
+                    my %= height
+                elif mx < 0 or mx >= width or my < 0 or my >= height:
+                    continue
+                if not queued[mx, my]:
+                    queued[mx, my] = True
+                    stack[pending] = mx * height + my
+                    pending += 1
+    return removed, visits, -1
+
+
+def _entropy_location(wave: NDArray[np.bool_], preferences: NDArray[np.float64]) -> Tuple[int, int]:
+    """makeEntropyLocationHeuristic as one loop, with the same tie breaking as argmin."""
+    number_of_patterns, width, height = wave.shape
+    best = np.inf
+    best_x = 0
+    best_y = 0
+    for x in range(width):
+        for y in range(height):
+            count = 0
+            for p in range(number_of_patterns):
+                if wave[p, x, y]:
+                    count += 1
+            if count > 1:
+                weight = preferences[x, y] + count
+                if weight < best:
+                    best = weight
+                    best_x = x
+                    best_y = y
+    return best_x, best_y
+
+
+_compiled: Optional[Tuple[Callable[..., Tuple[int, int, int]], Callable[..., Tuple[int, int]]]] = None
+
+
+def kernels(jit: bool = True) -> Tuple[Callable[..., Tuple[int, int, int]], Callable[..., Tuple[int, int]]]:
+    """The propagation and entropy kernels, compiled on first use.
+
+    With jit False they are returned as plain Python, which is far too slow
+    for real outputs but runs the same code without numba.
+    """
+    global _compiled
+    if not jit:
+        return _propagate_cells, _entropy_location
+    if _compiled is None:
+        import numba  # type: ignore
+
+        compile_kernel = numba.njit(cache=True, nogil=True)
+        _compiled = (compile_kernel(_propagate_cells), compile_kernel(_entropy_location))
+    return _compiled
+
+
+def warm_up() -> float:
+    """Compile (or load from numba's cache) the kernels now, returning the seconds it took."""
+    time_start = time.perf_counter()
+    propagate_kernel, entropy_kernel = kernels()
+    wave = np.ones((2, 2, 2), dtype=np.bool_)
+    indptr = np.array([0, 1, 2], dtype=np.int64)
+    propagate_kernel(
+        wave, indptr, indptr[:2], np.array([[0, 1]], dtype=np.int64), True,
+        np.arange(4, dtype=np.int64), np.ones((2, 2), dtype=np.bool_), 4,
+    )
+    entropy_kernel(wave, np.zeros((2, 2), dtype=np.float64))
+    return time.perf_counter() - time_start
+
+
+def sparse_adjacency(
+    adj: Mapping[Tuple[int, int], Any]
+) -> Tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.int64]]:
+    """The adjacency as the direction offsets and one CSR matrix of the rows of every direction.
+
+    Row d * P + q lists the patterns which may be next to pattern q in
+    direction d.
+    """
+    from scipy import sparse  # type: ignore
+
+    directions = list(adj)
+    offsets = np.array(directions, dtype=np.int64).reshape(-1, 2)
+    stacked = sparse.vstack([sparse.csr_matrix(adj[d], dtype=np.bool_) for d in directions], format="csr")
+    stacked.eliminate_zeros()
+    stacked.sort_indices()
+    return stacked.indptr.astype(np.int64), stacked.indices.astype(np.int64), offsets
+
+
+class NumbaPropagator:
+    """propagate() for one adjacency, on the compiled worklist kernel."""
+
+    def __init__(self, adj: Mapping[Tuple[int, int], Any], periodic: bool = False, jit: bool = True) -> None:
+        self.indptr, self.indices, self.offsets = sparse_adjacency(adj)
+        self.periodic = periodic
+        self.kernel, _ = kernels(jit)
+
+    def __call__(
+        self,
+        wave: NDArray[np.bool_],
+        changed: Optional[Collection[Tuple[int, int]]] = None,
+        onPropagate: Optional[Callable[[NDArray[np.bool_]], None]] = None,
+        stats: Optional[SolverStats] = None,
+    ) -> int:
+        """Propagate the changes to the given cells, or to every cell if None.
+
+        Returns the number of patterns removed, and raises Contradiction like
+        propagate().  The stats count checked cells as the iterations.
+        """
+        _, width, height = wave.shape
+        if stats is not None:
+            time_start = time.perf_counter()
+            unresolved_before = wave.sum(axis=0) > 1
+        queued = np.zeros((width, height), dtype=np.bool_)
+        stack = np.empty(width * height, dtype=np.int64)
+        if changed is None:
+            queued[:] = True
+            stack[:] = np.arange(width * height)
+            pending = width * height
+        else:
+            pending = 0
+            for x, y in changed:
+                for dx, dy in self.offsets.tolist():
+                    mx, my = x - dx, y - dy
+                    if self.periodic:
+                        mx, my = mx % width, my % height
+                    elif not (0 <= mx < width and 0 <= my < height):
+                        continue
+                    if not queued[mx, my]:
+                        queued[mx, my] = True
+                        stack[pending] = mx * height + my
+                        pending += 1
+        removed, visits, contradicted = self.kernel(
+            wave, self.indptr, self.indices, self.offsets, self.periodic, stack, queued, pending
+        )
+        if stats is not None:
+            collapsed = 0
+            if contradicted < 0:
+                collapsed = np.count_nonzero(unresolved_before & (wave.sum(axis=0) == 1))
+            stats.record_propagate(time.perf_counter() - time_start, visits, collapsed)
+        if onPropagate:
+            onPropagate(wave)
+        if contradicted >= 0:
+            cells = np.zeros((width, height), dtype=np.bool_)
+            cells[contradicted // height, contradicted % height] = True
+            raise Contradiction("Wave is in a contradictory state and can not be solved.", cells=cells)
+        return int(removed)
+
+
+def makeEntropyLocationHeuristic(
+    preferences: NDArray[np.floating[Any]], jit: bool = True
+) -> Callable[[NDArray[np.bool_]], Tuple[int, int]]:
+    _, kernel = kernels(jit)
+    preferences = np.ascontiguousarray(preferences, dtype=np.float64)
+
+    def entropyLocationHeuristic(wave: NDArray[np.bool_]) -> Tuple[int, int]:
+        x, y = kernel(wave, preferences)
+        return int(x), int(y)
+
+    return entropyLocationHeuristic
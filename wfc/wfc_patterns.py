@@ -3,7 +3,7 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict, Mapping, Optional, Tuple
+from typing import Dict, Mapping, Optional, Tuple
 from .wfc_utilities import hash_downto
 from collections import Counter
 import numpy as np
@@ -111,6 +111,19 @@ def rotate_grid(grid):
     return np.rot90(grid, axes=(1, 0))
 
 
+# Applied in turn to make the rotated and reflected copies of the input
+GRID_OPERATIONS = [
+    identity_grid,
+    reflect_grid,
+    rotate_grid,
+    reflect_grid,
+    rotate_grid,
+    reflect_grid,
+    rotate_grid,
+    reflect_grid,
+]
+
+
 def make_pattern_catalog_with_rotations(
     tile_grid: NDArray[np.int64], pattern_width: int, rotations: int = 7, input_is_periodic: bool = True
 ) -> Tuple[Dict[int, NDArray[np.int64]], Counter, NDArray[np.int64], NDArray[np.int64]]:
@@ -140,16 +153,7 @@ def make_pattern_catalog_with_rotations(
             merged_patch_codes = patch_codes.copy()
 
     counter = 0
-    grid_ops = [
-        identity_grid,
-        reflect_grid,
-        rotate_grid,
-        reflect_grid,
-        rotate_grid,
-        reflect_grid,
-        rotate_grid,
-        reflect_grid,
-    ]
+    grid_ops = GRID_OPERATIONS
     while counter <= (rotations):
         # logger.debug(rotated_tile_grid.shape)
         # logger.debug(np.array_equiv(reflect_grid(rotated_tile_grid.copy()), rotate_grid(rotated_tile_grid.copy())))
@@ -173,21 +177,39 @@ def make_pattern_catalog_with_rotations(
     )
 
 
+def count_patterns(
+    tile_grid: NDArray[np.int64], pattern_width: int, rotations: int = 7, input_is_periodic: bool = True
+) -> int:
+    """The number of patterns make_pattern_catalog_with_rotations finds, without building the catalog."""
+    rotated_tile_grid = tile_grid
+    pattern_codes = []
+    for grid_op in GRID_OPERATIONS[: rotations + 1]:
+        rotated_tile_grid = grid_op(rotated_tile_grid)
+        _, pattern_contents_list, _ = unique_patterns_2d(rotated_tile_grid, pattern_width, input_is_periodic)
+        pattern_codes.append(hash_downto(pattern_contents_list, 1))
+    return len(np.unique(np.concatenate(pattern_codes)))
+
+
 def pattern_grid_to_tiles(
     pattern_grid: NDArray[np.int64], pattern_catalog: Mapping[int, NDArray[np.int64]]
 ) -> NDArray[np.int64]:
+    """Replace each pattern hash in the grid with the hash of the pattern's anchor tile."""
+    pattern_ids, anchor_tiles = make_pattern_decode_table(pattern_catalog)
+    indices = np.searchsorted(pattern_ids, pattern_grid)
+    np.minimum(indices, len(pattern_ids) - 1, out=indices)
+    if not np.array_equal(pattern_ids[indices], pattern_grid):
+        raise KeyError("Pattern grid contains patterns which are not in the catalog.")
+    return anchor_tiles[indices]
+
+
+def make_pattern_decode_table(
+    pattern_catalog: Mapping[int, NDArray[np.int64]]
+) -> Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """Returns the sorted pattern hashes and, for each, the hash of its anchor tile."""
     anchor_x = 0
     anchor_y = 0
-
-    def pattern_to_tile(pattern: int) -> Any:
-        # if isinstance(pattern, list):
-        #     ptrns = []
-        #     for p in pattern:
-        #         logger.debug(p)
-        #         ptrns.push(pattern_to_tile(p))
-        #     logger.debug(ptrns)
-        #     assert False
-        #     return ptrns
-        return pattern_catalog[pattern][anchor_x][anchor_y]
-
-    return np.vectorize(pattern_to_tile)(pattern_grid)
+    pattern_ids = np.array(sorted(pattern_catalog.keys()), dtype=np.int64)
+    anchor_tiles = np.array(
+        [pattern_catalog[p][anchor_x][anchor_y] for p in pattern_ids], dtype=np.int64
+    ).reshape(pattern_ids.shape)
+    return pattern_ids, anchor_tiles
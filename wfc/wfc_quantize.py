@@ -0,0 +1,145 @@
+"""Colour quantization of the input image, to keep the number of tiles and patterns in check."""
+#EBSD maps colour each pixel by its crystal orientation, which varies a little inside every
+# grain, so nearly every pixel has a colour of its own and so does nearly every tile and
+# pattern. Quantizing the colours first merges them, as deformed_iron_wfc_run.py used to do
+# by hand with PIL.
+#
+#The quantization is a median cut: the box of colours with the widest range in one channel
+# is split at the median pixel along that channel, until there are enough boxes. It does
+# not draw random numbers, so the solver's seeded runs stay as they were. Each split
+# refines the boxes before it, so more colours can never mean fewer patterns, and
+# quantize_to_budget can bisect for the most colours that stay within a pattern budget.
+from __future__ import annotations
+
+from typing import Tuple
+import numpy as np
+from numpy.typing import NDArray
+from .wfc_tiles import make_tile_catalog
+from .wfc_patterns import count_patterns
+
+MAX_COLORS = 256
+
+
+def median_cut(
+    colors: NDArray[np.integer], counts: NDArray[np.int64], max_colors: int
+) -> Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """Split the distinct colors, with their pixel counts, into at most max_colors boxes.
+
+    Returns the box of each color and the box each box was split off from,
+    in the order of the splits (so parents[b] < b, and box 0 has itself as
+    parent).  There are fewer boxes when every box is down to one color.
+    """
+    values = colors.astype(np.float64)
+    boxes = np.zeros(len(colors), dtype=np.int64)
+    parents = np.zeros(max_colors, dtype=np.int64)
+    spread = np.zeros((max_colors, colors.shape[1]), dtype=np.float64)
+    spread[0] = values.max(axis=0) - values.min(axis=0)
+    for box in range(1, max_colors):
+        widest = spread[:box].max(axis=1)
+        target = int(widest.argmax())
+        if widest[target] <= 0:
+            return boxes, parents[:box]
+        channel = int(spread[target].argmax())
+        members = np.flatnonzero(boxes == target)
+        members = members[np.argsort(values[members, channel], kind="stable")]
+        cumulative = np.cumsum(counts[members])
+        cut = int(np.clip(np.searchsorted(cumulative, cumulative[-1] / 2), 1, len(members) - 1))
+        boxes[members[cut:]] = box
+        parents[box] = target
+        for b, part in ((target, members[:cut]), (box, members[cut:])):
+            spread[b] = values[part].max(axis=0) - values[part].min(axis=0)
+    return boxes, parents
+
+
+def merge_boxes(boxes: NDArray[np.int64], parents: NDArray[np.int64], number_of_boxes: int) -> NDArray[np.int64]:
+    """The boxes of median_cut as they were before every split past the first number_of_boxes."""
+    merged = boxes.copy()
+    while True:
+        later = merged >= number_of_boxes
+        if not later.any():
+            return merged
+        merged[later] = parents[merged[later]]
+
+
+def _palette_image(
+    image: NDArray[np.integer],
+    colors: NDArray[np.integer],
+    counts: NDArray[np.int64],
+    inverse: NDArray[np.int64],
+    boxes: NDArray[np.int64],
+) -> NDArray[np.integer]:
+    """Every pixel replaced by the mean color of its box, weighted by the pixel counts."""
+    number_of_boxes = boxes.max() + 1
+    totals = np.bincount(boxes, weights=counts, minlength=number_of_boxes)
+    palette = np.stack(
+        [np.bincount(boxes, weights=colors[:, c] * counts, minlength=number_of_boxes) for c in range(colors.shape[1])],
+        axis=1,
+    ) / totals[:, None]
+    palette = np.rint(palette).astype(image.dtype)
+    return palette[boxes[inverse]].reshape(image.shape)
+
+
+def _distinct_colors(image: NDArray[np.integer]) -> Tuple[NDArray[np.integer], NDArray[np.int64], NDArray[np.int64]]:
+    colors, inverse, counts = np.unique(
+        image.reshape(-1, image.shape[-1]), axis=0, return_inverse=True, return_counts=True
+    )
+    return colors, counts, inverse.reshape(-1)
+
+
+def quantize(image: NDArray[np.integer], number_of_colors: int) -> NDArray[np.integer]:
+    """The image with at most number_of_colors colors, by median cut."""
+    if number_of_colors < 1:
+        raise ValueError("An image needs at least one color.")
+    colors, counts, inverse = _distinct_colors(image)
+    boxes, _ = median_cut(colors, counts, number_of_colors)
+    return _palette_image(image, colors, counts, inverse, boxes)
+
+
+def count_image_patterns(
+    image: NDArray[np.integer],
+    tile_size: int = 1,
+    pattern_width: int = 2,
+    rotations: int = 7,
+    input_periodic: bool = True,
+) -> int:
+    """The number of patterns compile_model finds in the image, without working out the catalog or adjacency."""
+    _, tile_grid, _, _ = make_tile_catalog(image, tile_size)
+    return count_patterns(tile_grid, pattern_width, rotations, input_periodic)
+
+
+def quantize_to_budget(
+    image: NDArray[np.integer],
+    pattern_budget: int,
+    tile_size: int = 1,
+    pattern_width: int = 2,
+    rotations: int = 7,
+    input_periodic: bool = True,
+    max_colors: int = MAX_COLORS,
+) -> Tuple[NDArray[np.integer], int]:
+    """The image quantized to the most colors (up to max_colors) for which it has at most pattern_budget patterns.
+
+    Returns the image and its number of colors, which can have fewer
+    patterns than the budget allows but never more.  The pattern parameters are
+    those of compile_model, rotations zero-based.  Raises ValueError when
+    even a single color has too many patterns.
+    """
+    colors, counts, inverse = _distinct_colors(image)
+    boxes, parents = median_cut(colors, counts, max_colors)
+
+    def fits(number_of_colors: int) -> bool:
+        # Counted on the boxes rather than their mean colors, two of which may round to the same color
+        labels = merge_boxes(boxes, parents, number_of_colors)[inverse].reshape(image.shape[:-1] + (1,))
+        patterns = count_image_patterns(labels, tile_size, pattern_width, rotations, input_periodic)
+        return patterns <= pattern_budget
+
+    # The most colors that fit: low always fits, high + 1 never does
+    low, high = 1, len(parents)
+    if not fits(low):
+        raise ValueError(f"Even with a single color the image has more than {pattern_budget} patterns.")
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return _palette_image(image, colors, counts, inverse, merge_boxes(boxes, parents, low)), low
@@ -0,0 +1,468 @@
+"""A long-running generation server that keeps compiled models warm, and a client to load-test it."""
+#Calling execute_wfc from another process pays for the interpreter, the imports and the
+# model build every time. The server does each of those once: models are compiled on the
+# first request for them (or loaded from a folder of saved models), saved to a cache
+# folder and kept in an LRU cache, and the solves run on a pool of worker processes which
+# memory-map the saved models. It only listens on localhost.
+#
+#   python -m wfc.wfc_server serve --port 8765 --workers 4
+#   python -m wfc.wfc_server load --port 8765 --sample "Red Maze" --requests 200 --concurrency 8
+#
+# POST /generate takes a JSON job and answers with a PNG (or a .npy of the image array
+# with "format": "npy"); GET /models lists the cached models and GET /health answers ok.
+from __future__ import annotations
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict, cast
+import numpy as np
+from .wfc_model import WFCModel, compile_model
+from .wfc_solver import Contradiction, TimedOut
+
+logger = logging.getLogger(__name__)
+
+LocationHeuristic = Literal["lexical", "hilbert", "spiral", "entropy", "anti-entropy", "simple", "random"]
+PatternHeuristic = Literal["lexical", "rarest", "weighted", "random"]
+LOCATION_HEURISTICS = ["lexical", "hilbert", "spiral", "entropy", "anti-entropy", "simple", "random"]
+PATTERN_HEURISTICS = ["lexical", "rarest", "weighted", "random"]
+MAX_OUTPUT_CELLS = 1 << 20
+
+
+class BadRequest(Exception):
+    """The job is malformed, or asks for something that does not exist."""
+
+    pass
+
+
+class GenerationJob(TypedDict):
+    sample: Optional[str]  # An image in the sample folder, compiled with the settings below.
+    model: Optional[str]  # Or the name of a saved model in the model folder.
+    tile_size: int
+    pattern_width: int
+    symmetry: int
+    ground: int
+    periodic_input: bool
+    size: Tuple[int, int]
+    periodic_output: bool
+    seed: Optional[int]
+    loc: LocationHeuristic
+    choice: PatternHeuristic
+    backtracking: bool
+    attempts: int
+    time_limit: Optional[float]
+    format: Literal["png", "npy"]
+
+
+def parse_job(request: Dict[str, Any]) -> GenerationJob:
+    """Fill in the defaults of a job request and check its values."""
+    if not isinstance(request, dict):
+        raise BadRequest("The job must be a JSON object.")
+    job: GenerationJob = {
+        "sample": request.get("sample"),
+        "model": request.get("model"),
+        "tile_size": int(request.get("tile_size", 1)),
+        "pattern_width": int(request.get("pattern_width", 2)),
+        "symmetry": int(request.get("symmetry", 8)),
+        "ground": int(request.get("ground", 0)),
+        "periodic_input": bool(request.get("periodic_input", True)),
+        "size": (int(request.get("size", [48, 48])[0]), int(request.get("size", [48, 48])[1])),
+        "periodic_output": bool(request.get("periodic_output", True)),
+        "seed": None if request.get("seed") is None else int(request["seed"]),
+        # The heuristics are checked below
+        "loc": cast(LocationHeuristic, str(request.get("loc", "entropy"))),
+        "choice": cast(PatternHeuristic, str(request.get("choice", "weighted"))),
+        "backtracking": bool(request.get("backtracking", False)),
+        "attempts": int(request.get("attempts", 10)),
+        "time_limit": None if request.get("time_limit") is None else float(request["time_limit"]),
+        "format": request.get("format", "png"),
+    }
+    unknown = set(request) - set(job)
+    if unknown:
+        raise BadRequest(f"Unknown job fields: {', '.join(sorted(unknown))}.")
+    if (job["sample"] is None) == (job["model"] is None):
+        raise BadRequest("Give either a sample or a model.")
+    for name in (job["sample"], job["model"]):
+        if name is not None and (os.sep in name or name.startswith(".")):
+            raise BadRequest(f"{name!r} is not a valid name.")
+    if job["loc"] not in LOCATION_HEURISTICS or job["choice"] not in PATTERN_HEURISTICS:
+        raise BadRequest(f"Unknown heuristic {job['loc']}/{job['choice']}.")
+    if job["format"] not in ("png", "npy"):
+        raise BadRequest(f"Unknown format {job['format']!r}.")
+    if min(job["size"]) < 1 or job["size"][0] * job["size"][1] > MAX_OUTPUT_CELLS:
+        raise BadRequest(f"The size must be positive and at most {MAX_OUTPUT_CELLS} cells.")
+    if job["attempts"] < 1:
+        raise BadRequest("At least one attempt is needed.")
+    return job
+
+
+class ModelCache:
+    """Compiled models, least recently used dropped first.
+
+    Samples are compiled on first use and saved under cache_folder, so a model
+    dropped from memory (or from an earlier run of the server) is reloaded
+    instead of rebuilt.  Saved models in model_folder are only ever loaded.
+    """
+
+    def __init__(self, capacity: int, cache_folder: str, image_folder: str, model_folder: Optional[str] = None) -> None:
+        self.capacity = capacity
+        self.cache_folder = cache_folder
+        self.image_folder = image_folder
+        self.model_folder = model_folder
+        self.models: collections.OrderedDict[str, WFCModel] = collections.OrderedDict()
+        self.paths: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.build_locks: Dict[str, threading.Lock] = {}
+
+    def model_id(self, job: GenerationJob) -> str:
+        if job["model"] is not None:
+            return "model:" + job["model"]
+        # Only a model for periodic outputs is pruned, see compile_model
+        settings = [
+            job["sample"], job["tile_size"], job["pattern_width"], job["symmetry"], job["ground"], job["periodic_input"],
+            job["periodic_output"],
+        ]
+        return "sample:" + hashlib.sha1(json.dumps(settings).encode("utf_8")).hexdigest()[:16]
+
+    def _build(self, model_id: str, job: GenerationJob) -> Tuple[str, WFCModel]:
+        if job["model"] is not None:
+            if self.model_folder is None:
+                raise BadRequest("The server was started without a model folder.")
+            path = os.path.join(self.model_folder, job["model"])
+            if not os.path.isdir(path):
+                raise BadRequest(f"No saved model named {job['model']!r}.")
+            return path, WFCModel.load(path)
+        path = os.path.join(self.cache_folder, model_id.split(":")[1])
+        if os.path.exists(os.path.join(path, "model.json")):
+            return path, WFCModel.load(path)
+        image_filename = os.path.join(self.image_folder, f"{job['sample']}.png")
+        if not os.path.exists(image_filename):
+            raise BadRequest(f"No sample named {job['sample']!r}.")
+        import imageio  # type: ignore
+
+        image = imageio.imread(image_filename)[:, :, :3]
+        model = compile_model(
+            image,
+            tile_size=job["tile_size"],
+            pattern_width=job["pattern_width"],
+            rotations=job["symmetry"] - 1,
+            input_periodic=job["periodic_input"],
+            ground=job["ground"],
+            metadata={"filename": job["sample"]},
+            output_periodic=job["periodic_output"],
+        )
+        model.save(path)
+        return path, WFCModel.load(path)
+
+    def get(self, job: GenerationJob) -> Tuple[str, WFCModel]:
+        """The saved path and the model for a job, building it if needed."""
+        model_id = self.model_id(job)
+        with self.lock:
+            cached = self._lookup(model_id)
+            if cached is not None:
+                return cached
+            build_lock = self.build_locks.setdefault(model_id, threading.Lock())
+        # Only the builds of one model are serialized, so that two requests for it do not both
+        # compile it, while the warm models are served on.
+        with build_lock:
+            with self.lock:
+                cached = self._lookup(model_id)
+                if cached is not None:
+                    return cached
+                self.misses += 1
+            try:
+                path, model = self._build(model_id, job)
+            except BaseException:
+                with self.lock:
+                    self.build_locks.pop(model_id, None)
+                raise
+            # Cached before its build lock goes, so that a request in between finds one or the other
+            with self.lock:
+                self.models[model_id] = model
+                self.paths[model_id] = path
+                self.build_locks.pop(model_id, None)
+                while len(self.models) > self.capacity:
+                    evicted, _ = self.models.popitem(last=False)
+                    logger.debug(f"Dropping {evicted} from the model cache.")
+            return path, model
+
+    def _lookup(self, model_id: str) -> Optional[Tuple[str, WFCModel]]:
+        """A cached model, counted as a hit; call with the lock held."""
+        if model_id not in self.models:
+            return None
+        self.hits += 1
+        self.models.move_to_end(model_id)
+        return self.paths[model_id], self.models[model_id]
+
+    def describe(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "models": [
+                    {"id": model_id, "patterns": model.number_of_patterns, "metadata": model.metadata}
+                    for model_id, model in self.models.items()
+                ],
+            }
+
+
+@functools.lru_cache(maxsize=16)
+def _load_worker_model(path: str) -> WFCModel:
+    return WFCModel.load(path, mmap=True)
+
+
+def generate(job: GenerationJob, model: WFCModel) -> Tuple[bytes, Dict[str, Any]]:
+    """Solve one job, returning the encoded result and its stats."""
+    import wfc.wfc_control as wfc_control
+
+    attempt_stats: List[Dict[str, Any]] = []
+
+    def log_stats(stats: Dict[str, Any], _filename: str) -> None:
+        attempt_stats.append(stats)
+
+    if job["seed"] is None:
+        np.random.seed()
+    else:
+        np.random.seed(job["seed"])
+    image = wfc_control.execute_wfc(
+        model=model,
+        output_size=job["size"],
+        output_periodic=job["periodic_output"],
+        loc_heuristic=job["loc"],
+        choice_heuristic=job["choice"],
+        backtracking=job["backtracking"],
+        attempt_limit=job["attempts"],
+        time_limit=job["time_limit"],
+        log_stats_to_output=log_stats,
+    )
+    assert not isinstance(image, tuple)  # Only with return_solution
+    stats = {
+        "attempts": len(attempt_stats),
+        "solve_time": attempt_stats[-1]["solve duration"] if attempt_stats else None,
+        "patterns": model.number_of_patterns,
+    }
+    # execute_wfc's image is indexed [x, y], turn the grid of tiles (not the tiles) to rows first,
+    # which gives the same image execute_wfc writes to disk.
+    width, height = job["size"]
+    tile_size = model.tile_size
+    image = (
+        image.reshape(width, tile_size, height, tile_size, -1)
+        .transpose(2, 1, 0, 3, 4)
+        .reshape(height * tile_size, width * tile_size, -1)
+        .astype(np.uint8)
+    )
+    output = io.BytesIO()
+    if job["format"] == "npy":
+        np.save(output, image)
+    else:
+        import imageio  # type: ignore
+
+        imageio.imwrite(output, image, format="png")
+    return output.getvalue(), stats
+
+
+def generate_in_worker(job: GenerationJob, model_path: str) -> Tuple[bytes, Dict[str, Any]]:
+    return generate(job, _load_worker_model(model_path))
+
+
+class GenerationServer(http.server.ThreadingHTTPServer):
+    """An HTTP server on localhost which runs generation jobs on a process pool.
+
+    With workers=0 the jobs are solved in the request threads instead.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int, cache: ModelCache, workers: int = 1) -> None:
+        super().__init__(("127.0.0.1", port), GenerationRequestHandler)
+        self.cache = cache
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.requests_served = 0
+
+    def run_job(self, job: GenerationJob) -> Tuple[bytes, Dict[str, Any]]:
+        model_path, model = self.cache.get(job)
+        if self.pool is None:
+            return generate(job, model)
+        return self.pool.submit(generate_in_worker, job, model_path).result()
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+
+class GenerationRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: GenerationServer
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, data: Dict[str, Any]) -> None:
+        self.send_body(status, json.dumps(data).encode("utf_8"), "application/json")
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "requests": self.server.requests_served})
+        elif self.path == "/models":
+            self.send_json(200, self.server.cache.describe())
+        else:
+            self.send_json(404, {"error": f"No such endpoint {self.path}."})
+
+    def do_POST(self) -> None:
+        if self.path != "/generate":
+            self.send_json(404, {"error": f"No such endpoint {self.path}."})
+            return
+        time_begin = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = parse_job(json.loads(self.rfile.read(length) or b"{}"))
+        except (BadRequest, ValueError, TypeError, IndexError) as exc:
+            self.send_json(400, {"error": str(exc)})
+            return
+        try:
+            body, stats = self.server.run_job(job)
+        except BadRequest as exc:  # e.g. a sample or model that does not exist
+            self.send_json(400, {"error": str(exc)})
+            return
+        except (Contradiction, TimedOut) as exc:
+            self.send_json(422, {"error": f"No solution: {exc}"})
+            return
+        except Exception as exc:
+            logger.exception("Generation failed")
+            self.send_json(500, {"error": repr(exc)})
+            return
+        self.server.requests_served += 1
+        stats["time"] = time.perf_counter() - time_begin
+        content_type = "image/png" if job["format"] == "png" else "application/octet-stream"
+        self.send_body(200, body, content_type, {"X-WFC-Stats": json.dumps(stats)})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(format % args)
+
+
+def request_generation(url: str, job: Dict[str, Any], timeout: Optional[float] = None) -> Tuple[int, bytes, Dict[str, Any]]:
+    """POST a job to a server, returning the status, the body and the stats header."""
+    request = urllib.request.Request(
+        url.rstrip("/") + "/generate",
+        data=json.dumps(job).encode("utf_8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read(), json.loads(response.headers.get("X-WFC-Stats", "{}"))
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read(), {}
+
+
+def load_test(url: str, job: Dict[str, Any], requests: int, concurrency: int, vary_seed: bool = True) -> Dict[str, Any]:
+    """Send the job requests times from concurrency threads and summarize the latencies in seconds."""
+
+    def one(n: int) -> Tuple[float, int]:
+        request = dict(job, seed=job.get("seed", 0) + n) if vary_seed else job
+        time_begin = time.perf_counter()
+        status, _body, _stats = request_generation(url, request)
+        return time.perf_counter() - time_begin, status
+
+    time_begin = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall_time = time.perf_counter() - time_begin
+    latencies = np.array([latency for latency, status in results if status == 200])
+    summary: Dict[str, Any] = {
+        "requests": requests,
+        "succeeded": len(latencies),
+        "failed": collections.Counter(status for _latency, status in results if status != 200),
+        "wall_time": wall_time,
+        "throughput": len(latencies) / wall_time,
+    }
+    if len(latencies):
+        summary.update(
+            {
+                "p50": float(np.percentile(latencies, 50)),
+                "p90": float(np.percentile(latencies, 90)),
+                "p99": float(np.percentile(latencies, 99)),
+                "max": float(latencies.max()),
+            }
+        )
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve WFC generation over HTTP on localhost, or load-test a server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Run the server.")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Solver processes, 0 solves in the request threads.")
+    serve.add_argument("--cache-size", type=int, default=16, help="How many models to keep loaded.")
+    serve.add_argument("--cache-folder", type=str, default=None, help="Where compiled samples are saved, a temporary folder by default.")
+    serve.add_argument("--images", type=str, default="images/samples", help="The folder the sample images are in.")
+    serve.add_argument("--models", type=str, default=None, help="A folder of saved models, requested by folder name.")
+    load = commands.add_parser("load", help="Send requests to a running server and report the latency percentiles.")
+    load.add_argument("--url", type=str, default=None)
+    load.add_argument("--port", type=int, default=8765)
+    load.add_argument("--sample", type=str, default="Red Maze")
+    load.add_argument("--model", type=str, default=None)
+    load.add_argument("-N", "--pattern-width", type=int, default=2)
+    load.add_argument("--size", type=int, nargs=2, default=[32, 32], metavar=("WIDTH", "HEIGHT"))
+    load.add_argument("--requests", type=int, default=100)
+    load.add_argument("--concurrency", type=int, default=4)
+    load.add_argument("--same-seed", action="store_true", help="Send the same seed every time instead of counting up.")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        logging.basicConfig(level=logging.INFO)
+        with tempfile.TemporaryDirectory(prefix="wfc_server_") as temporary_folder:
+            cache = ModelCache(args.cache_size, args.cache_folder or temporary_folder, args.images, args.models)
+            server = GenerationServer(args.port, cache, workers=args.workers)
+            logger.info(f"Serving on http://127.0.0.1:{server.server_address[1]} with {args.workers} workers")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+    else:
+        url = args.url or f"http://127.0.0.1:{args.port}"
+        job: Dict[str, Any] = {"size": args.size, "seed": 0}
+        if args.model:
+            job["model"] = args.model
+        else:
+            job.update({"sample": args.sample, "pattern_width": args.pattern_width})
+        # One request first, so the model build is not counted in the latencies.
+        status, body, _stats = request_generation(url, job)
+        if status != 200:
+            parser.exit(1, f"The warm-up request failed with {status}: {body.decode('utf_8', 'replace')}\n")
+        summary = load_test(url, job, args.requests, args.concurrency, vary_seed=not args.same_seed)
+        print(f"{summary['succeeded']}/{summary['requests']} succeeded, {summary['throughput']:.1f} requests/s")
+        if summary["failed"]:
+            print(f"failed: {dict(summary['failed'])}")
+        if summary["succeeded"]:
+            print(
+                f"p50 {summary['p50'] * 1000:.1f}ms  p90 {summary['p90'] * 1000:.1f}ms  "
+                f"p99 {summary['p99'] * 1000:.1f}ms  max {summary['max'] * 1000:.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,23 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, TypeVar
-from scipy import sparse  # type: ignore
+from typing import (
+    TYPE_CHECKING, Any, Callable, Collection, Dict, Generator, Iterable, Iterator, List, Literal, Mapping, Optional, Tuple,
+    TypedDict, TypeVar,
+)
 import numpy
 import numpy as np
 import sys
 import math
 import itertools
+import time
+import concurrent.futures
+import threading
 from numpy.typing import NBitBase, NDArray
-from hilbertcurve.hilbertcurve import HilbertCurve  # type: ignore
+
+if TYPE_CHECKING:
+    from .wfc_instrumentation import SolverStats
+    from .wfc_trace import TraceRecorder
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +27,9 @@ T = TypeVar("T", bound=NBitBase)
 class Contradiction(Exception):
     """Solving could not proceed without backtracking/restarting."""
 
-    pass
+    def __init__(self, message: str = "", cells: Optional[NDArray[np.bool_]] = None) -> None:
+        super().__init__(message)
+        self.cells = cells  # The cells that ran out of patterns first, when known.
 
 
 class TimedOut(Exception):
@@ -34,6 +44,13 @@ class StopEarly(Exception):
     pass
 
 
+class SolveProgress(TypedDict):
+    step: int  # Steps (choices or backtracks) taken so far.
+    resolved: float  # The fraction of cells down to one pattern.
+    done: bool
+    wave: Optional[NDArray[Any]]  # A snapshot in the form asked for, on snapshot steps only.
+
+
 class Solver:
     """WFC Solver which can hold wave and backtracking state."""
 
@@ -48,22 +65,74 @@ class Solver:
         on_choice: Optional[Callable[[int, int, int], None]] = None,
         on_observe: Optional[Callable[[NDArray[numpy.bool_]], None]] = None,
         on_propagate: Optional[Callable[[NDArray[numpy.bool_]], None]] = None,
-        check_feasible: Optional[Callable[[NDArray[numpy.bool_]], bool]] = None
+        check_feasible: Optional[Callable[[NDArray[numpy.bool_]], bool]] = None,
+        trace: Optional[TraceRecorder] = None,
+        stats: Optional[SolverStats] = None,
+        history_limit: Optional[int] = None,
+        deadline: Optional[float] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        repair: bool = False,
+        repair_radius: int = 2,
+        repair_limit: int = 100,
+        backend: str = "numpy",
+        threads: int = 0,
+        batch_size: int = 1,
+        batch_spacing: int = 8,
+        active_set_threshold: Optional[float] = 0.8,
     ) -> None:
+        from .wfc_numba import NumbaPropagator, resolve_backend
+
+        if repair and trace is not None:
+            raise ValueError("Traces can not record repairs, trace without repair.")
+        if batch_size > 1 and trace is not None:
+            raise ValueError("Traces can not record batches of choices, trace with a batch size of 1.")
         self.wave = wave
         self.adj = adj
         self.periodic = periodic
         self.backtracking = backtracking
         self.history: List[NDArray[np.bool_]] = []  # An undo history for backtracking.
+        self.history_limit = history_limit  # Keep at most this many snapshots, dropping the oldest.
+        self.history_truncated = False
         self.on_backtrack = on_backtrack
         self.on_choice = on_choice
         self.on_observe = on_observe
         self.on_propagate = on_propagate
         self.check_feasible = check_feasible
+        self.trace = trace  # Optional binary log of choices, backtracks and propagations.
+        self.stats = stats  # Optional timers and counters, see wfc_instrumentation.
+        self.deadline = deadline  # A time.perf_counter() value after which solving stops.
+        self.should_stop = should_stop  # Polled before every step, e.g. threading.Event().is_set.
+        # Without backtracking, a contradiction can be repaired by resetting the cells around it
+        # to their initial domains. The radius doubles with every repair that fails straight away.
+        self.initial_wave = wave.copy() if repair and not backtracking else None
+        self.repair_radius = repair_radius
+        self.repair_limit = repair_limit
+        self.repairs = 0
+        self.repairs_in_a_row = 0
+        # The numba backend only propagates from the cells that changed since the wave was last
+        # consistent, see wfc_numba. Backtracks and repairs replace the wave, so check it all.
+        self.backend = resolve_backend(backend)
+        self.propagator = NumbaPropagator(adj, periodic) if self.backend == "numba" else None
+        self.consistent = False
+        # With threads > 1 the numpy propagate splits the wave into that many bands of rows
+        self.executor = band_executor(threads) if threads > 1 else None
+        self.bands = threads
+        # Collapse up to batch_size cells at least batch_spacing apart before each propagation.
+        # A batch that runs into a contradiction is undone and retried as one choice.
+        self.batch_size = batch_size
+        self.batch_spacing = batch_spacing
+        self.batch_failed = False
+        # Once this fraction of the cells is resolved, the numpy propagate only visits the
+        # unresolved ones, listed in active (flat indices). Needs a symmetric adjacency.
+        self.active_set_threshold = active_set_threshold if is_symmetric(adj) else None
+        self.active: Optional[NDArray[np.int64]] = None
+        self.steps = 0
 
     @property
     def is_solved(self) -> bool:
         """Is True if the wave has been fully resolved."""
+        if self.active is not None:
+            return len(self.active) == 0
         return self.wave.sum() == self.wave.shape[1] * self.wave.shape[2] and (self.wave.sum(axis=0) == 1).all()
 
     # Important
@@ -75,32 +144,143 @@ class Solver:
         """Attempt to collapse one wave.  Returns True if no more steps remain."""
         if self.is_solved:
             return True
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise TimedOut("Solving took longer than the time limit.")
+        if self.should_stop is not None and self.should_stop():
+            raise StopEarly("Solving was cancelled.")
         if self.check_feasible and not self.check_feasible(self.wave):
             raise Contradiction("Not feasible.")
         if self.backtracking:
             self.history.append(self.wave.copy())
-        propagate(self.wave, self.adj, periodic=self.periodic, onPropagate=self.on_propagate)
+            if self.history_limit is not None and len(self.history) > self.history_limit:
+                del self.history[0]
+                self.history_truncated = True
+        if self.stats is not None:
+            self.stats.record_memory(
+                self.wave.nbytes, len(self.history), len(self.history) * self.wave.nbytes
+            )
+        try:
+            removed = self.propagate(() if self.consistent else None)
+        except Contradiction as exc:
+            if self.initial_wave is None:
+                raise
+            self.repair(exc)
+            return False
+        if self.trace:
+            self.trace.propagated(removed)
+        choices: List[Tuple[int, int, int]] = []
+        before_batch: Optional[NDArray[np.bool_]] = None
         try:
-            pattern, i, j = observe(self.wave, location_heuristic, pattern_heuristic)
-            if self.on_choice:
-                self.on_choice(pattern, i, j)
-            self.wave[:, i, j] = False
-            self.wave[pattern, i, j] = True
+            if self.batch_size > 1 and not self.batch_failed:
+                if not self.backtracking:
+                    before_batch = self.wave.copy()  # Otherwise the history has it
+                choices = observe_batch(
+                    self.wave,
+                    location_heuristic,
+                    pattern_heuristic,
+                    self.batch_size,
+                    self.batch_spacing,
+                    periodic=self.periodic,
+                    stats=self.stats,
+                )
+            else:
+                choices = [observe(self.wave, location_heuristic, pattern_heuristic, stats=self.stats)]
+            for pattern, i, j in choices:
+                if self.trace:
+                    self.trace.chose(pattern, i, j)
+                if self.stats is not None:
+                    self.stats.record_choice(collapsed=bool(self.wave[:, i, j].sum() > 1))
+                if self.on_choice:
+                    self.on_choice(pattern, i, j)
+                self.wave[:, i, j] = False
+                self.wave[pattern, i, j] = True
+            if self.stats is not None and len(choices) > 1:
+                self.stats.record_batch(len(choices))
             if self.on_observe:
                 self.on_observe(self.wave)
-            propagate(self.wave, self.adj, periodic=self.periodic, onPropagate=self.on_propagate)
+            removed = self.propagate([(i, j) for _, i, j in choices])
+            if self.trace:
+                self.trace.propagated(removed)
+            self.repairs_in_a_row = 0
+            self.batch_failed = False
+            self.consistent = True
+            self.steps += 1
+            if self.active is None and self.active_set_threshold is not None and self.steps % ACTIVE_SET_CHECK_EVERY == 0:
+                self.start_active_set()
             return False  # Assume there is remaining steps, if not then the next call will return True.
-        except Contradiction:
+        except Contradiction as exc:
+            self.consistent = False
+            self.active = None  # The wave is about to be replaced or reset
+            if len(choices) > 1:
+                if self.stats is not None:
+                    self.stats.record_batch_contradiction()
+                # No single choice of the batch is known to be wrong: undo it and take them one at a time
+                self.wave = self.history.pop() if before_batch is None else before_batch
+                self.batch_failed = True
+                return False
+            if self.initial_wave is not None:
+                self.repair(exc)
+                return False
             if not self.backtracking:
                 raise
             if not self.history:
+                if self.history_truncated:
+                    raise Contradiction("Backtracked past the limit of the history.")
                 raise Contradiction("Every permutation has been attempted.")
             if self.on_backtrack:
                 self.on_backtrack()
+            if self.trace:
+                self.trace.backtracked(pattern, i, j)
+            if self.stats is not None:
+                self.stats.record_backtrack()
             self.wave = self.history.pop()
             self.wave[pattern, i, j] = False
             return False
 
+    def propagate(self, changed: Optional[Collection[Tuple[int, int]]]) -> int:
+        """Propagate with the solver's backend, changed lists the cells changed since the last propagation (None if unknown)."""
+        if self.propagator is not None:
+            return self.propagator(self.wave, changed, onPropagate=self.on_propagate, stats=self.stats)
+        if self.active is not None:
+            removed, self.active = propagate_cells(
+                self.wave, self.adj, self.active, periodic=self.periodic, onPropagate=self.on_propagate, stats=self.stats
+            )
+            return removed
+        return propagate(
+            self.wave,
+            self.adj,
+            periodic=self.periodic,
+            onPropagate=self.on_propagate,
+            stats=self.stats,
+            executor=self.executor,
+            bands=self.bands,
+        )
+
+    def start_active_set(self) -> None:
+        """Switch to propagating the unresolved cells only, if enough of the wave is resolved."""
+        if self.propagator is not None or not self.wave.flags.c_contiguous:
+            return
+        assert self.active_set_threshold is not None
+        unresolved = numpy.flatnonzero(self.wave.sum(axis=0) > 1)
+        if len(unresolved) <= (1 - self.active_set_threshold) * self.wave.shape[1] * self.wave.shape[2]:
+            logger.debug(f"Switching to the active set of {len(unresolved)} unresolved cells after {self.steps} steps.")
+            self.active = unresolved
+
+    def repair(self, contradiction: Contradiction) -> None:
+        """Reset the domains of the cells around a contradiction, instead of giving up on the attempt."""
+        assert self.initial_wave is not None
+        if contradiction.cells is None or self.repairs >= self.repair_limit:
+            raise Contradiction(f"{contradiction} ({self.repairs} repairs made).") from contradiction
+        radius = self.repair_radius << min(self.repairs_in_a_row, 16)
+        region = grow_region(contradiction.cells, radius, self.periodic)
+        self.wave[:, region] = self.initial_wave[:, region]
+        self.active = None
+        self.repairs += 1
+        self.repairs_in_a_row += 1
+        if self.stats is not None:
+            self.stats.record_repair(numpy.count_nonzero(region))
+        logger.debug(f"Repaired {numpy.count_nonzero(region)} cells around a contradiction, radius {radius}.")
+
     def solve(
         self,
         location_heuristic: Callable[[NDArray[numpy.bool_]], Tuple[int, int]],
@@ -111,6 +291,70 @@ class Solver:
             pass
         return numpy.argmax(self.wave, axis=0)
 
+    def iter_solve(
+        self,
+        location_heuristic: Callable[[NDArray[numpy.bool_]], Tuple[int, int]],
+        pattern_heuristic: Callable[[NDArray[np.bool_], NDArray[np.bool_]], int],
+        snapshot_every: int = 0,
+        snapshot: Literal["view", "copy", "collapsed"] = "view",
+    ) -> Generator[SolveProgress, None, NDArray[np.int64]]:
+        """Solve one step at a time, yielding the progress after each step.
+
+        Every snapshot_every steps, and on the last record, the wave is
+        included: "view" is a read-only view of the live wave, valid until the
+        generator is resumed; "copy" is a copy of the wave; "collapsed" is the
+        pattern of every resolved cell and -1 elsewhere, which costs one int
+        per cell instead of one bool per pattern per cell.  Stopping the
+        iteration leaves the solver where it is.  The solution is the
+        generator's return value.
+        """
+        step = 0
+        while True:
+            done = self.solve_next(location_heuristic=location_heuristic, pattern_heuristic=pattern_heuristic)
+            if not done:
+                step += 1
+            cells = self.wave.shape[1] * self.wave.shape[2]
+            if self.active is not None:
+                resolved = 1 - len(self.active) / cells  # Without counting the whole wave
+            else:
+                resolved = numpy.count_nonzero(self.wave.sum(axis=0) == 1) / cells
+            progress: SolveProgress = {
+                "step": step,
+                "resolved": resolved,
+                "done": done,
+                "wave": None,
+            }
+            if done or (snapshot_every and step % snapshot_every == 0):
+                if snapshot == "collapsed":
+                    progress["wave"] = numpy.where(self.wave.sum(axis=0) == 1, numpy.argmax(self.wave, axis=0), -1)
+                elif snapshot == "copy":
+                    progress["wave"] = self.wave.copy()
+                else:
+                    view = self.wave.view()
+                    view.flags.writeable = False
+                    progress["wave"] = view
+            yield progress
+            if done:
+                return numpy.argmax(self.wave, axis=0)
+
+
+def grow_region(cells: NDArray[np.bool_], radius: int, periodic: bool = False) -> NDArray[np.bool_]:
+    """The cells within radius (in both axes) of any of the given cells."""
+    region = cells
+    for axis in (0, 1):
+        size = cells.shape[axis]
+        if 2 * radius + 1 >= size:
+            region = numpy.broadcast_to(region.any(axis=axis, keepdims=True), cells.shape)
+            continue
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius, radius)
+        padded = numpy.pad(region, pad, mode="wrap" if periodic else "constant")
+        grown = numpy.zeros(cells.shape, dtype=numpy.bool_)
+        for offset in range(2 * radius + 1):
+            grown |= padded[offset : offset + size] if axis == 0 else padded[:, offset : offset + size]
+        region = grown
+    return numpy.array(region)
+
 
 def makeWave(n: int, w: int, h: int, ground: Optional[Iterable[int]] = None) -> NDArray[numpy.bool_]:
     wave: NDArray[numpy.bool_] = numpy.ones((n, w, h), dtype=numpy.bool_)
@@ -128,6 +372,8 @@ def makeWave(n: int, w: int, h: int, ground: Optional[Iterable[int]] = None) ->
 def makeAdj(
     adjLists: Mapping[Tuple[int, int], Collection[Iterable[int]]]
 ) -> Dict[Tuple[int, int], NDArray[numpy.bool_]]:
+    from scipy import sparse  # type: ignore
+
     adjMatrices = {}
     # logger.debug(adjLists)
     num_patterns = len(list(adjLists.values())[0])
@@ -244,6 +490,8 @@ def makeSpiralLocationHeuristic(preferences: NDArray[np.floating[Any]]) -> Calla
 
 
 def makeHilbertLocationHeuristic(preferences: NDArray[np.floating[Any]]) -> Callable[[NDArray[np.bool_]], Tuple[int, int]]:
+    from hilbertcurve.hilbertcurve import HilbertCurve  # type: ignore
+
     curve_size = math.ceil(math.sqrt(max(preferences.shape[0], preferences.shape[1])))
     logger.debug(curve_size)
     curve_size = 4
@@ -357,18 +605,105 @@ def make_global_use_all_patterns() -> Callable[[NDArray[np.bool_]], bool]:
 #####################################
 # Solver
 
+# How often (in steps) the solver checks whether to switch to the active set.
+ACTIVE_SET_CHECK_EVERY = 16
+
+# Below this many cells a threaded propagate costs more in overhead than it saves.
+PARALLEL_MIN_CELLS = 64 * 64
+
+_band_executors: Dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+_band_executors_lock = threading.Lock()
+
+
+def band_executor(threads: int) -> concurrent.futures.ThreadPoolExecutor:
+    """A pool of threads for propagate's bands, shared by every solver that asks for as many."""
+    with _band_executors_lock:
+        if threads not in _band_executors:
+            _band_executors[threads] = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="wfc-propagate")
+        return _band_executors[threads]
+
+
+def propagate_band(
+    wave: NDArray[np.bool_],
+    padded: NDArray[np.bool_],
+    adj: Mapping[Tuple[int, int], NDArray[numpy.bool_]],
+    start: int,
+    stop: int,
+) -> NDArray[np.int64]:
+    """One pass of propagate over the rows start to stop of the wave, returning their pattern counts.
+
+    The supports are read from padded, the wave as it was at the start of
+    the pass, so bands which don't overlap can be updated at the same time.
+    """
+    band = wave[:, start:stop]
+    # adj is the list of adjacencies. For each direction d in adjacency, 
+    # check which patterns are still valid... 
+    for d in adj:
+        dx, dy = d
+        # padded[] is a version of the adjacency matrix with the values wrapped around
+        # shifted[] is the padded version with the values shifted over in one direction
+        # because my code stores the directions as relative (x,y) coordinates, we can find
+        # the adjacent cell for each direction by simply shifting the matrix in that direction,
+        # which allows for arbitrary adjacency directions. This is somewhat excessive, but elegant.
+
+        shifted = padded[
+            :, 1 + start + dx : 1 + stop + dx, 1 + dy : 1 + wave.shape[2] + dy
+        ]
+        # logger.debug(f"shifted: {shifted.shape} | adj[d]: {adj[d].shape} | d: {d}")
+        # raise StopEarly
+        # supports = numpy.einsum('pwh,pq->qwh', shifted, adj[d]) > 0
+
+        # The adjacency matrix is a boolean matrix, indexed by the direction and the two patterns.
+        # If the value for (direction, pattern1, pattern2) is True, then this is a valid adjacency.
+        # This gives us a rapid way to compare: True is 1, False is 0, so multiplying the matrices
+        # gives us the adjacency compatibility.
+        supports = (adj[d] @ shifted.reshape(shifted.shape[0], -1)).reshape(
+            shifted.shape
+        ) > 0
+        # supports = ( <- for each cell in the matrix
+        # adj[d]  <- the adjacency matrix [sliced by the direction d]
+        # @       <- Matrix multiplication
+        # shifted.reshape(shifted.shape[0], -1)) <- change the shape of the shifted matrix to 2-dimensions, to make the matrix multiplication easier
+        # .reshape(           <- reshape our matrix-multiplied result...
+        #   shifted.shape)   <- ...to match the original shape of the shifted matrix
+        # > 0    <- is not false
+
+        # multiply the band by the support matrix to find which patterns are still in the domain
+        band *= supports
+    return band.sum(axis=0)
+
+
 # Super important
 def propagate(
     wave: NDArray[np.bool_],
     adj: Mapping[Tuple[int, int], NDArray[numpy.bool_]],
     periodic: bool = False,
     onPropagate: Optional[Callable[[NDArray[numpy.bool_]], None]] = None,
-) -> None:
-    """Completely probagate any newly collapsed waves to all areas."""
-    last_count = wave.sum()
+    stats: Optional[SolverStats] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+    bands: int = 0,
+) -> int:
+    """Completely probagate any newly collapsed waves to all areas.
+
+    With an executor (of threads, numpy and scipy release the GIL in the
+    products) and bands > 1, each pass is split into that many bands of
+    rows which are computed in parallel and joined before the next pass.
+    The result is the same.
+
+    Returns the number of patterns that were removed from the wave."""
+    initial_count = last_count = wave.sum()
+    if stats is not None:
+        time_start = time.perf_counter()
+        unresolved_before = wave.sum(axis=0) > 1
+    iterations = 0
+    contradicted: Optional[NDArray[np.bool_]] = None
+    width = wave.shape[1]
+    if executor is None or bands < 2 or width * wave.shape[2] < PARALLEL_MIN_CELLS:
+        bands = 1
+    edges = numpy.linspace(0, width, min(bands, width) + 1).astype(numpy.int64).tolist()
 
     while True:
-        supports = {}
+        iterations += 1
         if periodic:
             padded = numpy.pad(wave, ((0, 0), (1, 1), (1, 1)), mode="wrap")
         else:
@@ -376,64 +711,192 @@ def propagate(
                 wave, ((0, 0), (1, 1), (1, 1)), mode="constant", constant_values=True
             )
 
-        # adj is the list of adjacencies. For each direction d in adjacency, 
-        # check which patterns are still valid... 
-        for d in adj:
-            dx, dy = d
-            # padded[] is a version of the adjacency matrix with the values wrapped around
-            # shifted[] is the padded version with the values shifted over in one direction
-            # because my code stores the directions as relative (x,y) coordinates, we can find
-            # the adjacent cell for each direction by simply shifting the matrix in that direction,
-            # which allows for arbitrary adjacency directions. This is somewhat excessive, but elegant.
-
-            shifted = padded[
-                :, 1 + dx : 1 + wave.shape[1] + dx, 1 + dy : 1 + wave.shape[2] + dy
-            ]
-            # logger.debug(f"shifted: {shifted.shape} | adj[d]: {adj[d].shape} | d: {d}")
-            # raise StopEarly
-            # supports[d] = numpy.einsum('pwh,pq->qwh', shifted, adj[d]) > 0
-
-            # The adjacency matrix is a boolean matrix, indexed by the direction and the two patterns.
-            # If the value for (direction, pattern1, pattern2) is True, then this is a valid adjacency.
-            # This gives us a rapid way to compare: True is 1, False is 0, so multiplying the matrices
-            # gives us the adjacency compatibility.
-            supports[d] = (adj[d] @ shifted.reshape(shifted.shape[0], -1)).reshape(
-                shifted.shape
-            ) > 0
-            # supports[d] = ( <- for each cell in the matrix
-            # adj[d]  <- the adjacency matrix [sliced by the direction d]
-            # @       <- Matrix multiplication
-            # shifted.reshape(shifted.shape[0], -1)) <- change the shape of the shifted matrix to 2-dimensions, to make the matrix multiplication easier
-            # .reshape(           <- reshape our matrix-multiplied result...
-            #   shifted.shape)   <- ...to match the original shape of the shifted matrix
-            # > 0    <- is not false
-
-        # multiply the wave matrix by the support matrix to find which patterns are still in the domain
-        for d in adj:
-            wave *= supports[d]
+        if len(edges) > 2:
+            assert executor is not None
+            # Each band reads a one cell halo of its neighbours from padded, which is only replaced once they are all done
+            counts = numpy.concatenate(
+                list(executor.map(lambda b: propagate_band(wave, padded, adj, edges[b], edges[b + 1]), range(len(edges) - 1)))
+            )
+        else:
+            counts = propagate_band(wave, padded, adj, 0, width)
 
-        if wave.sum() == last_count:
+        if not counts.all():
+            # Stop here: an empty cell supports nothing, so further passes would only
+            # spread the emptiness over the whole wave and hide where it started.
+            contradicted = counts == 0
+            break
+        if counts.sum() == last_count:
             break  # No changes since the last loop, changed waves have been fully propagated.
-        last_count = wave.sum()
+        last_count = counts.sum()
+
+    if stats is not None:
+        stats.record_propagate(
+            time.perf_counter() - time_start,
+            iterations,
+            0 if contradicted is not None else numpy.count_nonzero(unresolved_before & (counts == 1)),
+        )
 
     if onPropagate:
         onPropagate(wave)
 
-    if (wave.sum(axis=0) == 0).any():
-        raise Contradiction("Wave is in a contradictory state and can not be solved.")
+    if contradicted is not None:
+        raise Contradiction("Wave is in a contradictory state and can not be solved.", cells=contradicted)
+    return int(initial_count - last_count)
+
+
+def is_symmetric(adj: Mapping[Tuple[int, int], NDArray[numpy.bool_]]) -> bool:
+    """Whether every direction has its opposite, with the transposed adjacency.
+
+    Then a resolved cell can not lose the support of its neighbours while they
+    still have patterns, which is what propagate_cells relies on.
+    """
+    for (dx, dy), matrix in adj.items():
+        if (-dx, -dy) not in adj:
+            return False
+        difference = matrix != adj[(-dx, -dy)].T
+        if (difference.nnz if hasattr(difference, "nnz") else numpy.count_nonzero(difference)) > 0:
+            return False
+    return True
+
+
+def propagate_cells(
+    wave: NDArray[np.bool_],
+    adj: Mapping[Tuple[int, int], NDArray[numpy.bool_]],
+    cells: NDArray[np.int64],
+    periodic: bool = False,
+    onPropagate: Optional[Callable[[NDArray[numpy.bool_]], None]] = None,
+    stats: Optional[SolverStats] = None,
+) -> Tuple[int, NDArray[np.int64]]:
+    """propagate() restricted to the given cells (flat indices into the last two axes).
+
+    The other cells are taken to be resolved and to stay supported, which
+    holds for a symmetric adjacency (see is_symmetric) and an arc consistent
+    wave.  The passes gather the neighbours of the cells instead of shifting
+    the whole wave, so they cost in proportion to the number of cells.  The
+    wave must be C-contiguous.  Returns the number of patterns removed and
+    the cells still unresolved.
+    """
+    if not wave.flags.c_contiguous:
+        raise ValueError("propagate_cells updates the wave through a flat view, which needs a C-contiguous wave.")
+    number_of_patterns, width, height = wave.shape
+    flat = wave.reshape(number_of_patterns, -1)
+    if stats is not None:
+        time_start = time.perf_counter()
+    x, y = numpy.divmod(cells, height)
+    neighbours: Dict[Tuple[int, int], Tuple[NDArray[np.intp], Optional[NDArray[np.bool_]]]] = {}
+    for d in adj:
+        dx, dy = d
+        nx, ny = x + dx, y + dy
+        if periodic:
+            neighbours[d] = ((nx % width) * height + ny % height, None)
+        else:
+            off_grid = (nx < 0) | (nx >= width) | (ny < 0) | (ny >= height)
+            neighbours[d] = (numpy.clip(nx, 0, width - 1) * height + numpy.clip(ny, 0, height - 1), off_grid)
+
+    domains = flat[:, cells]
+    initial_count = last_count = domains.sum()
+    if stats is not None:
+        unresolved_before = domains.sum(axis=0) > 1
+    iterations = 0
+    contradicted: Optional[NDArray[np.bool_]] = None
+    while True:
+        iterations += 1
+        supported = numpy.ones_like(domains)
+        for d in adj:
+            indices, outside = neighbours[d]
+            gathered = flat[:, indices]
+            if outside is not None:
+                gathered[:, outside] = True  # As the padding of propagate
+            supported &= (adj[d] @ gathered) > 0
+        domains &= supported
+        flat[:, cells] = domains
+        counts = domains.sum(axis=0)
+        if not counts.all():
+            contradicted = numpy.zeros(width * height, dtype=numpy.bool_)
+            contradicted[cells[counts == 0]] = True
+            break
+        if counts.sum() == last_count:
+            break
+        last_count = counts.sum()
+
+    if stats is not None:
+        stats.record_propagate(
+            time.perf_counter() - time_start,
+            iterations,
+            0 if contradicted is not None else numpy.count_nonzero(unresolved_before & (counts == 1)),
+        )
+        stats.active_propagations += 1
+    if onPropagate:
+        onPropagate(wave)
+    if contradicted is not None:
+        raise Contradiction(
+            "Wave is in a contradictory state and can not be solved.", cells=contradicted.reshape(width, height)
+        )
+    return int(initial_count - last_count), cells[counts > 1]
 
 
 def observe(
     wave: NDArray[np.bool_],
     locationHeuristic: Callable[[NDArray[np.bool_]], Tuple[int, int]],
     patternHeuristic: Callable[[NDArray[np.bool_], NDArray[np.bool_]], int],
+    stats: Optional[SolverStats] = None,
 ) -> Tuple[int, int, int]:
     """Return the next best wave to collapse based on the provided heuristics."""
+    if stats is None:
+        i, j = locationHeuristic(wave)
+        pattern = patternHeuristic(wave[:, i, j], wave)
+        return pattern, i, j
+    time_start = time.perf_counter()
     i, j = locationHeuristic(wave)
+    time_location = time.perf_counter()
     pattern = patternHeuristic(wave[:, i, j], wave)
+    stats.location_time += time_location - time_start
+    stats.pattern_time += time.perf_counter() - time_location
     return pattern, i, j
 
 
+def observe_batch(
+    wave: NDArray[np.bool_],
+    locationHeuristic: Callable[[NDArray[np.bool_]], Tuple[int, int]],
+    patternHeuristic: Callable[[NDArray[np.bool_], NDArray[np.bool_]], int],
+    size: int,
+    spacing: int,
+    periodic: bool = False,
+    stats: Optional[SolverStats] = None,
+) -> List[Tuple[int, int, int]]:
+    """Choose up to size cells at least spacing cells apart in both axes, and a pattern for each.
+
+    The cells are the location heuristic's picks in turn.  After each pick
+    the cells too close to it are made to look resolved in a scratch copy of
+    the wave, so that the heuristic passes them over for the next one.
+    """
+    time_start = time.perf_counter()
+    scratch = wave.copy()
+    width, height = wave.shape[1:]
+    radius = spacing - 1
+    cells: List[Tuple[int, int]] = []
+    while len(cells) < size:
+        i, j = locationHeuristic(scratch)
+        if numpy.count_nonzero(scratch[:, i, j]) < 2:
+            break  # Every unresolved cell is too close to one that was picked
+        cells.append((i, j))
+        xs = numpy.arange(i - radius, i + radius + 1)
+        ys = numpy.arange(j - radius, j + radius + 1)
+        if periodic:
+            xs, ys = xs % width, ys % height
+        else:
+            xs, ys = xs[(xs >= 0) & (xs < width)], ys[(ys >= 0) & (ys < height)]
+        near = numpy.ix_(xs, ys)
+        scratch[(slice(None),) + near] = False
+        scratch[0][near] = True
+    time_location = time.perf_counter()
+    choices = [(patternHeuristic(wave[:, i, j], wave), i, j) for i, j in cells]
+    if stats is not None:
+        stats.location_time += time_location - time_start
+        stats.pattern_time += time.perf_counter() - time_location
+    return choices
+
+
 def run(
     wave: NDArray[np.bool_],
     adj: Mapping[Tuple[int, int], NDArray[numpy.bool_]],
@@ -449,6 +912,17 @@ def run(
     onFinal: Optional[Callable[[NDArray[numpy.bool_]], None]] = None,
     depth: int = 0,
     depth_limit: Optional[int] = None,
+    trace: Optional[TraceRecorder] = None,
+    stats: Optional[SolverStats] = None,
+    history_limit: Optional[int] = None,
+    deadline: Optional[float] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    repair: bool = False,
+    backend: str = "numpy",
+    threads: int = 0,
+    batch_size: int = 1,
+    batch_spacing: int = 8,
+    active_set_threshold: Optional[float] = 0.8,
 ) -> NDArray[numpy.int64]:
     solver = Solver(
         wave=wave,
@@ -459,7 +933,18 @@ def run(
         on_choice=onChoice,
         on_observe=onObserve,
         on_propagate=onPropagate,
-        check_feasible=checkFeasible
+        check_feasible=checkFeasible,
+        trace=trace,
+        stats=stats,
+        history_limit=history_limit,
+        deadline=deadline,
+        should_stop=should_stop,
+        repair=repair,
+        backend=backend,
+        threads=threads,
+        batch_size=batch_size,
+        batch_spacing=batch_spacing,
+        active_set_threshold=active_set_threshold,
     )
     while not solver.solve_next(location_heuristic=locationHeuristic, pattern_heuristic=patternHeuristic):
         pass
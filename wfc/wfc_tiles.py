@@ -2,7 +2,7 @@
 #This module displays how the algorithm breaks up the image into equally-sized tiles for examination.
 from __future__ import annotations
 
-from typing import Dict, Tuple
+from typing import Dict, Mapping, Tuple
 import numpy as np
 from numpy.typing import NDArray
 from .wfc_utilities import hash_downto
@@ -56,3 +56,64 @@ def make_tile_catalog(
 
 def tiles_to_images(tile_grid, tile_catalog):
     return
+
+
+def make_tile_atlas(
+    tile_catalog: Mapping[int, NDArray[np.integer]]
+) -> Tuple[NDArray[np.int64], NDArray[np.integer]]:
+    """
+    Takes a tile catalog and returns the following:
+    tile_ids is the sorted array of hashed tile IDs
+    tile_atlas is an array of shape (n_tiles, tile_size, tile_size, channels),
+    where tile_atlas[k] holds the pixels of the tile with the ID tile_ids[k]
+    """
+    tile_ids: NDArray[np.int64] = np.array(sorted(tile_catalog.keys()), dtype=np.int64)
+    tile_atlas: NDArray[np.integer] = np.stack([tile_catalog[tile_id] for tile_id in tile_ids])
+    return tile_ids, tile_atlas
+
+
+def tile_grid_to_indices(tile_grid: NDArray[np.int64], tile_ids: NDArray[np.int64]) -> NDArray[np.intp]:
+    """
+    Takes a grid of hashed tile IDs and the sorted tile_ids of an atlas, and
+    returns the grid expressed as indices into the atlas.
+    """
+    indices: NDArray[np.intp] = np.searchsorted(tile_ids, tile_grid)
+    np.minimum(indices, len(tile_ids) - 1, out=indices)
+    if not np.array_equal(tile_ids[indices], tile_grid):
+        raise KeyError("Tile grid contains tiles which are not in the atlas.")
+    return indices
+
+
+def render_tile_indices(index_grid: NDArray[np.integer], tile_atlas: NDArray[np.integer]) -> NDArray[np.integer]:
+    """
+    Takes a 2D grid of atlas indices and returns the image made by placing
+    the corresponding tiles side by side.  The channel count and dtype are
+    those of the atlas.
+    """
+    tiles = tile_atlas[index_grid]  # (rows, columns, tile rows, tile columns, channels)
+    return tiles.swapaxes(1, 2).reshape(
+        (
+            index_grid.shape[0] * tile_atlas.shape[1],
+            index_grid.shape[1] * tile_atlas.shape[2],
+            tile_atlas.shape[3],
+        )
+    )
+
+
+def wave_to_average_image(
+    wave: NDArray[np.bool_ | np.integer], pattern_tiles: NDArray[np.integer], tile_atlas: NDArray[np.integer]
+) -> NDArray[np.float64]:
+    """
+    Takes a wave of shape (patterns, rows, columns), the atlas index of the tile
+    each pattern places, and returns the image where each cell is the mean of the
+    tiles that are still possible there.  Contradicted cells are left black.
+    The wave may also hold counts, which weight the mean.
+    """
+    n_patterns, rows, columns = wave.shape
+    pattern_pixels = tile_atlas[pattern_tiles].reshape((n_patterns, -1)).astype(np.float64)
+    flat_wave = wave.reshape((n_patterns, -1)).T.astype(np.float64)
+    counts = flat_wave.sum(axis=1, keepdims=True)
+    averages = (flat_wave @ pattern_pixels) / np.maximum(counts, 1)
+    return averages.reshape((rows, columns) + tile_atlas.shape[1:]).swapaxes(1, 2).reshape(
+        (rows * tile_atlas.shape[1], columns * tile_atlas.shape[2], tile_atlas.shape[3])
+    )
@@ -0,0 +1,207 @@
+"""Record solver events to a compact binary log and replay them offline."""
+#Recording a trace costs a few array writes per step, so it can stay switched on for
+# real runs. The wave at any point of the solve can be regenerated afterwards from the
+# trace and the model, for visualization, GIF export or debugging.
+#
+# File layout: the magic bytes, a little-endian uint32 header length, a JSON header,
+# the initial wave packed to bits along the pattern axis, and then fixed-size event
+# records (TRACE_EVENT) written in chunks.
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import struct
+from typing import IO, Any, Dict, Iterator, List, Mapping, Optional, Tuple
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+from .wfc_solver import propagate
+
+logger = logging.getLogger(__name__)
+
+TRACE_MAGIC = b"WFCTRACE"
+TRACE_FORMAT_VERSION = 1
+
+EVENT_PROPAGATE = 0  # count: patterns removed by one full propagation
+EVENT_CHOICE = 1  # pattern, i, j: the cell was collapsed to the pattern
+EVENT_BACKTRACK = 2  # pattern, i, j: the choice was undone and the pattern banned there
+
+TRACE_EVENT = np.dtype(
+    [("kind", "<u1"), ("pattern", "<i4"), ("i", "<i4"), ("j", "<i4"), ("count", "<i8")]
+)
+
+
+class TraceRecorder:
+    """Writes solver events to a file, buffering chunk_size events at a time."""
+
+    def __init__(
+        self,
+        filename: str,
+        wave: NDArray[np.bool_],
+        periodic: bool = False,
+        backtracking: bool = False,
+        chunk_size: int = 4096,
+    ) -> None:
+        self.filename = filename
+        self.buffer = np.zeros(chunk_size, dtype=TRACE_EVENT)
+        self.buffered = 0
+        self.events = 0
+        self.file: Optional[IO[bytes]] = open(filename, "wb")
+        header = json.dumps(
+            {
+                "version": TRACE_FORMAT_VERSION,
+                "shape": list(wave.shape),
+                "periodic": periodic,
+                "backtracking": backtracking,
+            }
+        ).encode("utf_8")
+        self.file.write(TRACE_MAGIC)
+        self.file.write(struct.pack("<I", len(header)))
+        self.file.write(header)
+        self.file.write(np.packbits(wave, axis=0).tobytes())
+
+    def record(self, kind: int, pattern: int = -1, i: int = -1, j: int = -1, count: int = 0) -> None:
+        self.buffer[self.buffered] = (kind, pattern, i, j, count)
+        self.buffered += 1
+        self.events += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def chose(self, pattern: int, i: int, j: int) -> None:
+        self.record(EVENT_CHOICE, pattern, i, j)
+
+    def backtracked(self, pattern: int, i: int, j: int) -> None:
+        self.record(EVENT_BACKTRACK, pattern, i, j)
+
+    def propagated(self, removed: int) -> None:
+        self.record(EVENT_PROPAGATE, count=removed)
+
+    def flush(self) -> None:
+        if self.file is not None and self.buffered:
+            self.file.write(self.buffer[: self.buffered].tobytes())
+            self.buffered = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> TraceRecorder:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def read_trace(filename: str) -> Tuple[Dict[str, Any], NDArray[np.bool_], NDArray[Any]]:
+    """Returns the header, the initial wave and the array of events of a trace file."""
+    with open(filename, "rb") as tracef:
+        if tracef.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{filename} is not a WFC trace.")
+        (header_length,) = struct.unpack("<I", tracef.read(4))
+        header = json.loads(tracef.read(header_length).decode("utf_8"))
+        if header.get("version") != TRACE_FORMAT_VERSION:
+            raise ValueError(f"{filename} has trace version {header.get('version')}, expected {TRACE_FORMAT_VERSION}.")
+        shape = tuple(header["shape"])
+        packed_shape = ((shape[0] + 7) // 8,) + shape[1:]
+        packed = np.frombuffer(tracef.read(int(np.prod(packed_shape))), dtype=np.uint8)
+        wave = np.unpackbits(packed.reshape(packed_shape), axis=0, count=shape[0]).astype(np.bool_)
+        data = tracef.read()
+    # A trace cut short by a crash may end in a partial record, ignore it.
+    usable = len(data) - len(data) % TRACE_EVENT.itemsize
+    events = np.frombuffer(data[:usable], dtype=TRACE_EVENT)
+    return header, wave, events
+
+
+def replay_trace(
+    filename: str,
+    adj: Mapping[Tuple[int, int], Any],
+    check: bool = True,
+) -> Iterator[Tuple[int, NDArray[Any], NDArray[np.bool_]]]:
+    """Re-run the events of a trace, yielding (choices so far, event, wave) after each event.
+
+    The yielded wave is updated in place by the next event, copy it to keep it.
+    With check, propagations that remove a different number of patterns than
+    recorded (e.g. because the adjacency does not match) raise a ValueError.
+    """
+    header, wave, events = read_trace(filename)
+    history = []
+    choices = 0
+    previous_kind = None
+    for event in events:
+        kind = event["kind"]
+        if kind == EVENT_PROPAGATE:
+            # Each solver step starts with a propagation, and that is where the
+            # solver takes its undo snapshot; the one after a choice ends the step.
+            if header["backtracking"] and previous_kind != EVENT_CHOICE:
+                history.append(wave.copy())
+            removed = propagate(wave, adj, periodic=header["periodic"])
+            if check and removed != event["count"]:
+                raise ValueError(
+                    f"Propagation after {choices} choices removed {removed} patterns, the trace recorded {event['count']}."
+                )
+        elif kind == EVENT_CHOICE:
+            choices += 1
+            wave[:, event["i"], event["j"]] = False
+            wave[event["pattern"], event["i"], event["j"]] = True
+        elif kind == EVENT_BACKTRACK:
+            wave[...] = history.pop()
+            wave[event["pattern"], event["i"], event["j"]] = False
+        previous_kind = kind
+        yield choices, event, wave
+
+
+def wave_after_choices(filename: str, adj: Mapping[Tuple[int, int], Any], choices: int) -> NDArray[np.bool_]:
+    """Regenerate the wave as it was after the given number of choices had been propagated."""
+    wave = None
+    for choice_count, _event, replayed in replay_trace(filename, adj):
+        if choice_count > choices:
+            break
+        if choice_count == choices:
+            wave = replayed.copy()
+    if wave is None:
+        raise ValueError(f"{filename} has fewer than {choices} choices.")
+    return wave
+
+
+def main() -> None:
+    from .wfc_model import WFCModel
+    from .wfc_tiles import wave_to_average_image
+    import imageio  # type: ignore
+
+    parser = argparse.ArgumentParser(description="Replay a solver trace and render the wave.")
+    parser.add_argument("trace", help="A trace recorded with execute_wfc(trace_filename=...).")
+    parser.add_argument("model", help="The saved model the trace was recorded with.")
+    parser.add_argument("--step", type=int, default=None, help="Render the wave after this many choices.")
+    parser.add_argument("--png", type=str, default=None, help="Where to write the image for --step.")
+    parser.add_argument("--gif", type=str, default=None, help="Write an animation of the whole solve.")
+    parser.add_argument("--every", type=int, default=1, help="Put every n-th choice into the animation.")
+    args = parser.parse_args()
+
+    model = WFCModel.load(args.model)
+    adj = model.adjacency_matrices()
+
+    def render(wave: NDArray[np.bool_]) -> NDArray[np.uint8]:
+        return wave_to_average_image(
+            wave.transpose((0, 2, 1)), model.pattern_tile_indices, model.tile_atlas
+        ).astype(np.uint8)
+
+    if args.step is not None:
+        wave = wave_after_choices(args.trace, adj, args.step)
+        imageio.imwrite(args.png or f"{args.trace}_{args.step}.png", render(wave))
+    if args.gif:
+        # A trace without events, e.g. of a solve that stopped at once, is just its initial wave
+        _, wave, _ = read_trace(args.trace)
+        frames: List[ArrayLike] = []
+        last_choice = -1
+        for choices, event, wave in replay_trace(args.trace, adj):
+            if event["kind"] == EVENT_PROPAGATE and choices != last_choice and choices % args.every == 0:
+                frames.append(render(wave))
+                last_choice = choices
+        frames.append(render(wave))
+        imageio.mimsave(args.gif, frames)
+
+
+if __name__ == "__main__":
+    main()
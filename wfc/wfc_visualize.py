@@ -1,18 +1,22 @@
 "Visualize the patterns into tiles and so on."
 from __future__ import annotations
 
+import concurrent.futures
 import logging
 import math
 import pathlib
 import itertools
-from typing import Dict, Tuple
-import imageio  # type: ignore
-import matplotlib  # type: ignore
+from typing import Dict, List, Optional, Sequence, Tuple
 import struct
-import matplotlib.pyplot as plt  # type: ignore
 import numpy as np
 from numpy.typing import NDArray
 from .wfc_patterns import pattern_grid_to_tiles
+from .wfc_tiles import (
+    make_tile_atlas,
+    render_tile_indices,
+    tile_grid_to_indices,
+    wave_to_average_image,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,27 +39,29 @@ def int_to_rgb(val):
 WFC_PARTIAL_BLANK = np.nan
 
 
+def resize_pixel(pixel: Sequence[int], color_channels: int) -> NDArray[np.int64]:
+    """Repeat or truncate a pixel to the given number of channels, like np.resize."""
+    return np.resize(np.asarray(pixel, dtype=np.int64), color_channels)
+
+
 def tile_to_image(tile, tile_catalog, tile_size, visualize=False):
     """
     Takes a single tile and returns the pixel image representation.
     """
-    new_img = np.zeros((tile_size[0], tile_size[1], 3), dtype=np.int64)
-    for u in range(tile_size[0]):
-        for v in range(tile_size[1]):
-            ## If we want to display a partial pattern, it is helpful to
-            ## be able to show empty cells. Therefore, in visualize mode,
-            ## we use -1 as a magic number for a non-existant tile.
-            pixel = [200, 0, 200]
-            if (visualize) and ((-1 == tile) or (WFC_PARTIAL_BLANK == tile)):
-                if 0 == (u + v) % 2:
-                    pixel = [255, 0, 255]
-            else:
-                if (visualize) and -2 == tile:
-                    pixel = [0, 255, 255]
-                else:
-                    pixel = tile_catalog[tile][u, v]
-            new_img[u, v] = pixel
-    return new_img
+    ## If we want to display a partial pattern, it is helpful to
+    ## be able to show empty cells. Therefore, in visualize mode,
+    ## we use -1 as a magic number for a non-existant tile.
+    if (visualize) and ((-1 == tile) or (WFC_PARTIAL_BLANK == tile)):
+        new_img = np.zeros((tile_size[0], tile_size[1], 3), dtype=np.int64)
+        new_img[:] = [200, 0, 200]
+        checker = np.add.outer(np.arange(tile_size[0]), np.arange(tile_size[1])) % 2 == 0
+        new_img[checker] = [255, 0, 255]
+        return new_img
+    if (visualize) and -2 == tile:
+        new_img = np.zeros((tile_size[0], tile_size[1], 3), dtype=np.int64)
+        new_img[:] = [0, 255, 255]
+        return new_img
+    return np.array(tile_catalog[tile][: tile_size[0], : tile_size[1]], dtype=np.int64)
 
 
 def argmax_unique(arr, axis):
@@ -131,8 +137,18 @@ def make_solver_visualizers(
     pattern_catalog=None,
     tile_catalog=None,
     tile_size=[1, 1],
+    render_workers: int = 0,
+    max_pending_frames: Optional[int] = None,
+    frame_interval: int = 1,
 ):
-    """Construct visualizers for displaying the intermediate solver status"""
+    """Construct visualizers for displaying the intermediate solver status.
+
+    With render_workers > 0 the readout figures are drawn by that many
+    background processes (see AsyncFrameRenderer), and the last returned
+    callback waits for them and returns the frame counts.
+    """
+    import imageio  # type: ignore
+
     logger.debug(wave.shape)
     pattern_total_count = wave.shape[0]
     resolution_order = np.full(
@@ -151,13 +167,18 @@ def make_solver_visualizers(
     max_choices = math.floor((wave.shape[1] * wave.shape[2]) / 3)
     output_individual_visualizations = False
 
-    tile_wave = np.zeros(wave.shape, dtype=np.int64)
-    for i in range(wave.shape[0]):
-        local_solution_as_ids = np.full(wave.shape[1:], decode_patterns[i])
-        local_solution_tile_grid = pattern_grid_to_tiles(
-            local_solution_as_ids, pattern_catalog
+    tile_atlas = None
+    pattern_tile_ids = None
+    pattern_tiles = None
+    if decode_patterns and pattern_catalog and tile_catalog:
+        # Lookup tables from pattern index to the tile it places, both as a tile
+        # hash and as an atlas index, so a whole wave can be decoded at once
+        tile_atlas = make_tile_atlas(tile_catalog)
+        pattern_tile_ids = pattern_grid_to_tiles(
+            np.array([decode_patterns[i] for i in range(pattern_total_count)]),
+            pattern_catalog,
         )
-        tile_wave[i] = local_solution_tile_grid
+        pattern_tiles = tile_grid_to_indices(pattern_tile_ids, tile_atlas[0])
 
     def choice_vis(pattern, i, j, wave=None):
         nonlocal choice_count
@@ -209,7 +230,16 @@ def make_solver_visualizers(
                     "plasma",
                 )
 
-    def wave_vis(wave):
+    frame_renderer = None
+    if render_workers > 0 and tile_atlas is not None and pattern_tile_ids is not None and pattern_tiles is not None:
+        frame_renderer = AsyncFrameRenderer(
+            render_workers,
+            (pattern_tile_ids, pattern_tiles, tile_atlas[1][:, : tile_size[0], : tile_size[1]]),
+            max_pending_frames=max_pending_frames,
+            frame_interval=frame_interval,
+        )
+
+    def update_resolution(wave):
         nonlocal vis_count
         nonlocal resolution_method
         nonlocal resolution_order
@@ -223,6 +253,10 @@ def make_solver_visualizers(
         resolution_method[resolved_by_propagation] = 1
         resolution_order[resolved_by_propagation] = choice_count
         backtracking_order[resolved_by_propagation] = backtracking_count
+        return pattern_left_count
+
+    def wave_vis(wave):
+        pattern_left_count = update_resolution(wave)
         if output_individual_visualizations:
             figure_wave_patterns(filename, pattern_left_count, pattern_total_count)
             figure_solver_data(
@@ -233,30 +267,21 @@ def make_solver_visualizers(
                 pattern_total_count,
                 "magma",
             )
-        if decode_patterns and pattern_catalog and tile_catalog:
-            solution_as_ids = np.vectorize(lambda x: decode_patterns[x])(
-                np.argmax(wave, 0)
-            )
-            solution_tile_grid = pattern_grid_to_tiles(solution_as_ids, pattern_catalog)
+        if tile_atlas is not None:
             if output_individual_visualizations:
+                solution_patterns = np.argmax(wave, 0)
                 figure_solver_data(
                     f"visualization/{filename}_tiles_assigned_{choice_count}.png",
                     "tiles assigned",
-                    solution_tile_grid,
+                    pattern_tile_ids[solution_patterns],
                     0,
                     pattern_total_count,
                     "plasma",
                 )
-            img = tile_grid_to_image(solution_tile_grid.T, tile_catalog, tile_size)
-
-            masked_tile_wave: np.ma.MaskedArray = np.ma.MaskedArray(
-                data=tile_wave, mask=(wave == False), dtype=np.int64
-            )
-            masked_img = tile_grid_to_average(
-                np.transpose(masked_tile_wave, (0, 2, 1)), tile_catalog, tile_size
-            )
-
-            if output_individual_visualizations:
+                img = render_tile_indices(
+                    pattern_tiles[solution_patterns.T],
+                    tile_atlas[1][:, : tile_size[0], : tile_size[1]],
+                )
                 figure_solver_image(
                     f"visualization/{filename}_solution_partial_{choice_count}.png",
                     "solved_tiles",
@@ -266,60 +291,33 @@ def make_solver_visualizers(
                     f"visualization/{filename}_solution_partial_img_{choice_count}.png",
                     img.astype(np.uint8),
                 )
-            fig_list = [
-                # {"title": "resolved by propagation", "data": resolved_by_propagation.T, "vmin": 0, "vmax": 2, "cmap": "inferno", "datatype":"figure"},
-                {
-                    "title": "order of resolution",
-                    "data": resolution_order.T,
-                    "vmin": 0,
-                    "vmax": max_choices / 4,
-                    "cmap": "hsv",
-                    "datatype": "figure",
-                },
-                {
-                    "title": "chosen pattern",
-                    "data": pattern_solution.T,
-                    "vmin": 0,
-                    "vmax": pattern_total_count,
-                    "cmap": "viridis",
-                    "datatype": "figure",
-                },
-                {
-                    "title": "resolution method",
-                    "data": resolution_method.T,
-                    "vmin": 0,
-                    "vmax": 2,
-                    "cmap": "magma",
-                    "datatype": "figure",
-                },
-                {
-                    "title": "patterns remaining",
-                    "data": pattern_left_count.T,
-                    "vmin": 0,
-                    "vmax": pattern_total_count,
-                    "cmap": "viridis",
-                    "datatype": "figure",
-                },
-                {
-                    "title": "tiles assigned",
-                    "data": solution_tile_grid.T,
-                    "vmin": None,
-                    "vmax": None,
-                    "cmap": "prism",
-                    "datatype": "figure",
-                },
-                {
-                    "title": "solved tiles",
-                    "data": masked_img.astype(np.uint8),
-                    "datatype": "image",
-                },
-            ]
-            figure_unified(
-                "Solver Readout",
+            render_solver_readout(
                 f"visualization/{filename}_readout_{choice_count:03}_{vis_count:03}.png",
-                fig_list,
+                wave,
+                resolution_order,
+                pattern_solution,
+                resolution_method,
+                max_choices,
+                pattern_tile_ids,
+                pattern_tiles,
+                tile_atlas[1][:, : tile_size[0], : tile_size[1]],
+            )
+
+    def make_async_wave_vis(final):
+        def async_wave_vis(wave):
+            update_resolution(wave)
+            frame_renderer.submit(
+                f"visualization/{filename}_readout_{choice_count:03}_{vis_count:03}.png",
+                wave,
+                resolution_order,
+                pattern_solution,
+                resolution_method,
+                max_choices,
+                final=final,
             )
 
+        return async_wave_vis
+
     def backtrack_vis() -> None:
         nonlocal vis_count
         nonlocal pattern_solution
@@ -328,10 +326,204 @@ def make_solver_visualizers(
         vis_count += 1
         pattern_solution = np.full(wave.shape[1:], -1)
 
+    if frame_renderer is not None:
+        return (
+            choice_vis,
+            make_async_wave_vis(final=False),
+            backtrack_vis,
+            None,
+            make_async_wave_vis(final=True),
+            frame_renderer.drain,
+        )
     return choice_vis, wave_vis, backtrack_vis, None, wave_vis, None
 
 
+def render_solver_readout(
+    output_filename: str,
+    wave: NDArray[np.bool_],
+    resolution_order: NDArray[np.floating],
+    pattern_solution: NDArray[np.floating],
+    resolution_method: NDArray[np.floating],
+    max_choices: int,
+    pattern_tile_ids: NDArray[np.int64],
+    pattern_tiles: NDArray[np.intp],
+    tile_atlas: NDArray[np.integer],
+) -> None:
+    """Draw the combined solver status figure for one step of the solve."""
+    pattern_total_count = wave.shape[0]
+    pattern_left_count = np.count_nonzero(wave > 0, axis=0)
+    solution_tile_grid = pattern_tile_ids[np.argmax(wave, 0)]
+    masked_img = wave_to_average_image(np.transpose(wave, (0, 2, 1)), pattern_tiles, tile_atlas)
+    fig_list = [
+        # {"title": "resolved by propagation", "data": resolved_by_propagation.T, "vmin": 0, "vmax": 2, "cmap": "inferno", "datatype":"figure"},
+        {
+            "title": "order of resolution",
+            "data": resolution_order.T,
+            "vmin": 0,
+            "vmax": max_choices / 4,
+            "cmap": "hsv",
+            "datatype": "figure",
+        },
+        {
+            "title": "chosen pattern",
+            "data": pattern_solution.T,
+            "vmin": 0,
+            "vmax": pattern_total_count,
+            "cmap": "viridis",
+            "datatype": "figure",
+        },
+        {
+            "title": "resolution method",
+            "data": resolution_method.T,
+            "vmin": 0,
+            "vmax": 2,
+            "cmap": "magma",
+            "datatype": "figure",
+        },
+        {
+            "title": "patterns remaining",
+            "data": pattern_left_count.T,
+            "vmin": 0,
+            "vmax": pattern_total_count,
+            "cmap": "viridis",
+            "datatype": "figure",
+        },
+        {
+            "title": "tiles assigned",
+            "data": solution_tile_grid.T,
+            "vmin": None,
+            "vmax": None,
+            "cmap": "prism",
+            "datatype": "figure",
+        },
+        {
+            "title": "solved tiles",
+            "data": masked_img.astype(np.uint8),
+            "datatype": "image",
+        },
+    ]
+    figure_unified("Solver Readout", output_filename, fig_list)
+
+
+# Lookup tables for the solver readout, set once in each render worker process.
+_frame_tables: Optional[Tuple[NDArray[np.int64], NDArray[np.intp], NDArray[np.integer]]] = None
+
+
+def _init_frame_renderer(tables) -> None:
+    global _frame_tables
+    _frame_tables = tables
+
+
+def _render_frame(
+    output_filename, packed_wave, pattern_count, resolution_order, pattern_solution, resolution_method, max_choices
+) -> None:
+    assert _frame_tables is not None
+    wave = np.unpackbits(packed_wave, axis=0, count=pattern_count).astype(np.bool_)
+    render_solver_readout(
+        output_filename,
+        wave,
+        resolution_order,
+        pattern_solution,
+        resolution_method,
+        max_choices,
+        *_frame_tables,
+    )
+
+
+class AsyncFrameRenderer:
+    """Renders solver readouts on a pool of background processes.
+
+    The solver side only packs the wave into bits and copies the per-cell
+    counters.  At most max_pending_frames snapshots are in flight; frames
+    offered while the pool is that far behind are dropped, so the solve is
+    never held up by matplotlib.  Final frames are always rendered.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        tables: Tuple[NDArray[np.int64], NDArray[np.intp], NDArray[np.integer]],
+        max_pending_frames: Optional[int] = None,
+        frame_interval: int = 1,
+    ) -> None:
+        self.workers = workers
+        self.tables = tables
+        self.max_pending_frames = max_pending_frames if max_pending_frames else 2 * workers
+        self.frame_interval = max(1, frame_interval)
+        self.executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.pending: List[concurrent.futures.Future] = []
+        self.frames_offered = 0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+
+    def submit(
+        self,
+        output_filename: str,
+        wave: NDArray[np.bool_],
+        resolution_order: NDArray[np.floating],
+        pattern_solution: NDArray[np.floating],
+        resolution_method: NDArray[np.floating],
+        max_choices: int,
+        final: bool = False,
+    ) -> bool:
+        """Queue a frame for rendering.  Returns False if the frame was skipped."""
+        self.frames_offered += 1
+        self._collect()
+        if not final:
+            if (self.frames_offered - 1) % self.frame_interval != 0 or len(self.pending) >= self.max_pending_frames:
+                self.frames_skipped += 1
+                return False
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=_init_frame_renderer, initargs=(self.tables,)
+            )
+        self.pending.append(
+            self.executor.submit(
+                _render_frame,
+                output_filename,
+                np.packbits(wave, axis=0),
+                wave.shape[0],
+                resolution_order.copy(),
+                pattern_solution.copy(),
+                resolution_method.copy(),
+                max_choices,
+            )
+        )
+        return True
+
+    def _collect(self) -> None:
+        still_pending = []
+        for future in self.pending:
+            if future.done():
+                if future.exception() is not None:
+                    logger.warning(f"Rendering a solver frame failed: {future.exception()}")
+                else:
+                    self.frames_rendered += 1
+            else:
+                still_pending.append(future)
+        self.pending = still_pending
+
+    def drain(self) -> Dict[str, int]:
+        """Wait for every queued frame, shut the pool down and report the frame counts.
+
+        The counts start again from zero, so each attempt of a solve reports its own.
+        """
+        concurrent.futures.wait(self.pending)
+        self._collect()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        counts = {
+            "frames rendered": self.frames_rendered,
+            "frames skipped": self.frames_skipped,
+        }
+        self.frames_offered = self.frames_rendered = self.frames_skipped = 0
+        return counts
+
+
 def figure_unified(figure_name_overall, filename, data):
+    import matplotlib.pyplot as plt  # type: ignore
+
     matfig, axs = plt.subplots(
         1, len(data), sharey="row", gridspec_kw={"hspace": 0, "wspace": 0}
     )
@@ -365,6 +557,8 @@ def visualize_solver(wave):
 
 
 def make_figure_solver_image(plot_title, img):
+    import matplotlib.pyplot as plt  # type: ignore
+
     visfig = plt.figure(figsize=(4, 4), edgecolor="k", frameon=True)
     plt.imshow(img, interpolation="nearest")
     plt.title(plot_title)
@@ -377,6 +571,8 @@ def make_figure_solver_image(plot_title, img):
 
 
 def figure_solver_image(filename, plot_title, img):
+    import matplotlib.pyplot as plt  # type: ignore
+
     visfig = make_figure_solver_image(plot_title, img)
     plt.savefig(filename, bbox_inches="tight", pad_inches=0)
     plt.close(fig=visfig)
@@ -384,6 +580,8 @@ def figure_solver_image(filename, plot_title, img):
 
 
 def make_figure_solver_data(plot_title, data, min_count, max_count, cmap_name):
+    import matplotlib.pyplot as plt  # type: ignore
+
     visfig = plt.figure(figsize=(4, 4), edgecolor="k", frameon=True)
     plt.title(plot_title)
     plt.matshow(data, vmin=min_count, vmax=max_count, cmap=cmap_name)
@@ -396,6 +594,8 @@ def make_figure_solver_data(plot_title, data, min_count, max_count, cmap_name):
 
 
 def figure_solver_data(filename, plot_title, data, min_count, max_count, cmap_name):
+    import matplotlib.pyplot as plt  # type: ignore
+
     visfig = make_figure_solver_data(plot_title, data, min_count, max_count, cmap_name)
     plt.savefig(filename, bbox_inches="tight", pad_inches=0)
     plt.close(fig=visfig)
@@ -403,6 +603,8 @@ def figure_solver_data(filename, plot_title, data, min_count, max_count, cmap_na
 
 
 def figure_wave_patterns(filename, pattern_left_count, max_count):
+    import matplotlib.pyplot as plt  # type: ignore
+
     global vis_count
     vis_count += 1
     visfig = plt.figure(figsize=(4, 4), edgecolor="k", frameon=True)
@@ -418,42 +620,35 @@ def figure_wave_patterns(filename, pattern_left_count, max_count):
 
 def tile_grid_to_average(
     tile_grid: np.ma.MaskedArray,
-    tile_catalog: Dict[int, NDArray[np.int64]],
+    tile_catalog: Dict[int, NDArray[np.integer]],
     tile_size: Tuple[int, int],
-    color_channels: int = 3,
+    color_channels: Optional[int] = None,
 ) -> NDArray[np.int64]:
     """
   Takes a masked array of tile grid stacks and transforms it into an image, taking
   the average colors of the tiles in tile_catalog.
   """
-    new_img = np.zeros(
-        (
-            tile_grid.shape[1] * tile_size[0],
-            tile_grid.shape[2] * tile_size[1],
-            color_channels,
-        ),
-        dtype=np.int64,
+    tile_ids, tile_atlas = make_tile_atlas(tile_catalog)
+    tile_atlas = tile_atlas[:, : tile_size[0], : tile_size[1]]
+    stack_depth, rows, columns = tile_grid.shape
+    present = ~np.ma.getmaskarray(tile_grid)
+    indices = tile_grid_to_indices(
+        np.where(present, np.ma.getdata(tile_grid), tile_ids[0]), tile_ids
     )
-    for i in range(tile_grid.shape[1]):
-        for j in range(tile_grid.shape[2]):
-            tile_stack = tile_grid[:, i, j]
-            for u in range(tile_size[0]):
-                for v in range(tile_size[1]):
-                    pixel = [200, 0, 200]
-                    pixel_list = np.array(
-                        [
-                            tile_catalog[t][u, v]
-                            for t in tile_stack[tile_stack.mask == False]
-                        ],
-                        dtype=np.int64,
-                    )
-                    pixel = np.mean(pixel_list, axis=0)
-                    # TODO: will need to change if using an image with more than 3 channels
-                    new_img[(i * tile_size[0]) + u, (j * tile_size[1]) + v] = np.resize(
-                        pixel,
-                        new_img[(i * tile_size[0]) + u, (j * tile_size[1]) + v].shape,
-                    )
-    return new_img
+    # Count how often each tile occurs in each stack, then average with one matmul.
+    cells = np.broadcast_to(np.arange(rows * columns).reshape((rows, columns)), tile_grid.shape)
+    tile_counts = np.bincount(
+        (cells * len(tile_ids) + indices)[present],
+        minlength=rows * columns * len(tile_ids),
+    ).reshape((rows * columns, len(tile_ids)))
+    new_img = wave_to_average_image(
+        tile_counts.T.reshape((len(tile_ids), rows, columns)),
+        np.arange(len(tile_ids)),
+        tile_atlas,
+    )
+    if color_channels is not None and color_channels != new_img.shape[2]:
+        new_img = new_img[:, :, np.arange(color_channels) % new_img.shape[2]]
+    return new_img.astype(np.int64)
 
 
 def tile_grid_to_image(
@@ -462,57 +657,53 @@ def tile_grid_to_image(
     tile_size: Tuple[int, int],
     visualize: bool = False,
     partial: bool = False,
-    color_channels: int = 3,
+    color_channels: Optional[int] = None,
+    tile_atlas: Optional[Tuple[NDArray[np.int64], NDArray[np.integer]]] = None,
 ) -> NDArray[np.integer]:
     """
     Takes a tile_grid and transforms it into an image, using the information
     in tile_catalog. We use tile_size to figure out the size the new image
-    should be, and visualize for displaying partial tile patterns.
+    should be, and visualize for displaying partial tile patterns.  The image
+    has the channels and dtype of the tiles unless color_channels is given.
+    A precomputed (tile_ids, tile_atlas) from make_tile_atlas can be passed
+    to skip rebuilding it.
     """
-    tile_dtype = next(iter(tile_catalog.values())).dtype
-    new_img = np.zeros(
-        (
-            tile_grid.shape[0] * tile_size[0],
-            tile_grid.shape[1] * tile_size[1],
-            color_channels,
-        ),
-        dtype=tile_dtype,
-    )
     if partial and (len(tile_grid.shape)) > 2:
         # TODO: implement rendering partially completed solution
         # Call tile_grid_to_average() instead.
         assert False
-    else:
-        for i in range(tile_grid.shape[0]):
-            for j in range(tile_grid.shape[1]):
-                tile = tile_grid[i, j]
-                for u in range(tile_size[0]):
-                    for v in range(tile_size[1]):
-                        pixel = [200, 0, 200]
-                        ## If we want to display a partial pattern, it is helpful to
-                        ## be able to show empty cells. Therefore, in visualize mode,
-                        ## we use -1 as a magic number for a non-existant tile.
-                        if visualize and ((-1 == tile) or (-2 == tile)):
-                            if -1 == tile:
-                                if 0 == (i + j) % 2:
-                                    pixel = [255, 0, 255]
-                            if -2 == tile:
-                                pixel = [0, 255, 255]
-                        else:
-                            pixel = tile_catalog[tile][u, v]
-                        # TODO: will need to change if using an image with more than 3 channels
-                        new_img[
-                            (i * tile_size[0]) + u, (j * tile_size[1]) + v
-                        ] = np.resize(
-                            pixel,
-                            new_img[
-                                (i * tile_size[0]) + u, (j * tile_size[1]) + v
-                            ].shape,
-                        )
+    if tile_atlas is None:
+        tile_atlas = make_tile_atlas(tile_catalog)
+    tile_ids, atlas = tile_atlas
+    atlas = atlas[:, : tile_size[0], : tile_size[1]]
+    channels = atlas.shape[3] if color_channels is None else color_channels
+
+    ## If we want to display a partial pattern, it is helpful to
+    ## be able to show empty cells. Therefore, in visualize mode,
+    ## we use -1 as a magic number for a non-existant tile.
+    blank = np.zeros(tile_grid.shape, dtype=np.bool_)
+    if visualize:
+        blank = (tile_grid == -1) | (tile_grid == -2)
+    indices = tile_grid_to_indices(np.where(blank, tile_ids[0], tile_grid), tile_ids)
+    new_img = render_tile_indices(indices, atlas)
+    if channels != new_img.shape[2]:
+        new_img = new_img[:, :, np.arange(channels) % new_img.shape[2]]
+
+    if blank.any():
+        checker = np.add.outer(np.arange(tile_grid.shape[0]), np.arange(tile_grid.shape[1])) % 2 == 0
+        cell_colors = np.zeros(tile_grid.shape + (channels,), dtype=np.int64)
+        cell_colors[:] = resize_pixel([200, 0, 200], channels)
+        cell_colors[(tile_grid == -1) & checker] = resize_pixel([255, 0, 255], channels)
+        cell_colors[tile_grid == -2] = resize_pixel([0, 255, 255], channels)
+        pixel_blank = np.repeat(np.repeat(blank, atlas.shape[1], axis=0), atlas.shape[2], axis=1)
+        pixel_colors = np.repeat(np.repeat(cell_colors, atlas.shape[1], axis=0), atlas.shape[2], axis=1)
+        new_img = np.where(pixel_blank[:, :, np.newaxis], pixel_colors, new_img).astype(atlas.dtype)
     return new_img
 
 
 def figure_list_of_tiles(unique_tiles, tile_catalog, output_filename="list_of_tiles"):
+    import matplotlib.pyplot as plt  # type: ignore
+
     plt.figure(figsize=(4, 4), edgecolor="k", frameon=True)
     plt.title("Extracted Tiles")
     s = math.ceil(math.sqrt(len(unique_tiles))) + 1
@@ -527,6 +718,8 @@ def figure_list_of_tiles(unique_tiles, tile_catalog, output_filename="list_of_ti
 
 
 def figure_false_color_tile_grid(tile_grid, output_filename="./false_color_tiles"):
+    import matplotlib.pyplot as plt  # type: ignore
+
     figure_plot = plt.matshow(
         tile_grid,
         cmap="gist_ncar",
@@ -543,18 +736,9 @@ def figure_tile_grid(tile_grid, tile_catalog, tile_size):
 
 
 def render_pattern(render_pattern, tile_catalog):
-    """Turn a pattern into an image"""
-    rp_iter = np.nditer(render_pattern, flags=["multi_index"])
-    output = np.zeros(render_pattern.shape + (3,), dtype=np.uint32)
-    while not rp_iter.finished:
-        # Note that this truncates images with more than 3 channels down to just the channels in the output.
-        # If we want to have alpha channels, we'll need a different way to handle this.
-        output[rp_iter.multi_index] = np.resize(
-            tile_catalog[render_pattern[rp_iter.multi_index]],
-            output[rp_iter.multi_index].shape,
-        )
-        rp_iter.iternext()
-    return output
+    """Turn a pattern into an image, with one pixel (the tile's upper left) per tile"""
+    tile_ids, tile_atlas = make_tile_atlas(tile_catalog)
+    return tile_atlas[:, 0, 0][tile_grid_to_indices(render_pattern, tile_ids)]
 
 
 def figure_pattern_catalog(
@@ -564,6 +748,8 @@ def figure_pattern_catalog(
     pattern_width,
     output_filename="pattern_catalog",
 ):
+    import matplotlib.pyplot as plt  # type: ignore
+
     s_columns = 24 // min(24, pattern_width)
     s_rows = 1 + (int(len(pattern_catalog)) // s_columns)
     _fig = plt.figure(figsize=(s_columns, s_rows * 1.5))
@@ -591,6 +777,8 @@ def render_tiles_to_output(
     tile_size: Tuple[int, int],
     output_filename: str,
 ) -> None:
+    import imageio  # type: ignore
+
     img = tile_grid_to_image(tile_grid.T, tile_catalog, tile_size)
     imageio.imwrite(output_filename, img.astype(np.uint8))
 
@@ -679,6 +867,9 @@ def figure_adjacencies(
     output_filename="adjacency",
     render_b_first=False,
 ):
+    import matplotlib.patches  # type: ignore
+    import matplotlib.pyplot as plt  # type: ignore
+
     #    try:
     adjacency_directions_list = list(dict(adjacency_directions).values())
     _figadj = plt.figure(
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""Reproducible end-to-end benchmarks over a samples XML file."""
+#Every sample and heuristic combination of an experiment (see wfc_run.py) is run with a
+# fixed seed in a fresh process, so that timings and the peak memory of one job are not
+# affected by the jobs before it. The results are written as a JSON baseline which later
+# runs can be compared against:
+#
+#   python wfc_benchmark.py -s samples/samples_reference.xml -o baseline.json
+#   python wfc_benchmark.py -s samples/samples_reference.xml -o new.json --compare baseline.json
+#
+#With --backend numba the same jobs run on the numba solver backend; comparing that run
+# with a numpy baseline reports the speedup of every job along with any regressions.
+from __future__ import annotations
+
+import argparse
+import importlib.metadata
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict
+import numpy as np
+import wfc_run
+
+BENCHMARK_FORMAT = "wfc-benchmark"
+BENCHMARK_FORMAT_VERSION = 1
+
+# Which way each compared metric should move, 1 if lower is better and -1 if higher is better.
+COMPARED_METRICS: Dict[str, int] = {
+    "preprocess_time": 1,
+    "solve_time": 1,
+    "cells_per_sec": -1,
+    "attempts": 1,
+    "backtracks": 1,
+    "peak_rss_bytes": 1,
+}
+TIMING_METRICS = ["preprocess_time", "solve_time", "cells_per_sec"]
+
+
+class BenchmarkJob(TypedDict):
+    key: str
+    name: str
+    image_folder: str
+    seed: int
+    tile_size: int
+    pattern_width: int
+    symmetry: int
+    ground: int
+    periodic_input: bool
+    periodic_output: bool
+    generated_size: Tuple[int, int]
+    allowed_attempts: int
+    loc: Literal["lexical", "hilbert", "spiral", "entropy", "anti-entropy", "simple", "random"]
+    choice: Literal["lexical", "rarest", "weighted", "random"]
+    backtracking: bool
+    global_constraint: Any
+    backend: Literal["numpy", "numba"]
+    propagate_threads: int
+
+
+def make_jobs(
+    samples: str,
+    run_experiment: str,
+    seed: int,
+    image_folder: str,
+    only: Optional[List[str]] = None,
+    backend: Literal["numpy", "numba"] = "numpy",
+    propagate_threads: int = 0,
+) -> List[BenchmarkJob]:
+    """One job per sample, heuristic combination and screenshot of the experiment."""
+    jobs: List[BenchmarkJob] = []
+    for job in wfc_run.make_jobs(samples, run_experiment, only):
+        sample, experiment = job["sample"], job["experiment"]
+        jobs.append(
+            {
+                "key": job["key"],
+                "name": sample["name"],
+                "image_folder": image_folder,
+                "seed": seed + job["screenshot"],
+                "tile_size": sample["tile_size"],
+                "pattern_width": sample["pattern_width"],
+                "symmetry": sample["symmetry"],
+                "ground": sample["ground"],
+                "periodic_input": sample["periodic_input"],
+                "periodic_output": sample["periodic_output"],
+                "generated_size": sample["generated_size"],
+                "allowed_attempts": sample["allowed_attempts"],
+                "loc": experiment["loc"],
+                "choice": experiment["choice"],
+                "backtracking": experiment["backtracking"],
+                "global_constraint": experiment["global_constraint"],
+                "backend": backend,
+                "propagate_threads": propagate_threads,
+            }
+        )
+    return jobs
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """The peak resident set size of this process, or None where it can not be measured."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_job(job: BenchmarkJob) -> Dict[str, Any]:
+    """Run one job and measure it, this is meant to run in a fresh process."""
+    import imageio  # type: ignore
+    import wfc.wfc_control as wfc_control
+    import wfc.wfc_numba as wfc_numba
+
+    attempt_stats: List[Dict[str, Any]] = []
+
+    def log_stats(stats: Dict[str, Any], _filename: str) -> None:
+        attempt_stats.append(dict(stats))
+
+    image = imageio.imread(os.path.join(job["image_folder"], job["name"] + ".png"))[:, :, :3]
+    warmup_time = None
+    if wfc_numba.resolve_backend(job["backend"]) == "numba":
+        # Every job runs in a fresh process: keep the one-off compilation out of the timings
+        warmup_time = wfc_numba.warm_up()
+    np.random.seed(job["seed"])
+    time_begin = time.perf_counter()
+    outcome = "success"
+    try:
+        wfc_control.execute_wfc(
+            image=image,
+            tile_size=job["tile_size"],
+            pattern_width=job["pattern_width"],
+            rotations=job["symmetry"],
+            output_size=job["generated_size"],
+            ground=job["ground"],
+            attempt_limit=job["allowed_attempts"],
+            output_periodic=job["periodic_output"],
+            input_periodic=job["periodic_input"],
+            loc_heuristic=job["loc"],
+            choice_heuristic=job["choice"],
+            backtracking=job["backtracking"],
+            global_constraint=job["global_constraint"],
+            log_stats_to_output=log_stats,
+            instrument=True,
+            backend=job["backend"],
+            propagate_threads=job["propagate_threads"],
+        )
+    except wfc_control.TimedOut:
+        outcome = "attempt limit"
+    except Exception as exc:
+        outcome = f"error: {exc!r}"
+    wall_time = time.perf_counter() - time_begin
+
+    result: Dict[str, Any] = {
+        "outcome": outcome,
+        "wall_time": wall_time,
+        "preprocess_time": None,
+        "solve_time": sum(s["solve duration"] for s in attempt_stats),
+        "cells_per_sec": None,
+        "attempts": len(attempt_stats),
+        "backtracks": sum(s.get("backtracks", 0) for s in attempt_stats),
+        "pattern_count": None,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "warmup_time": warmup_time,
+    }
+    if attempt_stats:
+        result["preprocess_time"] = attempt_stats[0]["time_adjacency"] - attempt_stats[0]["time_start"]
+        result["pattern_count"] = attempt_stats[0]["pattern count"]
+        last = attempt_stats[-1]
+        if last.get("outcome") == "success" and last["solve duration"] > 0:
+            width, height = job["generated_size"]
+            result["cells_per_sec"] = width * height / last["solve duration"]
+    return result
+
+
+def combine_repeats(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Take the median of the timings of repeated runs, the other fields are the same for a fixed seed."""
+    combined = dict(results[0])
+    for metric in TIMING_METRICS + ["wall_time"]:
+        values = [r[metric] for r in results if r[metric] is not None]
+        combined[metric] = statistics.median(values) if values else None
+    combined["peak_rss_bytes"] = max((r["peak_rss_bytes"] or 0) for r in results) or None
+    combined["repeats"] = len(results)
+    return combined
+
+
+def run_benchmark(jobs: List[BenchmarkJob], repeat: int = 1) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    context = multiprocessing.get_context("spawn")
+    # maxtasksperchild=1 gives every job a fresh process, which keeps peak RSS per job.
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for n, job in enumerate(jobs):
+            runs = [pool.apply(run_job, (job,)) for _ in range(repeat)]
+            results[job["key"]] = combine_repeats(runs)
+            result = results[job["key"]]
+            print(
+                f"[{n + 1}/{len(jobs)}] {job['key']}: {result['outcome']}, "
+                f"solve {result['solve_time']:.3f}s, attempts {result['attempts']}",
+                flush=True,
+            )
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numba": numba_version(),
+    }
+
+
+def numba_version() -> Optional[str]:
+    try:
+        return importlib.metadata.version("numba")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def speedups(baseline: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """The baseline's solve time over the current one, for the jobs that succeeded in both."""
+    ratios = {}
+    for key, result in current.items():
+        old = baseline.get(key)
+        if old is None or old["outcome"] != "success" or result["outcome"] != "success":
+            continue
+        if old["solve_time"] and result["solve_time"]:
+            ratios[key] = old["solve_time"] / result["solve_time"]
+    return ratios
+
+
+def compare_results(
+    baseline: Dict[str, Dict[str, Any]],
+    current: Dict[str, Dict[str, Any]],
+    threshold: float = 0.1,
+    min_time: float = 0.05,
+) -> List[str]:
+    """List the metrics that got worse than the baseline by more than the threshold (a fraction).
+
+    Timing changes smaller than min_time seconds are treated as noise.
+    """
+    regressions = []
+    for key, result in current.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        if old["outcome"] == "success" and result["outcome"] != "success":
+            regressions.append(f"{key}: outcome {old['outcome']} -> {result['outcome']}")
+            continue
+        for metric, direction in COMPARED_METRICS.items():
+            old_value, new_value = old.get(metric), result.get(metric)
+            if old_value is None or new_value is None:
+                continue
+            if metric in ("preprocess_time", "solve_time") and abs(new_value - old_value) < min_time:
+                continue
+            if direction > 0:
+                worse = new_value > old_value * (1 + threshold)
+            else:
+                worse = new_value < old_value / (1 + threshold)
+            if worse:
+                change = (new_value - old_value) / old_value if old_value else float("inf")
+                regressions.append(f"{key}: {metric} {old_value:.4g} -> {new_value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def load_baseline(filename: str) -> Dict[str, Any]:
+    with open(filename, encoding="utf_8") as baselinef:
+        baseline = json.load(baselinef)
+    if baseline.get("format") != BENCHMARK_FORMAT or baseline.get("version") != BENCHMARK_FORMAT_VERSION:
+        raise ValueError(f"{filename} is not a version {BENCHMARK_FORMAT_VERSION} benchmark baseline.")
+    return baseline
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Runs the samples with fixed seeds and records timings, attempts and peak memory.",
+    )
+    parser.add_argument(
+        "-s", "--samples",
+        type=str,
+        default="samples/samples_reference.xml",
+        metavar="XML_FILE",
+        help="An XML file with input data, defaults to samples/samples_reference.xml.",
+    )
+    parser.add_argument(
+        "-e", "--experiment",
+        type=str,
+        default="simple",
+        choices=["simple", "choice", "choices", "heuristic", "backtracking", "backtracking_heuristic"],
+        help="Which experiment grid of wfc_run.py to run, defaults to simple.",
+    )
+    parser.add_argument("--only", type=str, action="append", help="Only run samples with this name, can be repeated.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the first screenshot of each sample.")
+    parser.add_argument("--repeat", type=int, default=1, help="Run each job this many times and keep the median timings.")
+    parser.add_argument("--images", type=str, default="images/samples", help="The folder the sample images are in.")
+    parser.add_argument(
+        "--backend", type=str, default="numpy", choices=["numpy", "numba"], help="The solver backend, see wfc/wfc_numba.py."
+    )
+    parser.add_argument("--propagate-threads", type=int, default=0, help="Split each propagation pass over this many threads.")
+    parser.add_argument("-o", "--output", type=str, default="benchmark.json", help="Where to write the results.")
+    parser.add_argument("--compare", type=str, default=None, metavar="BASELINE", help="A previous results file to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Flag metrics that got worse by more than this fraction.")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Ignore timing changes smaller than this many seconds.")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.compare) if args.compare else None
+    jobs = make_jobs(
+        args.samples,
+        args.experiment,
+        args.seed,
+        args.images,
+        args.only,
+        backend=args.backend,
+        propagate_threads=args.propagate_threads,
+    )
+    results = run_benchmark(jobs, repeat=args.repeat)
+    with open(args.output, "w", encoding="utf_8") as outf:
+        json.dump(
+            {
+                "format": BENCHMARK_FORMAT,
+                "version": BENCHMARK_FORMAT_VERSION,
+                "samples": args.samples,
+                "experiment": args.experiment,
+                "seed": args.seed,
+                "backend": args.backend,
+                "propagate_threads": args.propagate_threads,
+                "environment": environment(),
+                "results": results,
+            },
+            outf,
+            indent=1,
+        )
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if baseline is not None:
+        if baseline["environment"] != environment():
+            print("Warning: the baseline was recorded in a different environment.")
+        missing = sorted(set(baseline["results"]) - set(results))
+        if missing:
+            print(f"{len(missing)} jobs of the baseline were not run.")
+        ratios = speedups(baseline["results"], results)
+        if baseline.get("backend", "numpy") != args.backend:
+            print(f"Comparing the {args.backend} backend with a {baseline.get('backend', 'numpy')} baseline.")
+        for key, ratio in ratios.items():
+            print(f"speedup {key}: {ratio:.2f}x")
+        if ratios:
+            print(f"Median solve time speedup {statistics.median(ratios.values()):.2f}x over {len(ratios)} jobs.")
+        regressions = compare_results(baseline["results"], results, args.threshold, args.min_time)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks of the solver, preprocessing and rendering kernels on synthetic models."""
+#Each kernel is timed in isolation while one parameter of a synthetic model is swept and
+# the others stay at their defaults:
+#
+#   patterns  the number of patterns
+#   size      the width and height of the output (and of the synthetic pattern grid)
+#   density   the fraction of pattern pairs that may be adjacent
+#
+#For every kernel and sweep the exponent of a power law fitted to the timings is reported,
+# e.g. ~2 over size for a kernel that is linear in the number of cells. Comparing the exponents with an
+# earlier run catches a kernel that went from O(n) to O(n^2) even when the absolute times
+# are still small:
+#
+#   python wfc_microbenchmark.py -o micro.json --plot-dir output
+#   python wfc_microbenchmark.py -o micro_new.json --compare micro.json
+#
+#The time to import the main modules in a fresh interpreter is recorded as well, since
+# every pool worker pays it; --imports-only skips the kernel sweeps.
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from wfc import wfc_numba, wfc_solver
+from wfc.wfc_adjacency import adjacency_extraction
+from wfc.wfc_model import CARDINAL_DIRECTIONS, WFCModel
+from wfc.wfc_patterns import pattern_grid_to_tiles
+from wfc.wfc_tiles import wave_to_average_image
+from wfc.wfc_utilities import hash_downto
+from wfc.wfc_visualize import tile_grid_to_average, tile_grid_to_image
+import wfc_benchmark
+
+MICROBENCHMARK_FORMAT = "wfc-microbenchmark"
+MICROBENCHMARK_FORMAT_VERSION = 1
+
+DEFAULTS: Dict[str, Any] = {"patterns": 64, "size": 32, "density": 0.2}
+SWEEPS: Dict[str, List[Any]] = {
+    "patterns": [16, 32, 64, 128, 256],
+    "size": [16, 32, 64, 128],
+    "density": [0.05, 0.1, 0.2, 0.4, 0.8],
+}
+IMPORTED_MODULES = ["wfc.wfc_solver", "wfc.wfc_model", "wfc.wfc_control", "wfc.wfc_visualize"]
+PATTERN_WIDTH = 2
+TILE_SIZE = 1
+TILES = 16
+
+
+def make_synthetic_model(patterns: int, density: float, rng: np.random.RandomState) -> WFCModel:
+    """A model with random patterns and a random adjacency of the given density.
+
+    Every pattern may be placed next to itself, so a wave filled with one pattern
+    is always a solution.  Opposite directions are kept consistent, as they are
+    in models extracted from images.
+    """
+    adjacency = np.zeros((len(CARDINAL_DIRECTIONS), patterns, patterns), dtype=np.bool_)
+    for d, (dx, dy) in enumerate(CARDINAL_DIRECTIONS):
+        opposite = CARDINAL_DIRECTIONS.index((-dx, -dy))
+        if opposite < d:
+            adjacency[d] = adjacency[opposite].T
+        else:
+            adjacency[d] = rng.random_sample((patterns, patterns)) < density
+            adjacency[d][np.diag_indices(patterns)] = True
+    return WFCModel(
+        pattern_ids=np.arange(patterns, dtype=np.int64),
+        pattern_contents=rng.randint(0, TILES, size=(patterns, PATTERN_WIDTH, PATTERN_WIDTH)).astype(np.int64),
+        weights=rng.randint(1, 10, size=patterns).astype(np.float64),
+        directions=np.array(CARDINAL_DIRECTIONS, dtype=np.int64),
+        adjacency=adjacency,
+        tile_ids=np.arange(TILES, dtype=np.int64),
+        tile_atlas=rng.randint(0, 256, size=(TILES, TILE_SIZE, TILE_SIZE, 3)).astype(np.uint8),
+    )
+
+
+def make_partial_wave(patterns: int, size: int, rng: np.random.RandomState) -> NDArray[np.bool_]:
+    """A wave halfway through a solve: some cells collapsed and the rest partly reduced."""
+    wave = rng.random_sample((patterns, size, size)) < 0.5
+    collapsed = rng.random_sample((size, size)) < 0.5
+    wave[:, collapsed] = False
+    wave[rng.randint(0, patterns, size=(size, size)), np.arange(size)[:, None], np.arange(size)[None, :]] = True
+    return wave
+
+
+class Case:
+    """The inputs the kernels are timed on, for one set of parameters."""
+
+    def __init__(self, patterns: int, size: int, density: float, seed: int = 0) -> None:
+        rng = np.random.RandomState(seed)
+        self.size = size
+        self.model = make_synthetic_model(patterns, density, rng)
+        self.adj = self.model.adjacency_matrices()
+        self.adj_lists = {
+            direction: [np.nonzero(row)[0].tolist() for row in self.model.adjacency[d]]
+            for d, direction in self.model.direction_offsets
+        }
+        self.empty_wave = np.ones((patterns, size, size), dtype=np.bool_)
+        self.wave = make_partial_wave(patterns, size, rng)
+        self.preferences = rng.random_sample((size, size)) * 0.1
+        self.solution = rng.randint(0, patterns, size=(size, size))
+        self.pattern_grid = self.model.pattern_ids[self.solution]
+        self.tile_grid = self.model.pattern_tiles[self.solution]
+        stack: np.ma.MaskedArray = np.ma.masked_array(
+            self.model.pattern_tiles[:, None, None] * np.ones((patterns, size, size), dtype=np.int64),
+            mask=~self.wave,
+        )
+        self.tile_stack = stack
+        self.hash_input = rng.randint(0, TILES, size=(size * size, PATTERN_WIDTH, PATTERN_WIDTH)).astype(np.int64)
+
+
+def time_propagate(case: Case) -> Callable[[], Any]:
+    i, j = case.size // 2, case.size // 2
+
+    def run() -> None:
+        wave = case.empty_wave.copy()
+        wave[:, i, j] = False
+        wave[0, i, j] = True
+        try:
+            wfc_solver.propagate(wave, case.adj, periodic=True)
+        except wfc_solver.Contradiction:
+            pass
+
+    return run
+
+
+def time_propagate_numba(case: Case) -> Callable[[], Any]:
+    i, j = case.size // 2, case.size // 2
+    propagator = wfc_numba.NumbaPropagator(case.adj, periodic=True)
+    wfc_numba.warm_up()
+
+    def run() -> None:
+        wave = case.empty_wave.copy()
+        wave[:, i, j] = False
+        wave[0, i, j] = True
+        try:
+            propagator(wave, [(i, j)])
+        except wfc_solver.Contradiction:
+            pass
+
+    return run
+
+
+def time_location(make_heuristic: Callable[[Case], Callable[[NDArray[np.bool_]], Tuple[int, int]]]):
+    def setup(case: Case) -> Callable[[], Any]:
+        heuristic = make_heuristic(case)
+        return lambda: heuristic(case.wave)
+
+    return setup
+
+
+def time_pattern(make_heuristic: Callable[[NDArray[np.floating[Any]]], Callable[[NDArray[np.bool_], NDArray[np.bool_]], int]]):
+    def setup(case: Case) -> Callable[[], Any]:
+        heuristic = make_heuristic(case.model.weights)
+        i, j = np.unravel_index(np.argmax(case.wave.sum(axis=0)), case.wave.shape[1:])
+        return lambda: heuristic(case.wave[:, i, j], case.wave)
+
+    return setup
+
+
+def time_observe(case: Case) -> Callable[[], Any]:
+    location_heuristic = wfc_solver.makeEntropyLocationHeuristic(case.preferences)
+    pattern_heuristic = wfc_solver.makeWeightedPatternHeuristic(case.model.weights)
+    return lambda: wfc_solver.observe(case.wave, location_heuristic, pattern_heuristic)
+
+
+def time_adjacency_extraction(case: Case) -> Callable[[], Any]:
+    pattern_catalog = case.model.pattern_catalog
+    return lambda: adjacency_extraction(
+        case.pattern_grid, pattern_catalog, case.model.direction_offsets, (PATTERN_WIDTH, PATTERN_WIDTH)
+    )
+
+
+def time_pattern_grid_to_tiles(case: Case) -> Callable[[], Any]:
+    pattern_catalog = case.model.pattern_catalog
+    return lambda: pattern_grid_to_tiles(case.pattern_grid, pattern_catalog)
+
+
+def time_tile_grid_to_image(case: Case) -> Callable[[], Any]:
+    tile_catalog = case.model.tile_catalog
+    return lambda: tile_grid_to_image(case.tile_grid, tile_catalog, (TILE_SIZE, TILE_SIZE))
+
+
+def time_tile_grid_to_average(case: Case) -> Callable[[], Any]:
+    tile_catalog = case.model.tile_catalog
+    return lambda: tile_grid_to_average(case.tile_stack, tile_catalog, (TILE_SIZE, TILE_SIZE))
+
+
+# Kernel name, the function that prepares the timed call, and the largest parameter values
+# worth timing it at (adjacency_extraction is quadratic in the pattern count by design).
+KERNELS: List[Tuple[str, Callable[[Case], Callable[[], Any]], Dict[str, Any]]] = [
+    ("propagate", time_propagate, {}),
+    ("observe", time_observe, {}),
+    ("location/lexical", time_location(lambda case: wfc_solver.lexicalLocationHeuristic), {}),
+    ("location/simple", time_location(lambda case: wfc_solver.simpleLocationHeuristic), {}),
+    ("location/entropy", time_location(lambda case: wfc_solver.makeEntropyLocationHeuristic(case.preferences)), {}),
+    ("location/anti-entropy", time_location(lambda case: wfc_solver.makeAntiEntropyLocationHeuristic(case.preferences)), {}),
+    ("location/random", time_location(lambda case: wfc_solver.makeRandomLocationHeuristic(case.preferences)), {}),
+    ("location/spiral", time_location(lambda case: wfc_solver.makeSpiralLocationHeuristic(case.preferences.copy())), {}),
+    ("location/hilbert", time_location(lambda case: wfc_solver.makeHilbertLocationHeuristic(case.preferences.copy())), {}),
+    ("pattern/lexical", time_pattern(lambda weights: wfc_solver.lexicalPatternHeuristic), {}),
+    ("pattern/weighted", time_pattern(wfc_solver.makeWeightedPatternHeuristic), {}),
+    ("pattern/random", time_pattern(wfc_solver.makeRandomPatternHeuristic), {}),
+    ("pattern/rarest", time_pattern(wfc_solver.makeRarestPatternHeuristic), {}),
+    ("pattern/most common", time_pattern(wfc_solver.makeMostCommonPatternHeuristic), {}),
+    ("makeAdj", lambda case: lambda: wfc_solver.makeAdj(case.adj_lists), {}),
+    ("adjacency_extraction", time_adjacency_extraction, {"patterns": 128}),
+    ("hash_downto", lambda case: lambda: hash_downto(case.hash_input, 1), {}),
+    ("render/solution_to_image", lambda case: lambda: case.model.solution_to_image(case.solution), {}),
+    ("render/wave_to_average_image", lambda case: lambda: wave_to_average_image(case.wave, case.model.pattern_tile_indices, case.model.tile_atlas), {}),
+    ("render/pattern_grid_to_tiles", time_pattern_grid_to_tiles, {}),
+    ("render/tile_grid_to_image", time_tile_grid_to_image, {}),
+    ("render/tile_grid_to_average", time_tile_grid_to_average, {}),
+]
+if wfc_numba.HAVE_NUMBA:
+    KERNELS += [
+        ("numba/propagate", time_propagate_numba, {}),
+        ("numba/location/entropy", time_location(lambda case: wfc_numba.makeEntropyLocationHeuristic(case.preferences)), {}),
+    ]
+
+
+def measure(call: Callable[[], Any], repeat: int = 3) -> float:
+    """Seconds per call, the best of repeat rounds of enough calls to take about 0.2 seconds."""
+    timer = timeit.Timer(call)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def fit_exponent(values: List[float], times: List[float]) -> Optional[float]:
+    """The exponent k of the power law time ~ value**k that fits the timings best."""
+    if len(values) < 2:
+        return None
+    return float(np.polyfit(np.log(values), np.log(times), 1)[0])
+
+
+def run_sweep(sweep: str, kernels: List[Tuple[str, Callable[[Case], Callable[[], Any]], Dict[str, Any]]], repeat: int, seed: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for value in SWEEPS[sweep]:
+        params = dict(DEFAULTS)
+        params[sweep] = value
+        case = Case(params["patterns"], params["size"], params["density"], seed=seed)
+        for name, setup, limits in kernels:
+            if sweep in limits and value > limits[sweep]:
+                continue
+            np.random.seed(seed)
+            seconds = measure(setup(case), repeat=repeat)
+            kernel = results.setdefault(name, {"values": [], "times": []})
+            kernel["values"].append(value)
+            kernel["times"].append(seconds)
+            print(f"{sweep}={value} {name}: {seconds * 1e6:.1f}us", flush=True)
+    for kernel in results.values():
+        kernel["exponent"] = fit_exponent(kernel["values"], kernel["times"])
+    return results
+
+
+def measure_import_time(module: str, repeat: int = 5) -> float:
+    """Seconds to import the module in a fresh interpreter, including its dependencies, best of repeat."""
+    best = float("inf")
+    for _ in range(repeat):
+        importtime = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stderr
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        for line in importtime.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                best = min(best, int(fields[1]) / 1e6)
+    return best
+
+
+def plot_sweeps(sweeps: Dict[str, Dict[str, Any]], plot_dir: str) -> None:
+    import matplotlib  # type: ignore
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt  # type: ignore
+
+    os.makedirs(plot_dir, exist_ok=True)
+    for sweep, results in sweeps.items():
+        fig, ax = plt.subplots(figsize=(10, 7))
+        for name, kernel in results.items():
+            ax.loglog(kernel["values"], kernel["times"], marker="o", label=f"{name} (k={kernel['exponent']:.2f})")
+        ax.set_xlabel(sweep)
+        ax.set_ylabel("seconds per call")
+        ax.set_title(f"Kernel scaling with {sweep}, others at {', '.join(f'{k}={v}' for k, v in DEFAULTS.items() if k != sweep)}")
+        ax.legend(fontsize="small", ncol=2)
+        fig.savefig(os.path.join(plot_dir, f"microbenchmark_{sweep}.png"), dpi=100, bbox_inches="tight")
+        plt.close(fig)
+
+
+def compare_exponents(
+    baseline: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]], max_increase: float = 0.5
+) -> List[str]:
+    """List the kernels whose fitted exponent grew by more than max_increase."""
+    regressions = []
+    for sweep, results in current.items():
+        for name, kernel in results.items():
+            old = baseline.get(sweep, {}).get(name)
+            if old is None or old["exponent"] is None or kernel["exponent"] is None:
+                continue
+            if kernel["exponent"] > old["exponent"] + max_increase:
+                regressions.append(
+                    f"{name} over {sweep}: exponent {old['exponent']:.2f} -> {kernel['exponent']:.2f}"
+                )
+    return regressions
+
+
+def compare_imports(baseline: Dict[str, float], current: Dict[str, float], max_increase: float = 0.5, min_time: float = 0.05) -> List[str]:
+    """List the modules whose import got slower by more than the max_increase fraction and min_time seconds."""
+    regressions = []
+    for module, seconds in current.items():
+        old = baseline.get(module)
+        if old is not None and seconds > old * (1 + max_increase) and seconds - old > min_time:
+            regressions.append(f"import {module}: {old:.3f}s -> {seconds:.3f}s")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Times the WFC kernels on synthetic models and fits scaling curves.")
+    parser.add_argument("--sweep", type=str, action="append", choices=list(SWEEPS), help="Only run this sweep, can be repeated.")
+    parser.add_argument("--kernel", type=str, action="append", help="Only time kernels whose name starts with this, can be repeated.")
+    parser.add_argument("--repeat", type=int, default=3, help="Keep the best of this many rounds.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str, default="microbenchmark.json", help="Where to write the results.")
+    parser.add_argument("--plot-dir", type=str, default=None, help="Write a log-log plot per sweep to this folder.")
+    parser.add_argument("--compare", type=str, default=None, metavar="BASELINE", help="A previous results file to compare with.")
+    parser.add_argument("--max-exponent-increase", type=float, default=0.5, help="Flag kernels whose exponent grew by more than this.")
+    parser.add_argument("--imports-only", action="store_true", help="Only measure the module import times.")
+    parser.add_argument("--max-import-increase", type=float, default=0.5, help="Flag imports that got slower by more than this fraction.")
+    args = parser.parse_args()
+
+    imports = {module: measure_import_time(module) for module in IMPORTED_MODULES}
+    for module, seconds in imports.items():
+        print(f"import {module}: {seconds:.3f}s")
+    kernels = [k for k in KERNELS if not args.kernel or any(k[0].startswith(prefix) for prefix in args.kernel)]
+    sweeps = {}
+    if not args.imports_only:
+        sweeps = {sweep: run_sweep(sweep, kernels, args.repeat, args.seed) for sweep in (args.sweep or list(SWEEPS))}
+    with open(args.output, "w", encoding="utf_8") as outf:
+        json.dump(
+            {
+                "format": MICROBENCHMARK_FORMAT,
+                "version": MICROBENCHMARK_FORMAT_VERSION,
+                "defaults": DEFAULTS,
+                "environment": wfc_benchmark.environment(),
+                "imports": imports,
+                "sweeps": sweeps,
+            },
+            outf,
+            indent=1,
+        )
+    print(f"Wrote {args.output}")
+    for sweep, results in sweeps.items():
+        for name, kernel in results.items():
+            print(f"{sweep:>8} {name:<32} exponent {kernel['exponent']:.2f}")
+    if args.plot_dir:
+        plot_sweeps(sweeps, args.plot_dir)
+
+    if args.compare:
+        with open(args.compare, encoding="utf_8") as baselinef:
+            baseline = json.load(baselinef)
+        if baseline.get("format") != MICROBENCHMARK_FORMAT or baseline.get("version") != MICROBENCHMARK_FORMAT_VERSION:
+            raise ValueError(f"{args.compare} is not a version {MICROBENCHMARK_FORMAT_VERSION} micro-benchmark file.")
+        regressions = compare_imports(baseline["imports"], imports, args.max_import_increase)
+        regressions += compare_exponents(baseline["sweeps"], sweeps, args.max_exponent_increase)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No complexity regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,17 @@
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
 import datetime
+import hashlib
+import json
 import logging
-from typing import List, Literal, TypedDict, Union
+import tempfile
+import time
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict, Union
+import numpy as np
 import wfc.wfc_control as wfc_control
+from wfc.wfc_model import WFCModel, compile_model
 import xml.etree.ElementTree as ET
 import os
 
@@ -28,12 +35,27 @@ def string2bool(strn: Union[bool, str]) -> bool:
     return strn.lower() in ["true"]
 
 
-def run_default(run_experiment: str = "simple", samples: str = "samples_reference.xml") -> None:
-    log_filename = f"log_{datetime.datetime.now().isoformat()}".replace(":", ".")
+class SampleParameters(TypedDict):
+    name: str
+    tile_size: int
+    pattern_width: int
+    symmetry: int
+    ground: int
+    periodic_input: bool
+    periodic_output: bool
+    generated_size: Tuple[int, int]
+    screenshots: int
+    iteration_limit: int
+    allowed_attempts: int
+    backtracking: bool
+
+
+def read_samples(samples: str) -> List[SampleParameters]:
+    """Read the overlapping model entries of a samples XML file."""
     xdoc = ET.ElementTree(file=samples)
     default_allowed_attempts = 10
     default_backtracking = str(False)
-    log_stats_to_output = wfc_control.make_log_stats()
+    sample_list: List[SampleParameters] = []
 
     for xnode in xdoc.getroot():
         name = xnode.get("name", "NAME")
@@ -64,271 +86,617 @@ def run_default(run_experiment: str = "simple", samples: str = "samples_referenc
                 xnode.get("allowed_attempts", default_allowed_attempts)
             )  # Give up after this many contradictions
             backtracking = string2bool(xnode.get("backtracking", default_backtracking))
-            visualize_experiment = False
-
-            run_instructions: List[RunInstructions] = [  # simple
+            sample_list.append(
                 {
-                    "loc": "entropy",
-                    "choice": "weighted",
+                    "name": name,
+                    "tile_size": tile_size,
+                    "pattern_width": pattern_width,
+                    "symmetry": symmetry,
+                    "ground": ground,
+                    "periodic_input": periodic_input,
+                    "periodic_output": periodic_output,
+                    "generated_size": generated_size,
+                    "screenshots": screenshots,
+                    "iteration_limit": iteration_limit,
+                    "allowed_attempts": allowed_attempts,
                     "backtracking": backtracking,
-                    "global_constraint": False,
                 }
-            ]
-            # run_instructions = [{"loc": "entropy", "choice": "weighted", "backtracking": True, "global_constraint": "allpatterns"}]
-            if run_experiment == "choice":
-                run_instructions = [
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "random",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "random",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "random",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": "allpatterns",
-                    },
-                ]
-            if run_experiment == "heuristic":
-                run_instructions = [
-                    {
-                        "loc": "hilbert",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "spiral",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "anti-entropy",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "simple",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "weighted",
-                        "backtracking": backtracking,
-                        "global_constraint": False,
-                    },
-                ]
-            if run_experiment == "backtracking":
-                run_instructions = [
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                ]
-            if run_experiment == "backtracking_heuristic":
-                run_instructions = [
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "lexical",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": "allpatterns",
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "weighted",
-                        "backtracking": True,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "random",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                ]
-            if run_experiment == "choices":
-                run_instructions = [
-                    {
-                        "loc": "entropy",
-                        "choice": "rarest",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "weighted",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                    {
-                        "loc": "entropy",
-                        "choice": "random",
-                        "backtracking": False,
-                        "global_constraint": False,
-                    },
-                ]
-
-            for experiment in run_instructions:
-                for x in range(screenshots):
-                    print(f"-: {name} > {x}")
-                    try:
-                        solution = wfc_control.execute_wfc(
-                            name,
-                            tile_size=tile_size,
-                            pattern_width=pattern_width,
-                            rotations=symmetry,
-                            output_size=generated_size,
-                            ground=ground,
-                            attempt_limit=allowed_attempts,
-                            output_periodic=periodic_output,
-                            input_periodic=periodic_input,
-                            loc_heuristic=experiment["loc"],
-                            choice_heuristic=experiment["choice"],
-                            backtracking=experiment["backtracking"],
-                            global_constraint=experiment["global_constraint"],
-                            log_filename=log_filename,
-                            log_stats_to_output=log_stats_to_output,
-                            visualize=visualize_experiment,
-                            logging=True,
-                        )
-                        print(solution)
-                    except Exception as exc:
-                        print(f"Skipped because: {exc}")
-
-            if False:  # These are included for my colab experiments, remove them if you're not me
-                os.system(
-                    'cp -rf "/content/wfc/output/*.tsv" "/content/drive/My Drive/wfc_exper/2"'
-                )
-                os.system(
-                    'cp -r "/content/wfc/output" "/content/drive/My Drive/wfc_exper/2"'
-                )
+            )
+    return sample_list
+
+
+def make_run_instructions(run_experiment: str, backtracking: bool) -> List[RunInstructions]:
+    """The heuristic combinations that each sample is run with in an experiment."""
+    run_instructions: List[RunInstructions] = [  # simple
+        {
+            "loc": "entropy",
+            "choice": "weighted",
+            "backtracking": backtracking,
+            "global_constraint": False,
+        }
+    ]
+    # run_instructions = [{"loc": "entropy", "choice": "weighted", "backtracking": True, "global_constraint": "allpatterns"}]
+    if run_experiment == "choice":
+        run_instructions = [
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "random",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+            {
+                "loc": "lexical",
+                "choice": "random",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "random",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "random",
+                "choice": "random",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": False,
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": "allpatterns",
+            },
+        ]
+    if run_experiment == "heuristic":
+        run_instructions = [
+            {
+                "loc": "hilbert",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "spiral",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "anti-entropy",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "simple",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+            {
+                "loc": "random",
+                "choice": "weighted",
+                "backtracking": backtracking,
+                "global_constraint": False,
+            },
+        ]
+    if run_experiment == "backtracking":
+        run_instructions = [
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+        ]
+    if run_experiment == "backtracking_heuristic":
+        run_instructions = [
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": False,
+            },
+            {
+                "loc": "lexical",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+            {
+                "loc": "random",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "random",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": "allpatterns",
+            },
+            {
+                "loc": "random",
+                "choice": "weighted",
+                "backtracking": True,
+                "global_constraint": False,
+            },
+            {
+                "loc": "random",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+        ]
+    if run_experiment == "choices":
+        run_instructions = [
+            {
+                "loc": "entropy",
+                "choice": "rarest",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "weighted",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+            {
+                "loc": "entropy",
+                "choice": "random",
+                "backtracking": False,
+                "global_constraint": False,
+            },
+        ]
+    return run_instructions
+
+
+class RunJob(TypedDict):
+    key: str
+    index: int
+    sample: SampleParameters
+    experiment: RunInstructions
+    screenshot: int
+
+
+class JobResult(TypedDict):
+    key: str
+    outcome: str
+    duration: float
+    log_rows: List[Tuple[Dict[str, Any], str]]
+
+
+def make_jobs(samples: str, run_experiment: str, only: Optional[List[str]] = None) -> List[RunJob]:
+    """One job per sample, heuristic combination and screenshot of the experiment, in file order."""
+    jobs: List[RunJob] = []
+    keys = set()
+    for sample in read_samples(samples):
+        if only and sample["name"] not in only:
+            continue
+        for experiment in make_run_instructions(run_experiment, sample["backtracking"]):
+            for x in range(sample["screenshots"]):
+                width, height = sample["generated_size"]
+                key = f"{sample['name']} N={sample['pattern_width']} {width}x{height} {experiment['loc']}/{experiment['choice']}"
+                if experiment["backtracking"]:
+                    key += " backtracking"
+                if experiment["global_constraint"]:
+                    key += f" {experiment['global_constraint']}"
+                key += f" #{x}"
+                while key in keys:  # The same entry listed twice in the samples file
+                    key += "'"
+                keys.add(key)
+                jobs.append({"key": key, "index": len(jobs), "sample": sample, "experiment": experiment, "screenshot": x})
+    return jobs
+
+
+def model_key(sample: SampleParameters) -> str:
+    """Samples with the same key share one compiled model, whatever their output size and attempts.
+
+    Whether the output wraps is part of it, as only models for periodic
+    outputs are pruned.
+    """
+    return (
+        f"{sample['name']} tile_size={sample['tile_size']} N={sample['pattern_width']} symmetry={sample['symmetry']} "
+        f"ground={sample['ground']} periodic={sample['periodic_input']} periodic_output={sample['periodic_output']}"
+    )
+
+
+def compile_sample_model(sample: SampleParameters, image_folder: str = "images/samples") -> WFCModel:
+    import imageio  # type: ignore
+
+    image = imageio.imread(os.path.join(image_folder, sample["name"] + ".png"))[:, :, :3]
+    return compile_model(
+        image,
+        tile_size=sample["tile_size"],
+        pattern_width=sample["pattern_width"],
+        rotations=sample["symmetry"] - 1,
+        input_periodic=sample["periodic_input"],
+        ground=sample["ground"],
+        metadata={"filename": sample["name"]},
+        output_periodic=sample["periodic_output"],
+    )
+
+
+def run_job(
+    job: RunJob,
+    model: WFCModel,
+    log_filename: str,
+    instrument: bool = False,
+    time_limit: Optional[float] = None,
+    seed: Optional[int] = None,
+) -> JobResult:
+    """Solve one job with a compiled model, collecting its log rows instead of writing them."""
+    sample = job["sample"]
+    experiment = job["experiment"]
+    log_rows: List[Tuple[Dict[str, Any], str]] = []
+
+    def collect_stats(stats: Dict[str, Any], filename: str) -> None:
+        log_rows.append((dict(stats), filename))
+
+    if seed is not None:
+        np.random.seed(seed + job["index"])
+    time_begin = time.perf_counter()
+    outcome = "success"
+    try:
+        wfc_control.execute_wfc(
+            sample["name"],
+            model=model,
+            output_size=sample["generated_size"],
+            attempt_limit=sample["allowed_attempts"],
+            output_periodic=sample["periodic_output"],
+            loc_heuristic=experiment["loc"],
+            choice_heuristic=experiment["choice"],
+            backtracking=experiment["backtracking"],
+            global_constraint=experiment["global_constraint"],
+            log_filename=log_filename,
+            log_stats_to_output=collect_stats,
+            visualize=False,
+            logging=True,
+            instrument=instrument,
+            time_limit=time_limit,
+        )
+    except Exception as exc:
+        outcome = f"Skipped because: {exc}"
+    return {"key": job["key"], "outcome": outcome, "duration": time.perf_counter() - time_begin, "log_rows": log_rows}
+
+
+_worker_models: Dict[str, WFCModel] = {}
+
+
+def run_pooled_job(
+    job: RunJob,
+    model_path: str,
+    log_filename: str,
+    instrument: bool = False,
+    time_limit: Optional[float] = None,
+    seed: Optional[int] = None,
+) -> JobResult:
+    """run_job in a worker process, which memory-maps each saved model once."""
+    if model_path not in _worker_models:
+        _worker_models[model_path] = WFCModel.load(model_path, mmap=True)
+    if seed is None:
+        # Forked workers start with the same random state, draw a fresh one for every job.
+        np.random.seed()
+    return run_job(job, _worker_models[model_path], log_filename, instrument, time_limit, seed)
+
+
+RUN_MANIFEST_FORMAT = "wfc-run"
+RUN_MANIFEST_VERSION = 1
+
+
+def write_atomically(filename: str, text: str) -> None:
+    """Replace the file in one step, so that it is never seen (or left) half written."""
+    temporary = filename + ".tmp"
+    with open(temporary, "w", encoding="utf_8") as outf:
+        outf.write(text)
+        outf.flush()
+        os.fsync(outf.fileno())
+    os.replace(temporary, filename)
+
+
+def job_id(job: RunJob, instrument: bool, time_limit: Optional[float], seed: Optional[int]) -> str:
+    """Identifies a job by everything its result depends on, so edits to the samples file rerun only what changed."""
+    identity = {
+        "sample": job["sample"],
+        "experiment": job["experiment"],
+        "screenshot": job["screenshot"],
+        "seed": None if seed is None else seed + job["index"],
+        "instrument": instrument,
+        "time_limit": time_limit,
+    }
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode("utf_8")).hexdigest()[:16]
+
+
+class RunManifest:
+    """The finished jobs of a run, kept in a folder so that an interrupted run can be resumed.
+
+    Every finished job is written to jobs/<id>.json and then listed in
+    manifest.json, both atomically.  log.tsv is rebuilt from the job files in
+    job order when the run starts and ends, and appended to in between.
+    """
+
+    def __init__(self, run_folder: str) -> None:
+        self.run_folder = run_folder
+        self.filename = os.path.join(run_folder, "manifest.json")
+        self.log_filename = os.path.join(run_folder, "log.tsv")
+        self.completed: Dict[str, Dict[str, str]] = {}
+        os.makedirs(os.path.join(run_folder, "jobs"), exist_ok=True)
+        if os.path.exists(self.filename):
+            with open(self.filename, encoding="utf_8") as manifestf:
+                manifest = json.load(manifestf)
+            if manifest.get("format") != RUN_MANIFEST_FORMAT or manifest.get("version") != RUN_MANIFEST_VERSION:
+                raise ValueError(f"{self.filename} is not a version {RUN_MANIFEST_VERSION} run manifest.")
+            self.completed = {
+                id_: entry
+                for id_, entry in manifest["completed"].items()
+                if os.path.exists(self.result_filename(id_))
+            }
+
+    def result_filename(self, id_: str) -> str:
+        return os.path.join(self.run_folder, "jobs", id_ + ".json")
+
+    def is_complete(self, id_: str) -> bool:
+        return id_ in self.completed
+
+    def add(self, id_: str, result: JobResult) -> None:
+        # TSV values are written with str() anyway, and that keeps the numpy scalars JSON-safe.
+        stored = dict(result, log_rows=[({k: str(v) for k, v in row.items()}, f) for row, f in result["log_rows"]])
+        write_atomically(self.result_filename(id_), json.dumps(stored))
+        self.completed[id_] = {"key": result["key"], "outcome": result["outcome"]}
+        write_atomically(
+            self.filename,
+            json.dumps(
+                {"format": RUN_MANIFEST_FORMAT, "version": RUN_MANIFEST_VERSION, "completed": self.completed},
+                indent=1,
+            ),
+        )
+
+    def load_result(self, id_: str) -> JobResult:
+        with open(self.result_filename(id_), encoding="utf_8") as resultf:
+            return json.load(resultf)
+
+    def write_log(self, ids: List[str]) -> None:
+        """Rebuild log.tsv from the results of the completed jobs among ids, in that order.
+
+        Without any such results there is no log.tsv, so that rows of jobs no
+        longer in the run are not kept.
+        """
+        temporary = self.log_filename + ".rebuild"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        log_stats = wfc_control.make_log_stats()
+        for id_ in ids:
+            if self.is_complete(id_):
+                for stats, _filename in self.load_result(id_)["log_rows"]:
+                    log_stats(stats, temporary)
+        if os.path.exists(temporary):
+            os.replace(temporary, self.log_filename)
+        elif os.path.exists(self.log_filename):
+            os.remove(self.log_filename)
+
+
+def run_jobs(
+    jobs: List[RunJob],
+    log_filename: str,
+    workers: int = 1,
+    instrument: bool = False,
+    time_limit: Optional[float] = None,
+    seed: Optional[int] = None,
+    image_folder: str = "images/samples",
+    manifest: Optional[RunManifest] = None,
+) -> List[JobResult]:
+    """Run the jobs on a pool of worker processes and write all their log rows to one TSV.
+
+    Each sample's model is compiled once, in this process, and saved for the
+    workers to memory-map.  The workers only return their log rows, which are
+    written here as the jobs finish, so rows never interleave.  With one worker
+    the jobs run in this process, in order.
+
+    With a manifest, the jobs it lists as complete are skipped and every job
+    that runs to the end is added to it, and the TSV is the manifest's.
+    """
+    ids = {job["key"]: job_id(job, instrument, time_limit, seed) for job in jobs}
+    if manifest is not None:
+        done = [job for job in jobs if manifest.is_complete(ids[job["key"]])]
+        if done:
+            print(f"Skipping {len(done)} jobs that are already in the manifest.")
+        manifest.write_log([ids[job["key"]] for job in jobs])
+        jobs = [job for job in jobs if not manifest.is_complete(ids[job["key"]])]
+    log_stats_to_output = wfc_control.make_log_stats(
+        header_written=manifest is not None and os.path.exists(manifest.log_filename)
+    )
+    results: List[JobResult] = []
+    time_begin = time.perf_counter()
+
+    def report(result: JobResult, finished: bool = True) -> None:
+        results.append(result)
+        if manifest is not None and finished:
+            manifest.add(ids[result["key"]], result)
+        for stats, filename in result["log_rows"]:
+            log_stats_to_output(stats, manifest.log_filename if manifest is not None else filename)
+        elapsed = time.perf_counter() - time_begin
+        remaining = elapsed / len(results) * (len(jobs) - len(results))
+        print(
+            f"[{len(results)}/{len(jobs)}] {result['key']}: {result['outcome']} "
+            f"({result['duration']:.1f}s, {elapsed:.0f}s elapsed, ~{remaining:.0f}s left)",
+            flush=True,
+        )
+
+    def skipped(job: RunJob, exc: BaseException) -> JobResult:
+        return {"key": job["key"], "outcome": f"Skipped because: {exc}", "duration": 0.0, "log_rows": []}
+
+    all_ids = list(ids.values())
+
+    with tempfile.TemporaryDirectory(prefix="wfc_models_") as model_folder:
+        models: Dict[str, WFCModel] = {}
+        model_paths: Dict[str, str] = {}
+        build_errors: Dict[str, Exception] = {}
+        for job in jobs:
+            key = model_key(job["sample"])
+            if key in models or key in model_paths or key in build_errors:
+                continue
+            try:
+                model = compile_sample_model(job["sample"], image_folder)
+            except Exception as exc:
+                build_errors[key] = exc
+                continue
+            if workers > 1:
+                model_path = os.path.join(model_folder, str(len(model_paths)))
+                model.save(model_path)
+                model_paths[key] = model_path
+            else:
+                models[key] = model
+
+        if workers <= 1:
+            for job in jobs:
+                key = model_key(job["sample"])
+                if key in build_errors:
+                    report(skipped(job, build_errors[key]), finished=False)
+                else:
+                    report(run_job(job, models[key], log_filename, instrument, time_limit, seed))
+            if manifest is not None:
+                manifest.write_log(all_ids)
+            return results
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for job in jobs:
+                key = model_key(job["sample"])
+                if key in build_errors:
+                    report(skipped(job, build_errors[key]), finished=False)
+                    continue
+                future = pool.submit(run_pooled_job, job, model_paths[key], log_filename, instrument, time_limit, seed)
+                futures[future] = job
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    report(future.result())
+                except Exception as exc:  # e.g. a worker killed for running out of memory
+                    report(skipped(futures[future], exc), finished=False)
+    if manifest is not None:
+        manifest.write_log(all_ids)
+    return results
+
+
+def run_default(
+    run_experiment: str = "simple",
+    samples: str = "samples_reference.xml",
+    instrument: bool = False,
+    workers: int = 1,
+    time_limit: Optional[float] = None,
+    seed: Optional[int] = None,
+    only: Optional[List[str]] = None,
+    run_folder: Optional[str] = None,
+) -> None:
+    log_filename = f"log_{datetime.datetime.now().isoformat()}".replace(":", ".")
+    manifest = RunManifest(run_folder) if run_folder else None
+    jobs = make_jobs(samples, run_experiment, only)
+    results = run_jobs(
+        jobs,
+        log_filename,
+        workers=workers,
+        instrument=instrument,
+        time_limit=time_limit,
+        seed=seed,
+        manifest=manifest,
+    )
+    succeeded = sum(result["outcome"] == "success" for result in results)
+    print(f"{succeeded} of {len(results)} jobs succeeded.")
+
+    if False:  # These are included for my colab experiments, remove them if you're not me
+        os.system(
+            'cp -rf "/content/wfc/output/*.tsv" "/content/drive/My Drive/wfc_exper/2"'
+        )
+        os.system(
+            'cp -r "/content/wfc/output" "/content/drive/My Drive/wfc_exper/2"'
+        )
+
 
 def main() -> None:
     logging.basicConfig(level=logging.DEBUG)
@@ -350,8 +718,44 @@ def main() -> None:
         default="samples_reference.xml",
         help="An XML file with input data.  If unsure then use '-s samples_reference.xml'",
     )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="Add per-phase solver timings and counters to the TSV log.",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Run this many jobs at once, each in its own process.  Defaults to 1, in this process.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Give up on a job (all of its attempts) after this long.",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Seed job n with SEED + n, for reproducible runs.")
+    parser.add_argument("--only", type=str, action="append", help="Only run samples with this name, can be repeated.")
+    parser.add_argument(
+        "--run-dir",
+        type=str,
+        default=None,
+        metavar="FOLDER",
+        help="Keep a manifest and per-job results here, and skip the jobs already done when run again.",
+    )
     args = parser.parse_args()
-    run_default(run_experiment=args.experiment, samples=args.samples)
+    run_default(
+        run_experiment=args.experiment,
+        samples=args.samples,
+        instrument=args.instrument,
+        workers=args.jobs,
+        time_limit=args.timeout,
+        seed=args.seed,
+        only=args.only,
+        run_folder=args.run_dir,
+    )
 
 
 if __name__ == "__main__":